@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure the per-sound cost of building the converter command arguments.
+
+Prepares the m4r command from the default config the way the converter does,
+then times the final token substitution for each sound both ways: calling
+eval_finalize on every stage element, and filling in templates compiled once
+with compile_finalize. Run it with "make bench", or directly with Python
+from anywhere.
+
+"""
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                       "quakesounds_src")
+sys.path.insert(0, src_dir)
+import config
+
+SOUNDS = 1000
+REPEAT = 5
+
+cfg_path = os.path.join(src_dir, "res", "default.cfg")
+with open(cfg_path, 'r') as instream:
+    default_cfg = instream.read().replace("%UTILITY_PATH%", "%qs_internal%")
+cfg_table = {}
+config.read_properties(default_cfg.splitlines(), cfg_table, lambda x: None)
+settings = config.Settings(cfg_table, {'qs_home': "/qs/",
+                                       'qs_working_dir': "/qs/",
+                                       'qs_internal': "/tmp/qs_internal/"})
+var_names = ('sound_name', 'sound_input', 'sound_index', 'write_to')
+command = settings.eval_prep('m4r', var_names)
+command_stages = [[a.strip() for a in s.split(",")]
+                  for s in command.split("|")]
+stage_templates = [[settings.compile_finalize('m4r', a, var_names)
+                    for a in stage_args]
+                   for stage_args in command_stages]
+var_tables = [{'sound_name': "sound/items/sound{0}".format(n),
+               'write_to': "%write_to%",
+               'sound_input': "%sound_input%",
+               'sound_index': "%sound_index%"}
+              for n in range(SOUNDS)]
+
+def eval_each():
+    for var_table in var_tables:
+        for stage_args in command_stages:
+            [settings.eval_finalize('m4r', a, var_table) for a in stage_args]
+
+def fill_templates():
+    for var_table in var_tables:
+        for templates in stage_templates:
+            [t.fill(var_table) for t in templates]
+
+for var_table in var_tables[:3]:
+    assert ([[settings.eval_finalize('m4r', a, var_table) for a in stage_args]
+             for stage_args in command_stages] ==
+            [[t.fill(var_table) for t in templates]
+             for templates in stage_templates])
+
+print("m4r: " + " | ".join(" ".join(stage_args)
+                           for stage_args in command_stages))
+for (label, func) in (("eval_finalize", eval_each),
+                      ("templates", fill_templates)):
+    best = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print("{0:>14}: {1:.2f} us per sound".format(label,
+                                                 best * 1e6 / SOUNDS))
@@ -26,9 +26,49 @@ from one or more pak files.
 The :func:`resource_names` function retrieves a set of all the resource names
 in one or more pak files.
 
+The :func:`iter_resources` function is a lower-level interface that lazily
+generates the selected resources from one or more pak files, reading the
+content of each resource only when asked to.
+
 All of these functions have a ``sources`` parameter which can accept either a
 string specifying the filepath of a single pak file to process, or an iterable
-container of strings specifying multiple pak files to process.
+container of strings specifying multiple pak files to process. An open
+:class:`PakArchive` can be used in place of any such filepath.
+
+A :class:`PakArchive` opens a pak file and reads its file table just once, and
+then supports any number of lookups and reads of resources by name. It is
+meant for longer-running programs that embed this module.
+
+Resources can also come from loose files in a game directory (such as "id1",
+containing "sound/misc/basekey.wav" and so on). Anywhere that a pak file path
+is accepted, a directory path (or a :class:`GameDirectory`) can be used
+instead; its directory tree is scanned once, and the resource names are the
+file paths relative to the directory.
+
+Zip archives, such as the pk3 files used by later Quake engines, are also
+accepted anywhere that a pak file is; see :class:`ZipArchive`. So are pak files
+inside zip archives, with paths like "mod.zip!/pak0.pak"; see
+:class:`NestedPakArchive`. And so are gzip- or xz-compressed pak files; see
+:class:`CompressedPakArchive` and :func:`write_compressed_pak`.
+
+When the same resource name is in more than one pak file, by default it is
+processed from the first pak file where it is found. The ``precedence``
+parameter of :func:`process_resources`, :func:`extract_resources` and
+:func:`iter_resources` can instead resolve each name to a single pak file up
+front, using a :class:`PakOverlay`; "last" matches the way Quake lets later
+pak files override earlier ones.
+
+A :class:`PakCatalog` records the resources of a library of pak files in an
+SQLite database, including a content hash of each one, and only rescans pak
+files that have changed. Passed as the ``catalog`` argument of those same
+functions, it stands in for reading the file table of each pak file, and pak
+files that hold none of the selected resources are skipped entirely.
+
+Resources can also be selected by glob or regular expression patterns: a
+:class:`NameSelector` compiles a list of patterns (each with a template for
+the new names of the resources it matches) into one matcher, and
+:func:`select_resources` runs it over the file tables of some pak files to
+produce targets for :func:`process_resources`.
 
 Resource selection (using a set of names or a name map) and processing (with a
 user-provided function hook) is described in more detail in the documentation
@@ -62,6 +102,24 @@ Example of extracting specified resources from multiple pak files:
     targets = set(["sound/misc/basekey.wav", "sound/misc/medkey.wav"])
     expak.extract_resources(sources, targets)
 
+Example of looking up and reading resources from an open pak file:
+
+.. code-block:: python
+
+    with expak.PakArchive("pak0.pak") as pak:
+        if "sound/misc/basekey.wav" in pak:
+            basekey_data = pak.read("sound/misc/basekey.wav")
+        medkey_length = pak.stat("sound/misc/medkey.wav").length
+
+Example of streaming selected resources, stopping at the first large one:
+
+.. code-block:: python
+
+    for resource in expak.iter_resources(["pak0.pak", "pak1.pak"]):
+        if resource.length > 1000000:
+            break
+        my_handler_func_not_shown_here(resource.name, resource.read())
+
 More complex example:
 
 .. code-block:: python
@@ -88,260 +146,3869 @@ More complex example:
 """
 
 __all__ = ['process_resources',
+           'iter_resources',
            'extract_resources',
            'resource_names',
+           'PakArchive',
+           'PakFormatError',
+           'PakOverlay',
+           'GameDirectory',
+           'ZipArchive',
+           'NestedPakArchive',
+           'CompressedPakArchive',
+           'write_compressed_pak',
+           'PakCatalog',
+           'TargetTracker',
+           'NameSelector',
+           'select_resources',
            'nop_converter',
-           'print_err']
+           'copy_resource',
+           'streaming',
+           'print_err',
+           'index_cache_dir',
+           'coalesce_gap',
+           'coalesce_limit',
+           'use_mmap',
+           'inflate_threads',
+           'nested_pak_limit',
+           'normalize_names']
+
+__version__ = "1.2"
+
+
+import re
+import stat
+import struct
+import sys
+import os
+import errno
+import hashlib
+import io
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_right
+
+# NumPy is optional; if it is installed it is used to decode pak file tables.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from os import scandir
+except ImportError:
+    # 2.6 COMPAT: no os.scandir before Python 3.5
+    scandir = None
+
+# The mmap module may be unavailable on some platforms; in that case the
+# use_mmap flag below has no effect.
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+# The sqlite3 module is needed for :class:`PakCatalog`; some Python builds
+# leave it out.
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# The lzma module (Python 3.3 and later) is needed for xz-compressed pak files.
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Adapter for string type differences between Python 2 & 3.
+try:
+    basestring
+    def is_string(candidate):
+        return isinstance(candidate, basestring)
+except NameError:
+    def is_string(candidate):
+        return isinstance(candidate, str)
+
+# Adapter for array method name differences between Python 2 & 3.
+if hasattr(array, 'tobytes'):
+    def array_bytes(arr):
+        return arr.tobytes()
+else:
+    def array_bytes(arr):
+        return arr.tostring()
+
+PAK_FILE_SIGNATURE = b"PACK"
+RESOURCE_NAME_LEN = 56
+UNSIGNED_INT_LEN = 4
+TABLE_ENTRY_LEN = RESOURCE_NAME_LEN + (2 * UNSIGNED_INT_LEN)
+TABLE_ENTRY_FORMAT = "{0}sII".format(RESOURCE_NAME_LEN)
+INDEX_CACHE_SIGNATURE = b"EXPAKIDX"
+INDEX_CACHE_VERSION = 1
+INDEX_CACHE_HEADER = struct.Struct("<8sIIIqqqqqI")
+BLOCK_INDEX_SIGNATURE = b"EXPAKBLK"
+BLOCK_INDEX_VERSION = 1
+BLOCK_INDEX_HEADER = struct.Struct("<8sIqqqII")
+BLOCK_INDEX_ENTRY = struct.Struct("<qq")
+BLOCK_INDEX_SUFFIX = ".expakidx"
+COMPRESSED_CHUNK_SIZE = 64 * 1024
+COPY_CHUNK_SIZE = 64 * 1024
+# Errors from copy_file_range or sendfile that just mean they can't be used
+# for these files, so some other way of copying should be tried.
+KERNEL_COPY_ERRORS = frozenset([errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                errno.EBADF,
+                                getattr(errno, 'ENOTSUP', errno.EINVAL),
+                                getattr(errno, 'EOPNOTSUPP', errno.EINVAL)])
+GZIP_SIGNATURE = b"\x1f\x8b"
+XZ_SIGNATURE = b"\xfd7zXZ\x00"
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS paks (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resources (
+    pak_id INTEGER NOT NULL REFERENCES paks (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    hash TEXT,
+    stored_length INTEGER,
+    method INTEGER,
+    crc INTEGER,
+    PRIMARY KEY (pak_id, position)
+);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (name);
+"""
+ZIP_EOCD = struct.Struct("<4s4H2IH")
+ZIP_EOCD_SIGNATURE = b"PK\x05\x06"
+ZIP_CENTRAL_ENTRY = struct.Struct("<4s6H3I5H2I")
+ZIP_CENTRAL_SIGNATURE = b"PK\x01\x02"
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_UNSUPPORTED = 0xFFFF
+if numpy is not None:
+    TABLE_ENTRY_DTYPE = numpy.dtype([('name', "S{0}".format(RESOURCE_NAME_LEN)),
+                                     ('offset', "=u4"),
+                                     ('length', "=u4")])
+
+#: Boolean flag that may be changed to disable or enable stderr messages; True
+#: by default. Such messages are printed when exceptions are encountered that
+#: prevent reading a pak file or processing a resource.
+print_err = True
+
+#: Directory path for the pak file table index cache, or None to disable the
+#: cache. Initialized from the ``EXPAK_INDEX_CACHE`` environment variable (or
+#: None if that is not set), and may be changed. When enabled, the parsed file
+#: table of each pak is saved in this directory, and reused as long as the
+#: pak's path, size, modification time and inode are unchanged.
+index_cache_dir = os.environ.get("EXPAK_INDEX_CACHE") or None
+
+#: Largest gap (in bytes) between resources that may be bridged to combine
+#: their reads into a single sequential read; 64 KiB by default. May be changed,
+#: or set to None to read each resource separately. Resources are always read
+#: in the order of their offsets within the pak file, regardless.
+coalesce_gap = 64 * 1024
+
+#: Largest size (in bytes) of a single combined read; 4 MiB by default. May be
+#: changed. A resource larger than this is still read in one piece.
+coalesce_limit = 4 * 1024 * 1024
+
+#: Boolean flag that may be changed to enable or disable memory-mapped reading
+#: of pak files; False by default. When enabled, and when the pak file can be
+#: mapped, resource content is passed to converter functions as a read-only
+#: :class:`memoryview` slice of the mapped pak file rather than as a new bytes
+#: object. If mapping is not possible, the normal read path is used instead.
+use_mmap = False
+
+#: Number of threads used to inflate the deflated members of a zip (pk3)
+#: archive ahead of the converter function; 4 by default. May be changed, or
+#: set to 1 to inflate each member only when its content is read. zlib releases
+#: the interpreter lock while inflating, so the threads do run in parallel.
+inflate_threads = 4
+
+#: Largest size (in bytes) of a compressed pak file inside a zip archive that
+#: may be decompressed into memory; 256 MiB by default. May be changed. A pak
+#: file that is stored uncompressed inside a zip archive is read in place
+#: instead, whatever its size.
+nested_pak_limit = 256 * 1024 * 1024
+
+#: Whether resource names are matched the way Quake matches them, ignoring
+#: case and treating "\\" the same as "/" (and runs of slashes, or a leading
+#: slash, the same as one slash or none); False by default. May be changed.
+#: When enabled, the ``targets`` of :func:`process_resources` and the other
+#: functions are matched against a normalized index of each file table, so
+#: "Sound/Items/Armor1.WAV" selects "sound/items/armor1.wav"; the resource is
+#: still reported under its name in the pak file. Targets that normalize to
+#: the same name count as one target.
+normalize_names = False
+
+
+def read_uint(instream):
+    """Read an unsigned int from a binary file object.
+
+    Read :const:`UNSIGNED_INT_LEN` bytes from the current position in the file,
+    interpret those bytes as an unsigned integer, and return the result.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+
+    :returns: unsigned integer read from the file
+    :rtype:   int
+
+    """
+    packed = instream.read(UNSIGNED_INT_LEN)
+    if len(packed) != UNSIGNED_INT_LEN:
+        raise IOError(2, "unexpected EOF reading integer")
+    return struct.unpack('I', packed)[0]
+
+def read_header(instream):
+    """Read pak header info from a binary file object.
+
+    Seek to the beginning of the file. If the first four bytes don't contain the
+    :const:`PAK_FILE_SIGNATURE` string then return None. Otherwise continue to
+    read the offset and size of the file table. Return the file table offset and
+    number of table entries as a tuple.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+
+    :returns: tuple of file table offset and number of table entries if the
+              given file is a pak file, None otherwise
+    :rtype:   tuple(int,int) or None
+
+    """
+    instream.seek(0)
+    file_id = instream.read(len(PAK_FILE_SIGNATURE))
+    # We don't raise IOError on a short read here... IOError is for use after
+    # we've determined it's actually a pak file.
+    if file_id != PAK_FILE_SIGNATURE:
+        return None
+    ftable_off = read_uint(instream)
+    ftable_len = read_uint(instream)
+    num_files = ftable_len // TABLE_ENTRY_LEN
+    return (ftable_off, num_files)
+
+class FileTable(object):
+    """Compact in-memory form of a pak file table.
+
+    Rather than keeping a tuple per resource, the table keeps all of the
+    resource names in a single bytestring blob (null-separated, in table
+    order) and the resource offsets and lengths in two unsigned-int arrays.
+
+    """
+
+    def __init__(self, names, offsets, lengths):
+        """Initializer.
+
+        :param names:   null-separated resource names, in table order
+        :type names:    bytes
+        :param offsets: resource offsets, in table order
+        :type offsets:  array('I')
+        :param lengths: resource lengths, in table order
+        :type lengths:  array('I')
+
+        """
+        self.names = names
+        self.offsets = offsets
+        self.lengths = lengths
+        self.name_starts = None
+        self.normalized = None
+
+    def __len__(self):
+        """Number of resources in the table.
+
+        :returns: number of resources
+        :rtype:   int
+
+        """
+        return len(self.offsets)
+
+    def name_list(self):
+        """Split out the resource names.
+
+        :returns: resource names, in table order
+        :rtype:   list(bytes)
+
+        """
+        if not len(self):
+            return []
+        return self.names.split(b"\0")
+
+    def key_list(self):
+        """Get the keys used to match the resources against targets.
+
+        If :data:`normalize_names` is enabled, the normalized names are worked
+        out (and kept) the first time this is called; otherwise this is the
+        same as :meth:`name_list`.
+
+        :returns: resource name keys, in table order
+        :rtype:   list(bytes)
+
+        """
+        if not normalize_names:
+            return self.name_list()
+        if self.normalized is None:
+            self.normalized = [normalize_name(n) for n in self.name_list()]
+        return self.normalized
+
+    def name(self, index):
+        """Get the name of one resource.
+
+        The position of each name in the names blob is worked out (and kept,
+        as an array) the first time this is called.
+
+        :param index: position of the resource in the table
+        :type index:  int
+
+        :returns: resource name
+        :rtype:   bytes
+
+        """
+        if self.name_starts is None:
+            name_starts = array('I')
+            pos = 0
+            for name in self.name_list():
+                name_starts.append(pos)
+                pos += len(name) + 1
+            self.name_starts = name_starts
+        start = self.name_starts[index]
+        end = self.names.find(b"\0", start)
+        if end == -1:
+            end = len(self.names)
+        return self.names[start:end]
+
+    def select_order(self, targets):
+        """Get the positions of some of the resources, sorted by offset.
+
+        If the ``targets`` argument is None, all resources are selected;
+        otherwise only resources whose name keys (see :meth:`key_list`) are in
+        ``targets``.
+
+        :param targets: resource name keys to limit resource selection, or None
+                        to indicate that all resources should be selected
+        :type targets:  container(bytes) or None
+
+        :returns: table positions of selected resources, in offset order
+        :rtype:   array('I')
+
+        """
+        if targets is None:
+            selected = range(len(self))
+        else:
+            selected = [i for (i, n) in enumerate(self.key_list())
+                        if n in targets]
+        return array('I', sorted(selected, key=self.offsets.__getitem__))
+
+    def subset(self, positions):
+        """Make a file table containing only some of the resources.
+
+        :param positions: table positions of the resources to keep
+        :type positions:  iterable(int)
+
+        :returns: file table of the kept resources, in the given order
+        :rtype:   :class:`FileTable`
+
+        """
+        positions = list(positions)
+        return FileTable(b"\0".join([self.name(i) for i in positions]),
+                         array('I', [self.offsets[i] for i in positions]),
+                         array('I', [self.lengths[i] for i in positions]))
+
+    def select(self, targets):
+        """Generate (name, offset, length) tuples for some of the resources.
+
+        If the ``targets`` argument is None, all resources will be included in
+        the list; otherwise the list will be limited to resources whose name
+        keys (see :meth:`key_list`) are in ``targets``.
+
+        :param targets: resource name keys to limit resource selection, or None
+                        to indicate that all resources should be selected
+        :type targets:  container(bytes) or None
+
+        :returns: list of (name, offset, length) tuples for selected resources
+        :rtype:   list(tuple(bytes,int,int))
+
+        """
+        entries = zip(self.name_list(), self.offsets, self.lengths)
+        if targets is None:
+            return list(entries)
+        return [e for (e, k) in zip(entries, self.key_list()) if k in targets]
+
+class ZipTable(FileTable):
+    """File table for a zip (pk3) archive.
+
+    The offset of each resource is the offset of its member's local header, and
+    the length is its uncompressed size. The compressed size, compression
+    method and CRC of each member are kept in three more arrays.
+
+    """
+
+    def __init__(self, names, offsets, lengths, stored_lengths, methods, crcs):
+        """Initializer.
+
+        :param names:          null-separated resource names, in table order
+        :type names:           bytes
+        :param offsets:        local header offsets, in table order
+        :type offsets:         array('I')
+        :param lengths:        uncompressed sizes, in table order
+        :type lengths:         array('I')
+        :param stored_lengths: compressed sizes, in table order
+        :type stored_lengths:  array('I')
+        :param methods:        compression methods, in table order
+        :type methods:         array('H')
+        :param crcs:           CRC-32 of the uncompressed content, in table
+                               order
+        :type crcs:            array('I')
+
+        """
+        FileTable.__init__(self, names, offsets, lengths)
+        self.stored_lengths = stored_lengths
+        self.methods = methods
+        self.crcs = crcs
+
+    def subset(self, positions):
+        """Make a file table containing only some of the resources.
+
+        :param positions: table positions of the resources to keep
+        :type positions:  iterable(int)
+
+        :returns: file table of the kept resources, in the given order
+        :rtype:   :class:`ZipTable`
+
+        """
+        positions = list(positions)
+        table = FileTable.subset(self, positions)
+        return ZipTable(table.names, table.offsets, table.lengths,
+                        array('I', [self.stored_lengths[i] for i in positions]),
+                        array('H', [self.methods[i] for i in positions]),
+                        array('I', [self.crcs[i] for i in positions]))
+
+def read_zip_table(instream):
+    """Read the file table of a zip archive from its central directory.
+
+    Only the end-of-central-directory record and the central directory itself
+    are read; the local headers of the members are left alone until their
+    content is read. Directory entries are left out. Members that are
+    encrypted, or use a compression method other than stored or deflated, are
+    included but marked as unsupported. Multi-disk and zip64 archives are not
+    supported.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+
+    :returns: file table if the file is a supported zip archive, None
+              otherwise
+    :rtype:   :class:`ZipTable` or None
+
+    :raises IOError: if the file ends before the end of the central directory
+
+    """
+    instream.seek(0, os.SEEK_END)
+    size = instream.tell()
+    # The record is at the end of the file, followed by a comment of up to
+    # 64 KiB.
+    tail_len = min(size, ZIP_EOCD.size + 0xFFFF)
+    instream.seek(size - tail_len)
+    tail = instream.read(tail_len)
+    eocd_pos = tail.rfind(ZIP_EOCD_SIGNATURE)
+    if eocd_pos == -1 or eocd_pos + ZIP_EOCD.size > len(tail):
+        return None
+    (signature, disk, cd_disk, disk_entries, num_entries, cd_size, cd_offset,
+     comment_len) = ZIP_EOCD.unpack_from(tail, eocd_pos)
+    if (disk != 0 or cd_disk != 0 or disk_entries != num_entries or
+            num_entries == 0xFFFF or cd_offset == 0xFFFFFFFF):
+        return None
+    instream.seek(cd_offset)
+    cd_data = instream.read(cd_size)
+    if len(cd_data) != cd_size:
+        raise IOError(2, "unexpected EOF reading zip central directory")
+    names = []
+    offsets = array('I')
+    lengths = array('I')
+    stored_lengths = array('I')
+    methods = array('H')
+    crcs = array('I')
+    pos = 0
+    for i in range(num_entries):
+        try:
+            entry = ZIP_CENTRAL_ENTRY.unpack_from(cd_data, pos)
+        except struct.error:
+            return None
+        if entry[0] != ZIP_CENTRAL_SIGNATURE:
+            return None
+        flags = entry[3]
+        method = entry[4]
+        (name_len, extra_len, comment_len) = entry[10:13]
+        name_start = pos + ZIP_CENTRAL_ENTRY.size
+        name = cd_data[name_start:name_start + name_len]
+        pos = name_start + name_len + extra_len + comment_len
+        if name.endswith(b"/"):
+            continue
+        if flags & 1 or method not in (ZIP_STORED, ZIP_DEFLATED):
+            method = ZIP_UNSUPPORTED
+        names.append(name)
+        offsets.append(entry[16])
+        lengths.append(entry[9])
+        stored_lengths.append(entry[8])
+        methods.append(method)
+        crcs.append(entry[7])
+    return ZipTable(b"\0".join(names), offsets, lengths, stored_lengths,
+                    methods, crcs)
+
+def inflate_member(data, length, crc):
+    """Inflate the content of a deflated zip member.
+
+    :param data:   compressed content
+    :type data:    bytes
+    :param length: expected uncompressed size
+    :type length:  int
+    :param crc:    expected CRC-32 of the uncompressed content
+    :type crc:     int
+
+    :returns: uncompressed content
+    :rtype:   bytes
+
+    :raises IOError: if the content can't be inflated, or doesn't match the
+                     expected size and CRC
+
+    """
+    try:
+        content = zlib.decompress(data, -zlib.MAX_WBITS)
+    except zlib.error:
+        raise IOError(errno.EIO, "bad compressed data in zip member")
+    if len(content) != length or (zlib.crc32(content) & 0xFFFFFFFF) != crc:
+        raise IOError(errno.EIO, "zip member size or CRC mismatch")
+    return content
+
+def parse_filetable(table_data, num_files):
+    """Decode the raw content of a pak file table.
+
+    Decode all of the table entries in bulk, using a NumPy structured array if
+    NumPy is available, or :func:`struct.iter_unpack` otherwise. Each resource
+    name is terminated at its first null character.
+
+    :param table_data: raw file table content
+    :type table_data:  bytes
+    :param num_files:  number of entries in the table
+    :type num_files:   int
+
+    :returns: decoded file table
+    :rtype:   :class:`FileTable`
+
+    """
+    if numpy is not None:
+        records = numpy.frombuffer(table_data, TABLE_ENTRY_DTYPE, num_files)
+        raw_names = records['name'].tolist()
+        offsets = array('I', records['offset'].tobytes())
+        lengths = array('I', records['length'].tobytes())
+    else:
+        try:
+            unpacked = struct.iter_unpack(TABLE_ENTRY_FORMAT, table_data)
+        except AttributeError:
+            # Python versions before 3.4 don't have iter_unpack.
+            unpacked = [struct.unpack_from(TABLE_ENTRY_FORMAT, table_data, e)
+                        for e in range(0, len(table_data), TABLE_ENTRY_LEN)]
+        raw_names, offsets, lengths = [], array('I'), array('I')
+        for (raw_name, file_off, file_len) in unpacked:
+            raw_names.append(raw_name)
+            offsets.append(file_off)
+            lengths.append(file_len)
+    # Terminate each name at the first encountered null character.
+    names = b"\0".join([n.partition(b"\0")[0] for n in raw_names])
+    return FileTable(names, offsets, lengths)
+
+def load_filetable(instream, header):
+    """Given the header info, read the file table of a pak file.
+
+    Seek to the pak file table position in the file, read the entire table with
+    a single read, and decode it with :func:`parse_filetable`.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+    :param header:   pak header info, containing the file table offset and
+                     number of entries
+    :type header:    tuple(int,int)
+
+    :returns: decoded file table
+    :rtype:   :class:`FileTable`
+
+    """
+    (ftable_off, num_files) = header
+    table_len = num_files * TABLE_ENTRY_LEN
+    instream.seek(ftable_off)
+    table_data = instream.read(table_len)
+    if len(table_data) != table_len:
+        raise IOError(2, "unexpected EOF reading file table")
+    return parse_filetable(table_data, num_files)
+
+def read_filetable(instream, header, targets):
+    """Given the header info, extract info on resources contained in a pak file.
+
+    Load the file table with :func:`load_filetable` and generate a list of
+    (name, offset, length) tuples for some number of the resources in the
+    table. If the ``targets`` argument is None, all discovered resources will
+    be included in the list; otherwise the list will be limited to resources
+    whose names are in ``targets``.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+    :param header:   pak header info, containing the file table offset and
+                     number of entries
+    :type header:    tuple(int,int)
+    :param targets:  resource names to limit resource selection, or None to
+                     indicate that all resources should be selected
+    :type targets:   container(bytes) or None
+
+    :returns: list of (name, offset, length) tuples for selected resources
+    :rtype:   list(tuple(bytes,int,int))
+
+    """
+    if not targets and targets is not None:
+        return []
+    return load_filetable(instream, header).select(targets)
+
+def index_cache_key(pak_path, pak_stat):
+    """Compute the identity of a pak file for the file table index cache.
+
+    :param pak_path: file path of the pak file
+    :type pak_path:  str
+    :param pak_stat: stat result for the pak file
+    :type pak_stat:  :class:`os.stat_result`
+
+    :returns: cache file path, and the (size, mtime, inode) values that must
+              match for a cached table to be valid
+    :rtype:   tuple(str,tuple(int,int,int))
+
+    """
+    abs_path = os.path.abspath(pak_path)
+    path_hash = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()
+    cache_path = os.path.join(index_cache_dir, path_hash + ".idx")
+    return (cache_path,
+            (pak_stat.st_size, stat_mtime_ns(pak_stat), pak_stat.st_ino))
+
+def stat_mtime_ns(path_stat):
+    """Get the modification time from a stat result, in nanoseconds.
+
+    :param path_stat: stat result for a file
+    :type path_stat:  :class:`os.stat_result`
+
+    :returns: modification time
+    :rtype:   int
+
+    """
+    try:
+        return path_stat.st_mtime_ns
+    except AttributeError:
+        # Python versions before 3.3 don't have st_mtime_ns.
+        return int(path_stat.st_mtime * 1000000000)
+
+def load_cached_filetable(pak_path, pak_stat):
+    """Fetch a pak file table from the index cache.
+
+    Return None if :data:`index_cache_dir` is None, if there is no cache entry
+    for the pak file, or if the cache entry is stale or corrupted.
+
+    :param pak_path: file path of the pak file
+    :type pak_path:  str
+    :param pak_stat: stat result for the pak file
+    :type pak_stat:  :class:`os.stat_result`
+
+    :returns: cached file table, or None if no valid cache entry
+    :rtype:   :class:`FileTable` or None
+
+    """
+    if index_cache_dir is None:
+        return None
+    (cache_path, key) = index_cache_key(pak_path, pak_stat)
+    try:
+        with open(cache_path, 'rb') as instream:
+            cached = instream.read()
+    except IOError:
+        return None
+    if len(cached) < INDEX_CACHE_HEADER.size:
+        return None
+    (signature, version, itemsize, num_files, names_len, size, mtime, ino,
+     path_len, checksum) = INDEX_CACHE_HEADER.unpack_from(cached)
+    if (signature != INDEX_CACHE_SIGNATURE or
+            version != INDEX_CACHE_VERSION or
+            itemsize != array('I').itemsize or
+            (size, mtime, ino) != key):
+        return None
+    payload = cached[INDEX_CACHE_HEADER.size:]
+    array_len = num_files * itemsize
+    if (len(payload) != path_len + names_len + 2 * array_len or
+            zlib.crc32(payload) & 0xffffffff != checksum):
+        return None
+    # The path is stored only to detect (unlikely) cache filename collisions.
+    stored_path = payload[:path_len]
+    if stored_path != os.path.abspath(pak_path).encode('utf-8'):
+        return None
+    pos = path_len
+    names = payload[pos:pos + names_len]
+    pos += names_len
+    offsets = array('I', payload[pos:pos + array_len])
+    pos += array_len
+    lengths = array('I', payload[pos:pos + array_len])
+    return FileTable(names, offsets, lengths)
+
+def save_cached_filetable(pak_path, pak_stat, table):
+    """Store a pak file table in the index cache.
+
+    Do nothing if :data:`index_cache_dir` is None. The cache entry is written
+    to a temporary file that then replaces any existing entry, so concurrent
+    readers never see a partial entry. Failure to write the cache is not an
+    error; the table will just be parsed again next time.
+
+    :param pak_path: file path of the pak file
+    :type pak_path:  str
+    :param pak_stat: stat result for the pak file
+    :type pak_stat:  :class:`os.stat_result`
+    :param table:    file table to store
+    :type table:     :class:`FileTable`
+
+    """
+    if index_cache_dir is None:
+        return
+    (cache_path, key) = index_cache_key(pak_path, pak_stat)
+    abs_path = os.path.abspath(pak_path).encode('utf-8')
+    payload = b"".join([abs_path, table.names,
+                        array_bytes(table.offsets), array_bytes(table.lengths)])
+    header = INDEX_CACHE_HEADER.pack(INDEX_CACHE_SIGNATURE,
+                                     INDEX_CACHE_VERSION,
+                                     table.offsets.itemsize, len(table),
+                                     len(table.names), key[0], key[1], key[2],
+                                     len(abs_path),
+                                     zlib.crc32(payload) & 0xffffffff)
+    temp_path = None
+    try:
+        try:
+            os.makedirs(index_cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        (temp_fd, temp_path) = tempfile.mkstemp(dir=index_cache_dir)
+        with os.fdopen(temp_fd, 'wb') as outstream:
+            outstream.write(header)
+            outstream.write(payload)
+        try:
+            os.rename(temp_path, cache_path)
+        except OSError:
+            # Windows won't rename over an existing file.
+            os.remove(cache_path)
+            os.rename(temp_path, cache_path)
+        temp_path = None
+    except EnvironmentError:
+        if print_err:
+            sys.stderr.write("{0!r} exception writing index cache for {1}\n".format(
+                sys.exc_info()[1], pak_path))
+    finally:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+def get_filetable(instream):
+    """Read the file table of a pak file, using the index cache if enabled.
+
+    If the file table is in the index cache, return that without reading
+    anything from the pak file. Otherwise read the pak header information from
+    the file. If that succeeds, store the result of :func:`load_filetable` in
+    the index cache and return it; otherwise return None.
+
+    :param instream: binary file object to read from, opened from a path
+    :type instream:  file
+
+    :returns: decoded file table if the given file is a pak file, None
+              otherwise
+    :rtype:   :class:`FileTable` or None
+
+    """
+    pak_stat = None
+    if index_cache_dir is not None:
+        pak_stat = os.fstat(instream.fileno())
+        table = load_cached_filetable(instream.name, pak_stat)
+        if table is not None:
+            return table
+    header = read_header(instream)
+    if header is None:
+        return None
+    table = load_filetable(instream, header)
+    if pak_stat is not None:
+        save_cached_filetable(instream.name, pak_stat, table)
+    return table
+
+def get_target_info(instream, targets):
+    """Extract info on resources contained in a pak file.
+
+    Read the pak file table with :func:`get_filetable`. If that succeeds,
+    return the resources in the table that are selected by ``targets``;
+    otherwise return None.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+    :param targets:  resource names to limit resource selection, or None to
+                     indicate that all resources should be selected
+    :type targets:   container(bytes) or None
+
+    :returns: list of (name, offset, length) tuples for selected resources if
+              the given file is a pak file, None otherwise
+    :rtype:   list(tuple(bytes,int,int)) or None
+
+    """
+    if not targets and targets is not None:
+        # Nothing can be selected, so don't bother with the file table.
+        return None if read_header(instream) is None else []
+    table = get_filetable(instream)
+    if table is None:
+        return None
+    return table.select(targets)
+
+def map_file(instream):
+    """Memory-map an open pak file, if enabled and possible.
+
+    If :data:`use_mmap` is False, or if the file can't be mapped (mmap module
+    unavailable, empty file, unsupported file object, or a Python version
+    whose mmap objects can't be wrapped by :class:`memoryview`), return None
+    for both the mapping and the view.
+
+    :param instream: binary file object to map
+    :type instream:  file
+
+    :returns: the mapping and a read-only memoryview of the whole file, or
+              (None, None) if not mapped
+    :rtype:   tuple(:class:`mmap.mmap`,memoryview) or tuple(None,None)
+
+    """
+    mapped = None
+    if use_mmap and mmap is not None:
+        try:
+            mapped = mmap.mmap(instream.fileno(), 0, access=mmap.ACCESS_READ)
+            return (mapped, memoryview(mapped))
+        except (EnvironmentError, ValueError, TypeError, AttributeError):
+            if mapped is not None:
+                mapped.close()
+    return (None, None)
+
+def unmap_file(mapped, view):
+    """Undo :func:`map_file`.
+
+    :param mapped: the mapping, or None if not mapped
+    :type mapped:  :class:`mmap.mmap` or None
+    :param view:   view of the mapping, or None if not mapped
+    :type view:    memoryview or None
+
+    """
+    if view is not None:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # Someone is still holding a slice of the view; the mapping
+            # will be closed when that is garbage-collected.
+            pass
+
+def raw_name(name):
+    """Convert a resource name to the form used in pak file tables.
+
+    :param name: resource name
+    :type name:  str or bytes
+
+    :returns: resource name as bytes
+    :rtype:   bytes
+
+    """
+    try:
+        return name.encode('latin-1')
+    except AttributeError:
+        # Eh, probably already bytes.
+        return name
+
+def normalize_name(name):
+    """Convert a resource name to the form used by :data:`normalize_names`.
+
+    :param name: resource name, as in a pak file table
+    :type name:  bytes
+
+    :returns: resource name in lowercase, with "/" separators and without
+              empty path components
+    :rtype:   bytes
+
+    """
+    name = name.lower().replace(b"\\", b"/")
+    if b"//" in name or name.startswith(b"/"):
+        name = b"/".join([part for part in name.split(b"/") if part])
+    return name
+
+def name_key(name):
+    """Get the key used to match a resource name against targets.
+
+    :param name: resource name, as in a pak file table
+    :type name:  bytes
+
+    :returns: the normalized name if :data:`normalize_names` is enabled,
+              otherwise the name itself
+    :rtype:   bytes
+
+    """
+    if normalize_names:
+        return normalize_name(name)
+    return name
+
+class PakFormatError(IOError):
+    """Exception for signaling that a file is not a pak (or zip) file.
+
+    """
+
+    def __init__(self, pak_path, file_type="pak"):
+        """Initializer.
+
+        :param pak_path:  file path of the file
+        :type pak_path:   str
+        :param file_type: kind of file that was expected
+        :type file_type:  str
+
+        """
+        IOError.__init__(self, "{0} is not a {1} file".format(pak_path,
+                                                               file_type))
+        self.pak_path = pak_path
+
+class PakEntry(object):
+    """Compact record of one resource in a pak file.
+
+    """
+
+    __slots__ = ('name', 'offset', 'length')
+
+    def __init__(self, name, offset, length):
+        """Initializer.
+
+        :param name:   resource name
+        :type name:    bytes
+        :param offset: offset of the resource content in the pak file
+        :type offset:  int
+        :param length: length of the resource content
+        :type length:  int
+
+        """
+        self.name = name
+        self.offset = offset
+        self.length = length
+
+class MappableFile(object):
+    """An open file, with its content available as a mapped view if possible.
+
+    The file is mapped (if :data:`use_mmap` is enabled) the first time its
+    view is asked for. Use :meth:`close` (or a ``with`` statement) to release
+    the file.
+
+    """
+
+    def __init__(self, path):
+        """Initializer.
+
+        :param path: file path of the file
+        :type path:  str
+
+        :raises IOError: if the file can't be opened
+
+        """
+        self.path = path
+        self.instream = open(path, 'rb')
+        self.mapped = None
+        self.mapped_view = None
+        self.map_tried = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap and close the file.
+
+        """
+        unmap_file(self.mapped, self.mapped_view)
+        self.mapped = self.mapped_view = None
+        self.instream.close()
+
+    @property
+    def view(self):
+        """View of the mapped file, mapping it if necessary.
+
+        :returns: view of the mapped file, or None if not mapped
+        :rtype:   memoryview or None
+
+        """
+        if not self.map_tried:
+            self.map_tried = True
+            (self.mapped, self.mapped_view) = map_file(self.instream)
+        return self.mapped_view
+
+class PakArchive(MappableFile):
+    """An open pak file, for repeated lookups and reads of its resources.
+
+    The pak file is opened, and its file table read (or fetched from the index
+    cache), once when the archive is created. The name index is built the
+    first time a resource is looked up by name. If :data:`use_mmap` is enabled,
+    the file is mapped the first time resource content is read. Use
+    :meth:`close` (or a ``with`` statement) to release the file.
+
+    Resource names can be given as str or bytes. If the file table contains a
+    name more than once, lookups find the first entry with that name.
+
+    An archive can also be used as a source (or one of the sources) for
+    :func:`process_resources`, :func:`extract_resources`,
+    :func:`iter_resources` and :func:`resource_names`, which will then use it
+    rather than opening the pak file again. This is not true for the parallel
+    mode of :func:`process_resources`, where each worker opens the pak file
+    for itself.
+
+    A PakArchive should not be used by multiple threads at once.
+
+    """
+
+    def __init__(self, pak_path, table=None):
+        """Initializer.
+
+        :param pak_path: file path of the pak file
+        :type pak_path:  str
+        :param table:    file table to use instead of reading it from the pak
+                         file
+        :type table:     :class:`FileTable` or None
+
+        :raises PakFormatError: if the file is not a pak file
+
+        :raises IOError: if there is an error reading the pak file
+
+        """
+        MappableFile.__init__(self, pak_path)
+        try:
+            if table is None:
+                table = get_filetable(self.instream)
+                if table is None:
+                    raise PakFormatError(pak_path)
+        except:
+            self.instream.close()
+            raise
+        self.table = table
+        self.index = None
+
+    def entry(self, name):
+        """Look up a resource by name.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: the resource's entry, or None if not in the archive
+        :rtype:   :class:`PakEntry` or None
+
+        """
+        if self.index is None:
+            table = self.table
+            index = {}
+            for (i, entry_name) in enumerate(table.name_list()):
+                key = name_key(entry_name)
+                if key not in index:
+                    index[key] = PakEntry(entry_name, table.offsets[i],
+                                          table.lengths[i])
+            self.index = index
+        return self.index.get(name_key(raw_name(name)))
+
+    def __contains__(self, name):
+        return self.entry(name) is not None
+
+    def __len__(self):
+        return len(self.table)
+
+    def stat(self, name):
+        """Get the location of a resource within the pak file.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: the resource's entry
+        :rtype:   :class:`PakEntry`
+
+        :raises KeyError: if the resource is not in the archive
+
+        """
+        entry = self.entry(name)
+        if entry is None:
+            raise KeyError(name)
+        return entry
+
+    def names(self):
+        """Get the name of every resource in the archive.
+
+        :returns: resource names, in file table order
+        :rtype:   list(str)
+
+        """
+        return [n.decode() for n in self.table.name_list()]
+
+    def open(self, name):
+        """Get a file object for reading a resource's content incrementally.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: file object bounded to the resource content
+        :rtype:   :class:`ResourceReader`
+
+        :raises KeyError: if the resource is not in the archive
+
+        """
+        entry = self.stat(name)
+        return ResourceReader(self, entry.offset, entry.length)
+
+    def read(self, name):
+        """Read a resource's content.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: resource content
+        :rtype:   bytes
+
+        :raises KeyError: if the resource is not in the archive
+
+        :raises IOError: if the pak file ends before the end of the resource
+
+        """
+        entry = self.stat(name)
+        planned_read = PlannedRead(self, entry.offset,
+                                   entry.offset + entry.length)
+        orig_data = planned_read.content(entry.offset, entry.length)
+        if isinstance(orig_data, memoryview):
+            view = orig_data
+            orig_data = view.tobytes()
+            view.release()
+        return orig_data
+
+def scan_directory(dir_path):
+    """Build a file table for the loose files in a directory tree.
+
+    Each regular file in the tree becomes a table entry whose name is the file
+    path relative to ``dir_path``, with "/" separators; its offset is 0 and its
+    length is the file size. Files whose names can't be represented in a pak
+    file table, or that are too large for one, are left out. Entries are in
+    name order. Symlinks are followed, except for a directory symlink that
+    leads back to a directory containing it, which would make a loop.
+
+    :param dir_path: path of the directory
+    :type dir_path:  str
+
+    :returns: file table for the directory
+    :rtype:   :class:`FileTable`
+
+    :raises OSError: if a directory in the tree can't be listed
+
+    """
+    found = []
+    pending = [("", dir_path, frozenset())]
+    while pending:
+        (prefix, path, ancestors) = pending.pop()
+        # Identify directories by device and inode, where the platform has
+        # them, to notice a symlink loop.
+        dir_stat = os.stat(path)
+        if dir_stat.st_ino:
+            dir_id = (dir_stat.st_dev, dir_stat.st_ino)
+            if dir_id in ancestors:
+                continue
+            ancestors = ancestors | frozenset([dir_id])
+        if scandir is not None:
+            for entry in list(scandir(path)):
+                if entry.is_dir():
+                    pending.append((prefix + entry.name + "/", entry.path,
+                                    ancestors))
+                elif entry.is_file():
+                    found.append((prefix + entry.name, entry.stat().st_size))
+        else:
+            for name in os.listdir(path):
+                entry_path = os.path.join(path, name)
+                if os.path.isdir(entry_path):
+                    pending.append((prefix + name + "/", entry_path,
+                                    ancestors))
+                elif os.path.isfile(entry_path):
+                    found.append((prefix + name, os.path.getsize(entry_path)))
+    names = []
+    lengths = array('I')
+    for (name, size) in sorted(found):
+        if size > 0xFFFFFFFF:
+            continue
+        try:
+            names.append(raw_name(name))
+        except UnicodeError:
+            continue
+        lengths.append(size)
+    return FileTable(b"\0".join(names), array('I', [0]) * len(lengths),
+                     lengths)
+
+class GameDirectory(object):
+    """A game directory of loose resource files, usable as a source of resources.
+
+    Quake mods often provide resources as loose files (for example under
+    "id1/sound/...") rather than in pak files. A GameDirectory can be used
+    anywhere that a pak file is accepted as a source: the directory tree is
+    scanned once, into a file table whose resource names are the file paths
+    relative to the directory, and resource content is then read directly
+    from each file as it is needed.
+
+    A string source that names a directory rather than a file is used as a
+    GameDirectory automatically.
+
+    """
+
+    def __init__(self, dir_path, table=None):
+        """Initializer.
+
+        :param dir_path: path of the game directory
+        :type dir_path:  str
+        :param table:    file table to use instead of scanning the directory
+        :type table:     :class:`FileTable` or None
+
+        :raises OSError: if a directory in the tree can't be listed
+
+        """
+        self.path = dir_path
+        if table is None:
+            table = scan_directory(dir_path)
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Nothing to do; the loose files are only open while being read.
+
+        """
+        pass
+
+    def open_file(self, index):
+        """Open the loose file for one resource.
+
+        :param index: position of the resource in the file table
+        :type index:  int
+
+        :returns: the open file
+        :rtype:   :class:`MappableFile`
+
+        :raises IOError: if the file can't be opened
+
+        """
+        parts = self.table.name(index).decode('latin-1').split("/")
+        return MappableFile(os.path.join(self.path, *parts))
+
+class ZipArchive(PakArchive):
+    """An open zip (pk3) archive, for repeated lookups and reads of its members.
+
+    This supports the same interface as :class:`PakArchive`, and can likewise
+    be used as a source. Only the archive's central directory is read when it
+    is opened. Stored members are read directly at their offset in the
+    archive, exactly like pak file resources (including from the mapped file,
+    if :data:`use_mmap` is enabled); deflated members are inflated, by up to
+    :data:`inflate_threads` threads at a time when a source is processed.
+
+    A string source that names a zip archive rather than a pak file is used as
+    a ZipArchive automatically.
+
+    """
+
+    def __init__(self, zip_path, table=None):
+        """Initializer.
+
+        :param zip_path: file path of the zip archive
+        :type zip_path:  str
+        :param table:    file table to use instead of reading it from the
+                         archive
+        :type table:     :class:`ZipTable` or None
+
+        :raises PakFormatError: if the file is not a supported zip archive
+
+        :raises IOError: if there is an error reading the zip archive
+
+        """
+        MappableFile.__init__(self, zip_path)
+        try:
+            if table is None:
+                table = read_zip_table(self.instream)
+                if table is None:
+                    raise PakFormatError(zip_path, "zip")
+        except:
+            self.instream.close()
+            raise
+        self.table = table
+        self.index = None
+        self.positions = None
+
+    def position(self, name):
+        """Look up the table position of a member by name.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: position of the member in the file table
+        :rtype:   int
+
+        :raises KeyError: if the resource is not in the archive
+
+        """
+        if self.positions is None:
+            positions = {}
+            for (i, key) in enumerate(self.table.key_list()):
+                if key not in positions:
+                    positions[key] = i
+            self.positions = positions
+        try:
+            return self.positions[name_key(raw_name(name))]
+        except KeyError:
+            raise KeyError(name)
+
+    def read_range(self, offset, length):
+        """Read part of the archive.
+
+        :param offset: start of the read
+        :type offset:  int
+        :param length: length of the read
+        :type length:  int
+
+        :returns: content read
+        :rtype:   bytes
+
+        :raises IOError: if the archive ends before the end of the read
+
+        """
+        data = PlannedRead(self, offset, offset + length).content(offset,
+                                                                  length)
+        if isinstance(data, memoryview):
+            view = data
+            data = view.tobytes()
+            view.release()
+        return data
+
+    def data_offset(self, index):
+        """Find where a member's content starts, from its local header.
+
+        :param index: position of the member in the file table
+        :type index:  int
+
+        :returns: offset of the member content in the archive
+        :rtype:   int
+
+        :raises IOError: if the local header can't be read or is invalid
+
+        """
+        header_offset = self.table.offsets[index]
+        header = ZIP_LOCAL_HEADER.unpack(
+            self.read_range(header_offset, ZIP_LOCAL_HEADER.size))
+        if header[0] != ZIP_LOCAL_SIGNATURE:
+            raise IOError(errno.EIO, "bad zip member header")
+        return header_offset + ZIP_LOCAL_HEADER.size + header[9] + header[10]
+
+    def content_read(self, index, pool=None):
+        """Start reading a member's content.
+
+        :param index: position of the member in the file table
+        :type index:  int
+        :param pool:  thread pool to inflate a deflated member with, or None
+                      to inflate it only when its content is asked for
+        :type pool:   :class:`multiprocessing.pool.ThreadPool` or None
+
+        :returns: the offset of the member content in the archive, and a read
+                  that will produce the content
+        :rtype:   tuple(int,:class:`PlannedRead` or :class:`InflatedRead`)
+
+        :raises IOError: if the member can't be read, or uses an unsupported
+                         compression method or encryption
+
+        """
+        table = self.table
+        method = table.methods[index]
+        if method == ZIP_UNSUPPORTED:
+            raise IOError(errno.EIO, "unsupported zip member {0}".format(
+                table.name(index).decode()))
+        data_off = self.data_offset(index)
+        if method == ZIP_STORED:
+            return (data_off,
+                    PlannedRead(self, data_off, data_off + table.lengths[index]))
+        args = (self.read_range(data_off, table.stored_lengths[index]),
+                table.lengths[index], table.crcs[index])
+        if pool is None:
+            return (data_off, InflatedRead(args))
+        return (data_off, InflatedRead(args, pool.apply_async(inflate_member,
+                                                              args)))
+
+    def open(self, name):
+        """Get a file object for reading a member's content incrementally.
+
+        A deflated member is inflated all at once.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: file object for the member content
+        :rtype:   :class:`ResourceReader` or :class:`io.BytesIO`
+
+        :raises KeyError: if the resource is not in the archive
+
+        :raises IOError: if the member can't be read
+
+        """
+        index = self.position(name)
+        (data_off, content_read) = self.content_read(index)
+        return content_read.open(data_off, self.table.lengths[index])
+
+    def read(self, name):
+        """Read a member's content.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: member content
+        :rtype:   bytes
+
+        :raises KeyError: if the resource is not in the archive
+
+        :raises IOError: if the member can't be read
+
+        """
+        index = self.position(name)
+        (data_off, content_read) = self.content_read(index)
+        orig_data = content_read.content(data_off, self.table.lengths[index])
+        if isinstance(orig_data, memoryview):
+            view = orig_data
+            orig_data = view.tobytes()
+            view.release()
+        return orig_data
+
+def split_nested_path(path):
+    """Split a path that names a pak file inside a zip archive.
+
+    Such a path is the path of the zip archive, then "!/", then the name of
+    the pak file within the archive; for example "mod.zip!/pak0.pak". (The
+    platform's path separator can be used in place of the "/".)
+
+    :param path: path to check
+    :type path:  str
+
+    :returns: zip archive path and member name, or None if the path doesn't
+              name a pak file inside an existing zip archive
+    :rtype:   tuple(str,str) or None
+
+    """
+    if os.path.exists(path):
+        return None
+    for separator in ("!/", "!" + os.sep):
+        pos = path.find(separator)
+        if pos != -1 and os.path.isfile(path[:pos]):
+            member_name = path[pos + len(separator):].replace(os.sep, "/")
+            return (path[:pos], member_name)
+    return None
+
+class NestedPakArchive(PakArchive):
+    """An open pak file that is inside a zip archive.
+
+    This supports the same interface as :class:`PakArchive`, and can likewise
+    be used as a source, so that pak files distributed in zip archives don't
+    have to be extracted first. The path of a nested pak file is written as
+    described for :func:`split_nested_path`, for example "mod.zip!/pak0.pak";
+    a string source in that form is used as a NestedPakArchive automatically.
+
+    If the pak file is stored uncompressed in the zip archive, it is read in
+    place: the offsets in its file table are shifted to be offsets within the
+    zip archive, and everything else works just as for a pak file on its own
+    (including mapping, if :data:`use_mmap` is enabled). If it is compressed,
+    it is decompressed into memory once, when the archive is opened; this is
+    refused for pak files larger than :data:`nested_pak_limit`.
+
+    """
+
+    def __init__(self, nested_path, table=None):
+        """Initializer.
+
+        :param nested_path: path of the pak file inside a zip archive
+        :type nested_path:  str
+        :param table:       file table to use instead of reading it from the
+                            pak file
+        :type table:        :class:`FileTable` or None
+
+        :raises PakFormatError: if the file is not a pak file, or the
+                                containing file is not a zip archive
+
+        :raises IOError: if there is an error reading the zip archive, the
+                         pak file is not in the zip archive, or the pak file
+                         is compressed and too large
+
+        """
+        split_path = split_nested_path(nested_path)
+        if split_path is None:
+            raise IOError(errno.ENOENT, "no such zip archive", nested_path)
+        (zip_path, member_name) = split_path
+        with ZipArchive(zip_path) as outer:
+            try:
+                index = outer.position(member_name)
+            except KeyError:
+                raise IOError(errno.ENOENT, "no such member in zip archive",
+                              nested_path)
+            length = outer.table.lengths[index]
+            if outer.table.methods[index] == ZIP_STORED:
+                buffer = None
+                if table is None:
+                    table = read_embedded_filetable(
+                        outer, outer.data_offset(index), length, nested_path)
+            else:
+                if length > nested_pak_limit:
+                    raise IOError(errno.EFBIG, "compressed pak file too large "
+                                  "to read into memory", nested_path)
+                buffer = outer.read(member_name)
+        self.path = nested_path
+        self.buffer = buffer
+        if buffer is None:
+            self.instream = open(zip_path, 'rb')
+        else:
+            self.instream = io.BytesIO(buffer)
+        self.mapped = None
+        self.mapped_view = None
+        self.map_tried = False
+        try:
+            if table is None:
+                header = read_header(self.instream)
+                if header is None:
+                    raise PakFormatError(nested_path)
+                table = load_filetable(self.instream, header)
+        except:
+            self.instream.close()
+            raise
+        self.table = table
+        self.index = None
+
+    def close(self):
+        """Release the pak file content and close the zip archive.
+
+        """
+        if self.buffer is not None:
+            if self.mapped_view is not None:
+                try:
+                    self.mapped_view.release()
+                except BufferError:
+                    pass
+            self.mapped_view = None
+            self.buffer = None
+        MappableFile.close(self)
+
+    @property
+    def view(self):
+        """View of the pak file content, if it is in memory or mapped.
+
+        :returns: view of the content, or None if not available
+        :rtype:   memoryview or None
+
+        """
+        # 2.6 COMPAT: Python 2 memoryviews can't be released, so they are
+        # never handed out.
+        if (self.buffer is not None and use_mmap and
+                hasattr(memoryview, 'release')):
+            if self.mapped_view is None:
+                self.mapped_view = memoryview(self.buffer)
+            return self.mapped_view
+        return MappableFile.view.fget(self)
+
+def read_embedded_filetable(outer, base, length, nested_path):
+    """Read the file table of a pak file stored uncompressed in a zip archive.
+
+    :param outer:       the zip archive
+    :type outer:        :class:`ZipArchive`
+    :param base:        offset of the pak file content in the zip archive
+    :type base:         int
+    :param length:      length of the pak file
+    :type length:       int
+    :param nested_path: path of the pak file inside the zip archive
+    :type nested_path:  str
+
+    :returns: file table, with offsets relative to the start of the zip
+              archive
+    :rtype:   :class:`FileTable`
+
+    :raises PakFormatError: if the file is not a pak file
+
+    :raises IOError: if there is an error reading the zip archive, or the file
+                     table doesn't fit in the pak file
+
+    """
+    header_len = len(PAK_FILE_SIGNATURE) + 2 * UNSIGNED_INT_LEN
+    header = None
+    if length >= header_len:
+        header = read_header(io.BytesIO(outer.read_range(base, header_len)))
+    if header is None:
+        raise PakFormatError(nested_path)
+    (ftable_off, num_files) = header
+    table_len = num_files * TABLE_ENTRY_LEN
+    if ftable_off + table_len > length:
+        raise IOError(2, "unexpected EOF reading file table")
+    table = parse_filetable(outer.read_range(base + ftable_off, table_len),
+                            num_files)
+    table.offsets = array('I', [o + base for o in table.offsets])
+    return table
+
+def new_decompressor(compression):
+    """Make a decompressor for one gzip member or xz stream.
+
+    :param compression: "gzip" or "xz"
+    :type compression:  str
+
+    :returns: decompressor object
+    :rtype:   zlib decompressor or :class:`lzma.LZMADecompressor`
+
+    :raises IOError: if xz is asked for but the lzma module is unavailable
+
+    """
+    if compression == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if lzma is None:
+        raise IOError(errno.ENOSYS, "xz support needs the lzma module")
+    return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+if lzma is not None:
+    DECOMPRESS_ERRORS = (zlib.error, lzma.LZMAError, EOFError)
+else:
+    DECOMPRESS_ERRORS = (zlib.error, EOFError)
+
+def load_block_index(path, path_stat):
+    """Fetch the block index stored next to a compressed file.
+
+    :param path:      file path of the compressed file
+    :type path:       str
+    :param path_stat: stat result for the compressed file
+    :type path_stat:  :class:`os.stat_result`
+
+    :returns: compressed offsets and uncompressed offsets of the blocks, and
+              the total uncompressed length; or None if there is no valid
+              block index for the file as it is now
+    :rtype:   tuple(list(int),list(int),int) or None
+
+    """
+    try:
+        with open(path + BLOCK_INDEX_SUFFIX, 'rb') as instream:
+            stored = instream.read()
+    except IOError:
+        return None
+    if len(stored) < BLOCK_INDEX_HEADER.size:
+        return None
+    (signature, version, size, mtime, length, num_blocks,
+     checksum) = BLOCK_INDEX_HEADER.unpack_from(stored)
+    payload = stored[BLOCK_INDEX_HEADER.size:]
+    if (signature != BLOCK_INDEX_SIGNATURE or
+            version != BLOCK_INDEX_VERSION or
+            (size, mtime) != (path_stat.st_size, stat_mtime_ns(path_stat)) or
+            len(payload) != num_blocks * BLOCK_INDEX_ENTRY.size or
+            zlib.crc32(payload) & 0xffffffff != checksum):
+        return None
+    offsets = []
+    starts = []
+    for i in range(num_blocks):
+        (offset, start) = BLOCK_INDEX_ENTRY.unpack_from(
+            payload, i * BLOCK_INDEX_ENTRY.size)
+        offsets.append(offset)
+        starts.append(start)
+    return (offsets, starts, length)
+
+def save_block_index(path, path_stat, blocks):
+    """Store the block index for a compressed file next to it.
+
+    The index is written to a temporary file that then replaces any existing
+    index. Failure to write the index (for example in a read-only directory)
+    is not an error; it will just be rebuilt the next time it is needed.
+
+    :param path:      file path of the compressed file
+    :type path:       str
+    :param path_stat: stat result for the compressed file
+    :type path_stat:  :class:`os.stat_result`
+    :param blocks:    compressed offsets and uncompressed offsets of the
+                      blocks, and the total uncompressed length
+    :type blocks:     tuple(list(int),list(int),int)
+
+    """
+    (offsets, starts, length) = blocks
+    payload = b"".join([BLOCK_INDEX_ENTRY.pack(o, s)
+                        for (o, s) in zip(offsets, starts)])
+    header = BLOCK_INDEX_HEADER.pack(BLOCK_INDEX_SIGNATURE, BLOCK_INDEX_VERSION,
+                                     path_stat.st_size,
+                                     stat_mtime_ns(path_stat), length,
+                                     len(offsets),
+                                     zlib.crc32(payload) & 0xffffffff)
+    index_path = path + BLOCK_INDEX_SUFFIX
+    temp_path = None
+    try:
+        (temp_fd, temp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(temp_fd, 'wb') as outstream:
+            outstream.write(header)
+            outstream.write(payload)
+        try:
+            os.rename(temp_path, index_path)
+        except OSError:
+            # Windows won't rename over an existing file.
+            os.remove(index_path)
+            os.rename(temp_path, index_path)
+        temp_path = None
+    except EnvironmentError:
+        pass
+    finally:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+class CompressedFile(io.RawIOBase):
+    """Seekable read-only file object over the content of a compressed file.
+
+    A gzip file can consist of several independently compressed members, and
+    an xz file of several independent streams; each of these is a block that
+    decompression can start from. The block index (where each block starts,
+    in the compressed file and in the uncompressed content) is built by
+    decompressing the whole file once, and stored next to it, in a file with
+    the same name plus :const:`BLOCK_INDEX_SUFFIX`, for later use.
+
+    A read then decompresses only from the start of the block that contains
+    the read position, or just continues decompressing if the position is
+    ahead of (and in the same block as) the previous read. A file compressed
+    as a single block is still readable, but each backward seek goes back to
+    the start of the file; :func:`write_compressed_pak` writes pak files in
+    blocks.
+
+    """
+
+    def __init__(self, path, compression):
+        """Initializer.
+
+        :param path:        file path of the compressed file
+        :type path:         str
+        :param compression: "gzip" or "xz"
+        :type compression:  str
+
+        :raises IOError: if the file can't be opened
+
+        """
+        io.RawIOBase.__init__(self)
+        self.name = path
+        self.compression = compression
+        self.raw = open(path, 'rb')
+        self.blocks = None
+        self.position = 0
+        self.recording = False
+
+    def close(self):
+        self.raw.close()
+        io.RawIOBase.close(self)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.get_blocks()[2]
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self.position = offset
+        return self.position
+
+    def get_blocks(self):
+        """Get the block index, loading or building it if necessary.
+
+        :returns: compressed offsets and uncompressed offsets of the blocks,
+                  and the total uncompressed length
+        :rtype:   tuple(list(int),list(int),int)
+
+        :raises IOError: if the file can't be decompressed
+
+        """
+        if self.blocks is None:
+            path_stat = os.fstat(self.raw.fileno())
+            blocks = load_block_index(self.name, path_stat)
+            if blocks is None:
+                self.blocks = ([0], [0], 0)
+                self.restart(0)
+                self.recording = True
+                try:
+                    while self.inflate_more():
+                        pass
+                finally:
+                    self.recording = False
+                blocks = (self.blocks[0], self.blocks[1], self.produced)
+                save_block_index(self.name, path_stat, blocks)
+            self.blocks = blocks
+            self.restart(0)
+        return self.blocks
+
+    def restart(self, block):
+        """Start decompressing from the beginning of a block.
+
+        :param block: position of the block in the block index
+        :type block:  int
+
+        """
+        (offsets, starts, length) = self.blocks
+        self.raw.seek(offsets[block])
+        self.feed_pos = offsets[block]
+        self.produced = starts[block]
+        self.decompressor = new_decompressor(self.compression)
+        self.new_block = False
+        self.unused = b""
+        self.pending = b""
+        self.pending_off = 0
+        self.pending_pos = self.produced
+
+    def inflate_more(self):
+        """Decompress the next piece of content.
+
+        When building the block index, the start of each block is recorded
+        as it is found.
+
+        :returns: the next piece of decompressed content, or an empty string
+                  at the end of the file
+        :rtype:   bytes
+
+        :raises IOError: if the file can't be decompressed
+
+        """
+        while True:
+            if self.unused:
+                data = self.unused
+                self.unused = b""
+            else:
+                data = self.raw.read(COMPRESSED_CHUNK_SIZE)
+            if not data:
+                return b""
+            if self.new_block:
+                if self.compression == "xz":
+                    # Skip stream padding.
+                    stripped = data.lstrip(b"\0")
+                    self.feed_pos += len(data) - len(stripped)
+                    data = stripped
+                    if not data:
+                        continue
+                self.new_block = False
+                self.decompressor = new_decompressor(self.compression)
+                if self.recording:
+                    self.blocks[0].append(self.feed_pos)
+                    self.blocks[1].append(self.produced)
+            self.feed_pos += len(data)
+            try:
+                content = self.decompressor.decompress(data)
+            except DECOMPRESS_ERRORS:
+                raise IOError(errno.EIO, "bad compressed data", self.name)
+            unused = self.decompressor.unused_data
+            if unused or getattr(self.decompressor, 'eof', False):
+                self.feed_pos -= len(unused)
+                self.unused = unused
+                self.new_block = True
+            self.produced += len(content)
+            if content:
+                return content
+
+    def readinto(self, buffer):
+        """Read content into a writable buffer.
+
+        :param buffer: buffer to fill
+        :type buffer:  bytearray or memoryview
+
+        :returns: number of bytes read, 0 at the end of the content
+        :rtype:   int
+
+        :raises IOError: if the file can't be decompressed
+
+        """
+        (offsets, starts, length) = self.get_blocks()
+        view = memoryview(buffer)
+        count = min(len(view), length - self.position)
+        if count <= 0:
+            return 0
+        block = bisect_right(starts, self.position) - 1
+        if (self.position < self.pending_pos or
+                starts[block] > self.pending_pos):
+            self.restart(block)
+        filled = 0
+        while filled < count:
+            available = len(self.pending) - self.pending_off
+            if not available:
+                self.pending = self.inflate_more()
+                self.pending_off = 0
+                if not self.pending:
+                    break
+                continue
+            if self.pending_pos < self.position:
+                # Skip ahead to the read position.
+                skip = min(available, self.position - self.pending_pos)
+                self.pending_off += skip
+                self.pending_pos += skip
+                continue
+            take = min(available, count - filled)
+            view[filled:filled + take] = self.pending[self.pending_off:
+                                                      self.pending_off + take]
+            self.pending_off += take
+            self.pending_pos += take
+            filled += take
+        self.position += filled
+        return filled
+
+class CompressedPakArchive(PakArchive):
+    """An open gzip- or xz-compressed pak file.
+
+    This supports the same interface as :class:`PakArchive`, and can likewise
+    be used as a source, so that compressed pak files don't have to be
+    decompressed to disk first. The content is read through a
+    :class:`CompressedFile`, so reading the file table or a resource only
+    decompresses the blocks that it touches. The file table is kept in the
+    index cache (if enabled) like that of any other pak file. Compressed
+    content can't be mapped, so :data:`use_mmap` has no effect here.
+
+    A string source that names a gzip or xz file is used as a
+    CompressedPakArchive automatically.
+
+    """
+
+    def __init__(self, pak_path, table=None, compression=None):
+        """Initializer.
+
+        :param pak_path:    file path of the compressed pak file
+        :type pak_path:     str
+        :param table:       file table to use instead of reading it from the
+                            pak file
+        :type table:        :class:`FileTable` or None
+        :param compression: "gzip" or "xz", or None to identify the format
+                            from the file signature
+        :type compression:  str or None
+
+        :raises PakFormatError: if the file is not a compressed pak file
+
+        :raises IOError: if there is an error reading the pak file
+
+        """
+        if compression is None:
+            compression = file_format(pak_path)
+            if compression not in ("gzip", "xz"):
+                raise PakFormatError(pak_path, "compressed pak")
+        self.path = pak_path
+        self.instream = CompressedFile(pak_path, compression)
+        self.mapped = None
+        self.mapped_view = None
+        self.map_tried = True
+        try:
+            if table is None:
+                pak_stat = None
+                if index_cache_dir is not None:
+                    pak_stat = os.stat(pak_path)
+                    table = load_cached_filetable(pak_path, pak_stat)
+                if table is None:
+                    header = read_header(self.instream)
+                    if header is None:
+                        raise PakFormatError(pak_path)
+                    table = load_filetable(self.instream, header)
+                    if pak_stat is not None:
+                        save_cached_filetable(pak_path, pak_stat, table)
+        except:
+            self.instream.close()
+            raise
+        self.table = table
+        self.index = None
+
+def write_compressed_pak(pak_path, out_path, compression="gzip",
+                         block_size=1024 * 1024):
+    """Compress a pak file in blocks, for use as a :class:`CompressedPakArchive`.
+
+    The content is compressed in independent blocks of ``block_size`` bytes:
+    separate gzip members, or separate xz streams. Either way the result can
+    still be decompressed by the usual tools. The block index is written next
+    to ``out_path`` as well, so it doesn't have to be built on first use.
+
+    :param pak_path:    file path of the pak file to compress
+    :type pak_path:     str
+    :param out_path:    file path to write the compressed pak file to
+    :type out_path:     str
+    :param compression: "gzip" or "xz"
+    :type compression:  str
+    :param block_size:  uncompressed size of each block
+    :type block_size:   int
+
+    :raises ValueError: if the compression format is unknown
+
+    :raises IOError: if there is an error reading or writing
+
+    """
+    if compression not in ("gzip", "xz"):
+        raise ValueError("unknown compression format {0!r}".format(compression))
+    if compression == "xz" and lzma is None:
+        raise IOError(errno.ENOSYS, "xz support needs the lzma module")
+    offsets = []
+    starts = []
+    length = 0
+    with open(pak_path, 'rb') as instream:
+        with open(out_path, 'wb') as outstream:
+            while True:
+                block = instream.read(block_size)
+                if not block and offsets:
+                    break
+                offsets.append(outstream.tell())
+                starts.append(length)
+                if compression == "gzip":
+                    compressor = zlib.compressobj(9, zlib.DEFLATED,
+                                                  16 + zlib.MAX_WBITS)
+                    outstream.write(compressor.compress(block))
+                    outstream.write(compressor.flush())
+                else:
+                    outstream.write(lzma.compress(block))
+                length += len(block)
+                if not block:
+                    break
+    save_block_index(out_path, os.stat(out_path), (offsets, starts, length))
+
+def file_format(path):
+    """Identify a file that might not be a plain pak file, by its signature.
+
+    :param path: file path of the file
+    :type path:  str
+
+    :returns: "zip", "gzip" or "xz" if the file starts with the signature of
+              that format, None otherwise
+    :rtype:   str or None
+
+    :raises IOError: if the file can't be read
+
+    """
+    with open(path, 'rb') as instream:
+        signature = instream.read(len(XZ_SIGNATURE))
+    if signature[:4] in (ZIP_LOCAL_SIGNATURE, ZIP_EOCD_SIGNATURE):
+        return "zip"
+    if signature[:2] == GZIP_SIGNATURE:
+        return "gzip"
+    if signature == XZ_SIGNATURE:
+        return "xz"
+    return None
+
+def open_source(source, table=None):
+    """Get an open pak file or game directory for a source.
+
+    :param source: file path of a pak file, compressed pak file, zip
+                   archive, pak file inside a zip archive or game directory,
+                   or an open archive or game directory (which is returned
+                   as-is)
+    :type source:  str or :class:`PakArchive` or :class:`GameDirectory`
+    :param table:  file table to use instead of reading it from the source
+    :type table:   :class:`FileTable` or None
+
+    :returns: the open source
+    :rtype:   :class:`PakArchive` (or a subclass) or :class:`GameDirectory`
+
+    :raises PakFormatError: if a file is not a pak file or zip archive
+
+    :raises IOError: if there is an error reading a pak file
+
+    :raises OSError: if there is an error scanning a game directory
+
+    """
+    if isinstance(source, (PakArchive, GameDirectory)):
+        return source
+    if os.path.isdir(source):
+        return GameDirectory(source, table)
+    if split_nested_path(source) is not None:
+        return NestedPakArchive(source, table)
+    compression = file_format(source)
+    if compression == "zip":
+        return ZipArchive(source, table)
+    if compression is not None:
+        return CompressedPakArchive(source, table, compression)
+    return PakArchive(source, table)
+
+# Precedence rules for :class:`PakOverlay`.
+PRECEDENCE_RULES = ('first', 'last')
+
+class PakOverlay(object):
+    """Merged index of the resources in several pak files.
+
+    When more than one of the pak files contains a resource with a given name,
+    the precedence rule decides which of them is used: "first" picks the entry
+    from the earliest pak file in the sources list, and "last" (the rule that
+    Quake itself uses when loading pak0.pak, pak1.pak, and so on) picks the
+    entry from the latest one. Within a single pak file, the first entry with
+    a given name is used.
+
+    The file tables of all the pak files are read (or fetched from the index
+    cache) when the overlay is created, but no resource content is read and no
+    pak file is kept open. A pak file that can't be read is reported (see
+    :data:`print_err`) and left out of the overlay; the ``success`` attribute
+    is False if that has happened.
+
+    """
+
+    def __init__(self, sources, precedence='last', tables=None):
+        """Initializer.
+
+        :param sources:    file paths of the pak files, or open archives, in
+                           load order
+        :type sources:     iterable(str or :class:`PakArchive`)
+        :param precedence: precedence rule, "first" or "last"
+        :type precedence:  str
+        :param tables:     file tables already known for the sources (e.g.
+                           from a :class:`PakCatalog`), with None for any
+                           source whose file table should be read; a table
+                           may be limited to the resources of interest
+        :type tables:      list(:class:`FileTable` or None) or None
+
+        :raises ValueError: if the precedence rule is unknown
+
+        """
+        if precedence not in PRECEDENCE_RULES:
+            raise ValueError("unknown precedence rule {0!r}".format(precedence))
+        self.sources = list(sources)
+        self.precedence = precedence
+        if tables is None:
+            tables = [None] * len(self.sources)
+        self.tables = [t if t is not None else read_pak_filetable(s)
+                       for (s, t) in zip(self.sources, tables)]
+        self.success = None not in self.tables
+        self.index = None
+
+    def winners(self):
+        """Get the winning entry for every resource name.
+
+        The index is built the first time this is called.
+
+        :returns: table for looking up the source position and table position
+                  of the winning entry for a resource name
+        :rtype:   dict(bytes,tuple(int,int))
+
+        """
+        if self.index is None:
+            positions = list(range(len(self.sources)))
+            if self.precedence == 'last':
+                positions.reverse()
+            index = {}
+            for source_pos in positions:
+                table = self.tables[source_pos]
+                if table is None:
+                    continue
+                for (table_pos, key) in enumerate(table.key_list()):
+                    if key not in index:
+                        index[key] = (source_pos, table_pos)
+            self.index = index
+        return self.index
+
+    def __contains__(self, name):
+        return name_key(raw_name(name)) in self.winners()
+
+    def __len__(self):
+        return len(self.winners())
+
+    def stat(self, name):
+        """Get the location of the winning entry for a resource.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: the resource's entry
+        :rtype:   :class:`PakEntry`
+
+        :raises KeyError: if the resource is not in any of the pak files
+
+        """
+        (source_pos, table_pos) = self.winners()[name_key(raw_name(name))]
+        table = self.tables[source_pos]
+        return PakEntry(table.name(table_pos), table.offsets[table_pos],
+                        table.lengths[table_pos])
+
+    def source(self, name):
+        """Get the pak file that the winning entry for a resource is in.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: file path of the pak file, or the open archive, as it was
+                  given in the sources
+        :rtype:   str or :class:`PakArchive`
+
+        :raises KeyError: if the resource is not in any of the pak files
+
+        """
+        return self.sources[self.winners()[name_key(raw_name(name))][0]]
+
+    def names(self):
+        """Get the name of every resource in the overlay.
+
+        :returns: resource names
+        :rtype:   set(str)
+
+        """
+        return set([n.decode() for n in self.winners()])
+
+    def plan(self, targets=None):
+        """Work out which entries to read from which pak files.
+
+        Only the pak files that hold the winning entry for at least one of the
+        selected resources are included in the result, so no other pak file
+        needs to be opened to read them.
+
+        :param targets: resource names to limit resource selection, or None to
+                        indicate that all resources should be selected
+        :type targets:  container(bytes) or None
+
+        :returns: pak files to read, and for each the file table and the table
+                  positions of its selected entries (in offset order)
+        :rtype:   tuple(list(str or :class:`PakArchive`),
+                  list(tuple(:class:`FileTable`,array('I'))))
+
+        """
+        index = self.winners()
+        if targets is None:
+            chosen = index.values()
+        else:
+            chosen = [index[n] for n in targets if n in index]
+        selected = [[] for s in self.sources]
+        for (source_pos, table_pos) in chosen:
+            selected[source_pos].append(table_pos)
+        sources = []
+        selections = []
+        for (source_pos, positions) in enumerate(selected):
+            if positions:
+                table = self.tables[source_pos]
+                positions.sort(key=table.offsets.__getitem__)
+                sources.append(self.sources[source_pos])
+                selections.append((table, array('I', positions)))
+        return (sources, selections)
+
+def catalog_key(pak_path):
+    """Get the values that identify the current version of a pak file.
+
+    For a pak file inside a zip archive, the zip archive is what is checked.
+
+    :param pak_path: file path of the pak file (or other archive)
+    :type pak_path:  str
+
+    :returns: size and modification time of the file, or None if it can't be
+              found
+    :rtype:   tuple(int,int) or None
+
+    """
+    split_path = split_nested_path(pak_path)
+    if split_path is not None:
+        pak_path = split_path[0]
+    try:
+        path_stat = os.stat(pak_path)
+    except OSError:
+        return None
+    return (path_stat.st_size, stat_mtime_ns(path_stat))
+
+def scan_catalog_source(pak_path):
+    """Read the file table and resource content hashes of one pak file.
+
+    This is used by :meth:`PakCatalog.update`, possibly in a worker process.
+
+    :param pak_path: file path of the pak file (or other archive)
+    :type pak_path:  str
+
+    :returns: the pak file path, its version as described for
+              :func:`catalog_key`, and its file table; plus the SHA-1
+              hexdigest of each resource's content (None for a resource
+              that can't be read), in table order. If the pak file can't be
+              read, the version and everything after it are None.
+    :rtype:   tuple(str,tuple(int,int),:class:`FileTable`,list(str or None))
+
+    """
+    key = catalog_key(pak_path)
+    try:
+        with open_source(pak_path) as pak:
+            table = pak.table
+            digests = [None] * len(table)
+            for index in table.select_order(None):
+                length = table.lengths[index]
+                try:
+                    if isinstance(pak, ZipArchive):
+                        (data_off, content_read) = pak.content_read(index)
+                    else:
+                        data_off = table.offsets[index]
+                        content_read = PlannedRead(pak, data_off,
+                                                   data_off + length)
+                    orig_data = content_read.content(data_off, length)
+                except IOError:
+                    continue
+                digests[index] = hashlib.sha1(orig_data).hexdigest()
+                if isinstance(orig_data, memoryview):
+                    orig_data.release()
+        return (pak_path, key, table, digests)
+    except PakFormatError:
+        if print_err:
+            sys.stderr.write("{0}\n".format(sys.exc_info()[1]))
+    except (IOError, OSError):
+        if print_err:
+            sys.stderr.write("{0!r} exception reading pak {1}\n".format(
+                sys.exc_info()[1], pak_path))
+    return (pak_path, None, None, None)
+
+class PakCatalog(object):
+    """SQLite database cataloging the resources of a library of pak files.
+
+    For each cataloged pak file (or zip archive, compressed pak file, or pak
+    file inside a zip archive), the catalog records the name, offset, length
+    and content hash (SHA-1) of every resource. :meth:`update` only rescans
+    pak files whose size or modification time has changed since they were
+    last cataloged. :meth:`find` answers which pak files contain a resource
+    without opening any of them.
+
+    A catalog can also be passed to :func:`process_resources`,
+    :func:`extract_resources` and :func:`iter_resources`, which will then get
+    the file table entries for the selected resources from the catalog
+    instead of reading the file table of each pak file. Game directories are
+    not cataloged.
+
+    This needs the :mod:`sqlite3` module. Use :meth:`close` (or a ``with``
+    statement) to close the database.
+
+    """
+
+    def __init__(self, db_path):
+        """Initializer.
+
+        Open the catalog database, creating it if necessary.
+
+        :param db_path: file path of the database
+        :type db_path:  str
+
+        :raises IOError: if the sqlite3 module is unavailable
+
+        :raises sqlite3.Error: if the database can't be opened
+
+        """
+        if sqlite3 is None:
+            raise IOError(errno.ENOSYS, "catalog support needs the sqlite3 "
+                          "module")
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        with self.db:
+            self.db.executescript(CATALOG_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the database.
+
+        """
+        self.db.close()
+
+    def pak_row(self, pak_path):
+        """Look up the catalog record of a pak file, if it is current.
+
+        :param pak_path: absolute file path of the pak file
+        :type pak_path:  str
+
+        :returns: id and kind ("pak" or "zip") of the record, or None if the
+                  pak file isn't cataloged or has changed since
+        :rtype:   tuple(int,str) or None
+
+        """
+        row = self.db.execute("SELECT id, kind, size, mtime FROM paks "
+                              "WHERE path = ?", (pak_path,)).fetchone()
+        if row is None or (row[2], row[3]) != catalog_key(pak_path):
+            return None
+        return (row[0], row[1])
+
+    def update(self, sources, workers=None):
+        """Bring the catalog up to date for some pak files.
+
+        Each pak file that isn't cataloged yet, or has changed since it was,
+        is scanned (reading all of its content, to hash it). If ``workers`` is
+        greater than 1, several pak files are scanned at once by a pool of
+        that many worker processes. A pak file that can't be read is reported
+        (see :data:`print_err`) and dropped from the catalog. Game directories
+        and open archives among the sources are ignored.
+
+        :param sources: file paths of the pak files
+        :type sources:  iterable(str)
+        :param workers: number of worker processes, or None to scan the pak
+                        files one at a time
+        :type workers:  int or None
+
+        :returns: file paths of the pak files that were scanned
+        :rtype:   list(str)
+
+        """
+        stale = []
+        for source in sources:
+            if not is_string(source) or os.path.isdir(source):
+                continue
+            pak_path = os.path.abspath(source)
+            if self.pak_row(pak_path) is None and pak_path not in stale:
+                stale.append(pak_path)
+        if workers is not None and workers > 1 and len(stale) > 1:
+            pool = worker_pool(min(workers, len(stale)), None)
+            try:
+                for result in pool.imap_unordered(scan_catalog_source, stale):
+                    self.store(*result)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for pak_path in stale:
+                self.store(*scan_catalog_source(pak_path))
+        return stale
+
+    def store(self, pak_path, key, table, digests):
+        """Replace the catalog record of a pak file.
+
+        :param pak_path: absolute file path of the pak file
+        :type pak_path:  str
+        :param key:      version of the pak file, as described for
+                         :func:`catalog_key`, or None to just drop the record
+        :type key:       tuple(int,int) or None
+        :param table:    file table of the pak file
+        :type table:     :class:`FileTable`
+        :param digests:  content hash of each resource, in table order
+        :type digests:   list(str or None)
+
+        """
+        with self.db:
+            self.db.execute("DELETE FROM paks WHERE path = ?", (pak_path,))
+            if key is None:
+                return
+            is_zip = isinstance(table, ZipTable)
+            cursor = self.db.execute(
+                "INSERT INTO paks (path, kind, size, mtime) VALUES (?, ?, ?, ?)",
+                (pak_path, is_zip and "zip" or "pak", key[0], key[1]))
+            pak_id = cursor.lastrowid
+            rows = []
+            for (i, name) in enumerate(table.name_list()):
+                if is_zip:
+                    zip_info = (table.stored_lengths[i], table.methods[i],
+                                table.crcs[i])
+                else:
+                    zip_info = (None, None, None)
+                rows.append((pak_id, i, name.decode('latin-1'),
+                             table.offsets[i], table.lengths[i],
+                             digests[i]) + zip_info)
+            self.db.executemany(
+                "INSERT INTO resources (pak_id, position, name, offset, length, "
+                "hash, stored_length, method, crc) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def find(self, name):
+        """Find the cataloged pak files that contain a resource.
+
+        :param name: resource name
+        :type name:  str or bytes
+
+        :returns: (pak file path, offset, length, content hash) tuples, for
+                  each entry with the given name
+        :rtype:   list(tuple(str,int,int,str))
+
+        """
+        name = raw_name(name).decode('latin-1')
+        return [tuple(row) for row in self.db.execute(
+            "SELECT paks.path, resources.offset, resources.length, "
+            "resources.hash FROM resources JOIN paks ON paks.id = "
+            "resources.pak_id WHERE resources.name = ? "
+            "ORDER BY paks.path, resources.position", (name,))]
+
+    def tables(self, sources, targets=None):
+        """Get file tables for some pak files from the catalog.
+
+        The tables only include the entries for the selected resources, in
+        their original table order. Sources that aren't cataloged (or have
+        changed since they were) get None instead of a table.
+
+        :param sources: file paths of the pak files, or open archives
+        :type sources:  iterable(str or :class:`PakArchive`)
+        :param targets: resource names to limit resource selection, or None to
+                        indicate that all resources should be selected
+        :type targets:  container(bytes) or None
+
+        :returns: file table (or None) for each source
+        :rtype:   list(:class:`FileTable` or None)
+
+        """
+        names = None
+        if targets is not None:
+            names = [n.decode('latin-1') for n in targets]
+        tables = []
+        for source in sources:
+            row = None
+            if is_string(source) and not os.path.isdir(source):
+                row = self.pak_row(os.path.abspath(source))
+            if row is None:
+                tables.append(None)
+                continue
+            (pak_id, kind) = row
+            query = ("SELECT position, name, offset, length, stored_length, "
+                     "method, crc FROM resources WHERE pak_id = ?")
+            if names is None:
+                entries = list(self.db.execute(query, (pak_id,)))
+            elif normalize_names:
+                # The names in the database aren't normalized, so check them
+                # all against the targets.
+                entries = [e for e in self.db.execute(query, (pak_id,))
+                           if normalize_name(e[1].encode('latin-1')) in targets]
+            else:
+                entries = []
+                # Stay well under SQLite's limit on query parameters.
+                for start in range(0, len(names), 500):
+                    chunk = names[start:start + 500]
+                    entries.extend(self.db.execute(
+                        query + " AND name IN ({0})".format(
+                            ", ".join(["?"] * len(chunk))),
+                        [pak_id] + chunk))
+            entries.sort()
+            table = FileTable(
+                b"\0".join([e[1].encode('latin-1') for e in entries]),
+                array('I', [e[2] for e in entries]),
+                array('I', [e[3] for e in entries]))
+            if kind == "zip":
+                table = ZipTable(table.names, table.offsets, table.lengths,
+                                 array('I', [e[4] for e in entries]),
+                                 array('H', [e[5] for e in entries]),
+                                 array('I', [e[6] for e in entries]))
+            tables.append(table)
+        return tables
+
+def plan_reads(table, order):
+    """Group selected resources into sequential reads.
+
+    Take the selected resources in order (normally offset order, from
+    :meth:`FileTable.select_order`). Unless :data:`coalesce_gap` is None,
+    merge each resource into the preceding read if the gap between them is no
+    larger than :data:`coalesce_gap` and the combined read would be no larger
+    than :data:`coalesce_limit`. Reads are generated as they are planned.
+
+    :param table: file table of the pak file
+    :type table:  :class:`FileTable`
+    :param order: table positions of the selected resources
+    :type order:  iterable(int)
+
+    :returns: iterator over (offset, end, positions) reads, where positions is
+              the list of table positions of resources covered by that read
+    :rtype:   iterator(tuple(int,int,list(int)))
+
+    """
+    read = None
+    for index in order:
+        file_off = table.offsets[index]
+        file_end = file_off + table.lengths[index]
+        if read is not None and coalesce_gap is not None:
+            if (file_off - read[1] <= coalesce_gap and
+                    max(read[1], file_end) - read[0] <= coalesce_limit):
+                read[1] = max(read[1], file_end)
+                read[2].append(index)
+                continue
+        if read is not None:
+            yield tuple(read)
+        read = [file_off, file_end, [index]]
+    if read is not None:
+        yield tuple(read)
+
+def advise(instream, offset, length, advice):
+    """Pass an access-pattern hint for a file region to the OS, if supported.
+
+    This uses :func:`os.posix_fadvise`, so it does nothing on platforms (or
+    Python versions) that lack that function. Errors are ignored, since the
+    hint is only an optimization.
+
+    :param instream: binary file object that will be read
+    :type instream:  file
+    :param offset:   start of the region
+    :type offset:    int
+    :param length:   length of the region, or 0 for "to the end of the file"
+    :type length:    int
+    :param advice:   name of the advice constant, e.g. "POSIX_FADV_WILLNEED"
+    :type advice:    str
+
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(instream.fileno(), offset, length, getattr(os, advice))
+    except (EnvironmentError, AttributeError, ValueError):
+        pass
+
+def advise_reads(instream, reads):
+    """Pass through planned reads, hinting each one to the OS in advance.
+
+    The whole file is marked for sequential access, and each read is marked as
+    "will need" one read ahead of when it is passed through.
+
+    :param instream: binary file object that will be read
+    :type instream:  file
+    :param reads:    planned reads, as generated by :func:`plan_reads`
+    :type reads:     iterable(tuple(int,int,list(int)))
+
+    :returns: iterator over the planned reads
+    :rtype:   iterator(tuple(int,int,list(int)))
+
+    """
+    advise(instream, 0, 0, "POSIX_FADV_SEQUENTIAL")
+    previous = None
+    for read in reads:
+        advise(instream, read[0], read[1] - read[0], "POSIX_FADV_WILLNEED")
+        if previous is not None:
+            yield previous
+        previous = read
+    if previous is not None:
+        yield previous
+
+class PlannedRead(object):
+    """One planned sequential read, done the first time its content is needed.
+
+    """
+
+    __slots__ = ('pak', 'offset', 'end', 'data')
+
+    def __init__(self, pak, offset, end):
+        """Initializer.
+
+        :param pak:    pak file to read from
+        :type pak:     :class:`PakArchive`
+        :param offset: start of the read
+        :type offset:  int
+        :param end:    end of the read
+        :type end:     int
+
+        """
+        self.pak = pak
+        self.offset = offset
+        self.end = end
+        self.data = None
+
+    def content(self, file_off, file_len):
+        """Get the content of one resource covered by this read.
+
+        If the file is mapped, the content is a slice of the mapped view.
+        Otherwise the whole read is done with a single seek and read (if it
+        hasn't been done already), and the content is sliced out of that.
+
+        :param file_off: offset of the resource
+        :type file_off:  int
+        :param file_len: length of the resource
+        :type file_len:  int
+
+        :returns: resource content
+        :rtype:   bytes or memoryview
+
+        :raises IOError: if the file ends before the content of the resource
+
+        """
+        pak_view = self.pak.view
+        if pak_view is not None:
+            orig_data = pak_view[file_off:file_off + file_len]
+        else:
+            if self.data is None:
+                self.pak.instream.seek(self.offset)
+                self.data = self.pak.instream.read(self.end - self.offset)
+            data_off = file_off - self.offset
+            orig_data = self.data[data_off:data_off + file_len]
+        if len(orig_data) != file_len:
+            if isinstance(orig_data, memoryview):
+                orig_data.release()
+            raise IOError(2, "unexpected EOF reading resource data")
+        return orig_data
+
+    def open(self, file_off, file_len, iterator=None):
+        """Get a file object for reading one resource covered by this read.
+
+        :param file_off: offset of the resource
+        :type file_off:  int
+        :param file_len: length of the resource
+        :type file_len:  int
+        :param iterator: iterator to notify of read errors, if any
+        :type iterator:  :class:`ResourceIterator` or None
+
+        :returns: file object bounded to the resource content
+        :rtype:   :class:`ResourceReader`
+
+        """
+        return ResourceReader(self.pak, file_off, file_len, iterator)
+
+class InflatedRead(object):
+    """Content of a deflated zip member, inflated ahead of time or on demand.
+
+    """
+
+    __slots__ = ('args', 'pending', 'data')
+
+    def __init__(self, args, pending=None):
+        """Initializer.
+
+        :param args:    arguments for :func:`inflate_member`
+        :type args:     tuple(bytes,int,int)
+        :param pending: result of inflating in a thread pool, if started
+        :type pending:  :class:`multiprocessing.pool.AsyncResult` or None
+
+        """
+        self.args = args
+        self.pending = pending
+        self.data = None
+
+    def content(self, file_off, file_len):
+        """Get the inflated content, waiting for (or doing) the inflating.
+
+        :param file_off: offset of the member content in the archive
+        :type file_off:  int
+        :param file_len: uncompressed length of the member
+        :type file_len:  int
+
+        :returns: member content
+        :rtype:   bytes
+
+        :raises IOError: if the content can't be inflated
+
+        """
+        if self.data is None:
+            if self.pending is not None:
+                self.data = self.pending.get()
+            else:
+                self.data = inflate_member(*self.args)
+            self.args = self.pending = None
+        return self.data
+
+    def open(self, file_off, file_len, iterator=None):
+        """Get a file object for reading the inflated content.
+
+        :param file_off: offset of the member content in the archive
+        :type file_off:  int
+        :param file_len: uncompressed length of the member
+        :type file_len:  int
+        :param iterator: iterator to notify of read errors, if any
+        :type iterator:  :class:`ResourceIterator` or None
+
+        :returns: file object over the member content
+        :rtype:   :class:`io.BytesIO`
+
+        :raises IOError: if the content can't be inflated
+
+        """
+        try:
+            return io.BytesIO(self.content(file_off, file_len))
+        except IOError:
+            if iterator is not None:
+                iterator.read_error = sys.exc_info()[1]
+            raise
+
+class ResourceReader(io.RawIOBase):
+    """Read-only file object over the content of one resource in a pak file.
+
+    Reads are bounded by the resource's region of the pak file. Content is
+    read from the pak file (or copied from the mapped view) only as it is
+    asked for, so consuming the content in fixed-size chunks with
+    :meth:`readinto` keeps memory use flat regardless of the resource size.
+
+    """
+
+    def __init__(self, pak, offset, length, iterator=None):
+        """Initializer.
+
+        :param pak:      pak file to read from
+        :type pak:       :class:`PakArchive`
+        :param offset:   offset of the resource content in the pak file
+        :type offset:    int
+        :param length:   length of the resource content
+        :type length:    int
+        :param iterator: iterator to notify of read errors, if any
+        :type iterator:  :class:`ResourceIterator` or None
+
+        """
+        io.RawIOBase.__init__(self)
+        self.pak = pak
+        self.offset = offset
+        self.length = length
+        self.iterator = iterator
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        """Read content into a writable buffer.
+
+        :param buffer: buffer to fill
+        :type buffer:  bytearray or memoryview
+
+        :returns: number of bytes read, 0 at the end of the resource
+        :rtype:   int
+
+        :raises IOError: if the pak file ends before the end of the resource
+
+        """
+        view = memoryview(buffer)
+        count = min(len(view), self.length - self.position)
+        if count <= 0:
+            return 0
+        file_off = self.offset + self.position
+        pak_view = self.pak.view
+        if pak_view is not None:
+            region = pak_view[file_off:file_off + count]
+            read_count = len(region)
+            view[:read_count] = region
+            region.release()
+        else:
+            instream = self.pak.instream
+            instream.seek(file_off)
+            try:
+                read_count = instream.readinto(view[:count])
+            except (AttributeError, TypeError):
+                # Python 2 file objects can't read into a memoryview.
+                data = instream.read(count)
+                read_count = len(data)
+                view[:read_count] = data
+        if read_count != count:
+            error = IOError(2, "unexpected EOF reading resource data")
+            if self.iterator is not None:
+                self.iterator.read_error = error
+            raise error
+        self.position += count
+        return count
+
+    def copy_to(self, outstream):
+        """Copy the rest of the content to a file inside the kernel, if possible.
+
+        This copies straight from the pak file to ``outstream`` without
+        passing the content through Python: with :func:`os.copy_file_range`
+        for a regular file, or :func:`os.splice` for a pipe (such as the stdin
+        of a subprocess), or else with :func:`os.sendfile`. That works when
+        both are real files (or pipes) and the platform supports it (Linux
+        does); otherwise nothing is copied and False is returned.
+
+        If ``outstream`` is non-blocking and fills up, the :exc:`OSError`
+        (EAGAIN) is raised after the content copied so far has been counted,
+        so the copy can be picked up again once it is writable.
+
+        :param outstream: binary file object to write to, at its current
+                          position
+        :type outstream:  file
+
+        :returns: whether all of the content was copied
+        :rtype:   bool
+
+        :raises IOError: if the pak file ends before the end of the resource
+
+        """
+        try:
+            in_fd = self.pak.instream.fileno()
+            outstream.flush()
+            out_fd = outstream.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            # Not real files (io.UnsupportedOperation is both an OSError and
+            # a ValueError).
+            return False
+        if stat.S_ISFIFO(os.fstat(out_fd).st_mode):
+            kernel_copies = ('splice', 'sendfile')
+        else:
+            kernel_copies = ('copy_file_range', 'sendfile')
+        for name in kernel_copies:
+            kernel_copy = getattr(os, name, None)
+            if kernel_copy is None:
+                continue
+            while self.position < self.length:
+                file_off = self.offset + self.position
+                count = min(self.length - self.position, 1 << 30)
+                try:
+                    if name == 'sendfile':
+                        copied = kernel_copy(out_fd, in_fd, file_off, count)
+                    else:
+                        copied = kernel_copy(in_fd, out_fd, count, file_off)
+                except OSError as e:
+                    if e.errno not in KERNEL_COPY_ERRORS:
+                        raise
+                    break
+                if not copied:
+                    error = IOError(2, "unexpected EOF reading resource data")
+                    if self.iterator is not None:
+                        self.iterator.read_error = error
+                    raise error
+                self.position += copied
+            else:
+                return True
+        return False
+
+def copy_resource(source, outstream):
+    """Write the content of a resource to a file.
+
+    If ``source`` is a :class:`ResourceReader` over a region of a pak file (or
+    a loose file in a game directory) and ``outstream`` is a real file, the
+    content is copied inside the kernel where the platform supports it; see
+    :meth:`ResourceReader.copy_to`. Otherwise it is copied in chunks.
+
+    :param source:    resource content, or a file object to read it from
+    :type source:     bytes or memoryview or file
+    :param outstream: binary file object to write to
+    :type outstream:  file
+
+    :raises IOError: if there is an error reading or writing
+
+    """
+    if not hasattr(source, 'readinto'):
+        outstream.write(source)
+        return
+    if isinstance(source, ResourceReader) and source.copy_to(outstream):
+        return
+    chunk = bytearray(COPY_CHUNK_SIZE)
+    chunk_view = memoryview(chunk)
+    while True:
+        count = source.readinto(chunk)
+        if not count:
+            break
+        outstream.write(chunk_view[:count])
+
+class Resource(object):
+    """A resource selected from a pak file, as produced by :func:`iter_resources`.
+
+    The ``name`` attribute is the resource name, and ``target_name`` is the
+    name that :func:`process_resources` would pass to a converter function for
+    this resource (which depends on the ``targets`` argument). ``pak_path``,
+    ``offset`` and ``length`` locate the resource content, which is not read
+    until :meth:`read` is called.
+
+    """
+
+    __slots__ = ('pak_path', 'raw_name', 'target_name', 'offset', 'length',
+                 'planned_read', 'iterator', 'data')
+
+    def __init__(self, pak_path, raw_name, target_name, offset, length,
+                 planned_read, iterator):
+        """Initializer.
+
+        :param pak_path:     file path of the pak file
+        :type pak_path:      str
+        :param raw_name:     resource name from the file table
+        :type raw_name:      bytes
+        :param target_name:  name to pass to a converter function
+        :type target_name:   str
+        :param offset:       offset of the resource in the pak file
+        :type offset:        int
+        :param length:       length of the resource
+        :type length:        int
+        :param planned_read: read that covers this resource
+        :type planned_read:  :class:`PlannedRead` or :class:`InflatedRead`
+        :param iterator:     iterator that produced this resource
+        :type iterator:      :class:`ResourceIterator`
+
+        """
+        self.pak_path = pak_path
+        self.raw_name = raw_name
+        self.target_name = target_name
+        self.offset = offset
+        self.length = length
+        self.planned_read = planned_read
+        self.iterator = iterator
+        self.data = None
+
+    @property
+    def name(self):
+        """Resource name.
+
+        :returns: resource name
+        :rtype:   str
+
+        """
+        return self.raw_name.decode()
+
+    def read(self):
+        """Get the resource content, reading it if necessary.
+
+        If :data:`use_mmap` is enabled, the content may be a view into the
+        mapped pak file, which is only valid until the iterator moves on to
+        the next resource.
+
+        If this raises IOError, the iterator will move on to the next pak file
+        (if any) rather than continuing with this one.
+
+        :returns: resource content
+        :rtype:   bytes or memoryview
+
+        :raises IOError: if there is an error reading the pak file
+
+        """
+        if self.data is None:
+            try:
+                self.data = self.planned_read.content(self.offset, self.length)
+            except IOError:
+                self.iterator.read_error = sys.exc_info()[1]
+                raise
+        return self.data
+
+    def open(self):
+        """Get a file object for reading the resource content incrementally.
+
+        Unlike :meth:`read`, this doesn't read all of the content at once. The
+        file object is only valid until the iterator moves on to the next
+        resource.
+
+        :returns: file object bounded to the resource content
+        :rtype:   :class:`ResourceReader` or :class:`io.BytesIO`
+
+        """
+        return self.planned_read.open(self.offset, self.length, self.iterator)
+
+    def done(self):
+        """Mark this resource as successfully processed.
+
+        If the iterator was given a set or dict of targets, remove this
+        resource's element from it, so that it will not be selected from any
+        later pak files. Otherwise do nothing.
+
+        """
+        self.iterator.mark_done(self.raw_name)
+
+    def release(self):
+        """Drop the resource content, releasing any view of a mapped file.
+
+        """
+        if isinstance(self.data, memoryview):
+            self.data.release()
+        self.data = None
+
+class ResourceIterator(object):
+    """Iterator over selected resources from pak files.
+
+    See :func:`iter_resources`. After iteration, the ``success`` attribute
+    indicates whether every pak file was read without errors.
+
+    """
+
+    def __init__(self, sources, enc_targets, targets=None, selections=None):
+        """Initializer.
+
+        :param sources:     file paths of the pak files to read, or open
+                            archives
+        :type sources:      iterable(str or :class:`PakArchive`)
+        :param enc_targets: resources to select, as described for
+                            :func:`iter_resources` and converted by
+                            :func:`encode_targets`; contents may be modified
+        :type enc_targets:  dict(bytes,(str,str)) or None
+        :param targets:     the original targets that ``enc_targets`` was
+                            converted from, if they should be brought up to
+                            date once the iteration finishes; contents may be
+                            modified
+        :type targets:      dict(str,str) or set(str) or None
+        :param selections:  for each of the sources, the file table to use
+                            instead of reading it from the pak file, and the
+                            table positions (in offset order) of the resources
+                            to select instead of selecting by ``enc_targets``
+        :type selections:   list(tuple(:class:`FileTable`,array('I'))) or None
+
+        """
+        self.enc_targets = enc_targets
+        self.targets = targets
+        self.selections = selections
+        self.success = True
+        self.read_error = None
+        self.resources = self.generate(sources)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.resources)
+        except StopIteration:
+            self.update_targets()
+            raise
+
+    # 2.6 COMPAT: Python 2 iterator protocol
+    next = __next__
+
+    def close(self):
+        """Stop the iteration early.
+
+        Close the pak file being read (if any), and bring the original targets
+        up to date.
+
+        """
+        self.resources.close()
+        self.update_targets()
+
+    def update_targets(self):
+        """Remove the resources marked as done from the original targets.
+
+        """
+        if self.targets is not None and self.targets is not self.enc_targets:
+            update_targets(self.targets, self.enc_targets)
+
+    def selects(self, raw_name):
+        """Check whether a resource is still selected by the targets.
+
+        :param raw_name: resource name from the file table
+        :type raw_name:  bytes
+
+        :returns: True if there are no targets, or the resource is one of them
+                  and hasn't been marked as done
+        :rtype:   bool
+
+        """
+        return self.enc_targets is None or name_key(raw_name) in self.enc_targets
+
+    def mark_done(self, raw_name):
+        """Remove a resource from the targets, if it is still there.
+
+        :param raw_name: resource name from the file table
+        :type raw_name:  bytes
+
+        """
+        if self.enc_targets is not None:
+            self.enc_targets.pop(name_key(raw_name), None)
+
+    def generate(self, sources):
+        """Generate the selected resources from each pak file in turn.
+
+        :param sources: file paths of the pak files to read, or open archives
+        :type sources:  iterable(str or :class:`PakArchive`)
+
+        :returns: iterator over selected resources
+        :rtype:   iterator(:class:`Resource`)
+
+        """
+        for (source_pos, source) in enumerate(sources):
+            if self.enc_targets is not None and not self.enc_targets:
+                # Nothing left to look for.
+                return
+            if self.selections is None:
+                (table, order) = (None, None)
+            else:
+                (table, order) = self.selections[source_pos]
+            pak = None
+            try:
+                pak = open_source(source, table)
+                if order is None:
+                    order = pak.table.select_order(self.enc_targets)
+                if isinstance(pak, GameDirectory):
+                    resources = self.generate_directory(pak, order)
+                elif isinstance(pak, ZipArchive):
+                    resources = self.generate_zip(pak, order)
+                else:
+                    resources = self.generate_pak(pak, order)
+                for resource in resources:
+                    yield resource
+                    resource.release()
+                    if self.read_error is not None:
+                        raise self.read_error
+            except PakFormatError:
+                self.success = False
+                if print_err:
+                    sys.stderr.write("{0}\n".format(sys.exc_info()[1]))
+            except (IOError, OSError):
+                self.read_error = None
+                self.success = False
+                if print_err:
+                    sys.stderr.write("{0!r} exception reading pak {1}\n".format(
+                        sys.exc_info()[1], getattr(source, 'path', source)))
+            finally:
+                if pak is not None and pak is not source:
+                    pak.close()
+
+    def generate_pak(self, pak, order):
+        """Generate the selected resources from one pak file, in offset order.
+
+        :param pak:   pak file to read from
+        :type pak:    :class:`PakArchive`
+        :param order: table positions of the selected resources
+        :type order:  iterable(int)
+
+        :returns: iterator over selected resources
+        :rtype:   iterator(:class:`Resource`)
+
+        """
+        table = pak.table
+        reads = advise_reads(pak.instream, plan_reads(table, order))
+        for (read_off, read_end, indices) in reads:
+            planned_read = PlannedRead(pak, read_off, read_end)
+            for index in indices:
+                raw_name = table.name(index)
+                key = name_key(raw_name)
+                if self.enc_targets is None:
+                    target_name = raw_name.decode()
+                elif key in self.enc_targets:
+                    target_name = self.enc_targets[key][1]
+                else:
+                    # Already processed from an earlier entry.
+                    continue
+                yield Resource(pak.path, raw_name, target_name,
+                               table.offsets[index], table.lengths[index],
+                               planned_read, self)
+
+    def generate_zip(self, archive, order):
+        """Generate the selected resources from one zip archive, in offset order.
+
+        Stored members are read just like pak file resources. Deflated members
+        are handed to a pool of :data:`inflate_threads` threads a little
+        ahead of when they are produced, so that inflating overlaps with the
+        processing of earlier resources.
+
+        :param archive: zip archive to read from
+        :type archive:  :class:`ZipArchive`
+        :param order:   table positions of the selected resources
+        :type order:    iterable(int)
+
+        :returns: iterator over selected resources
+        :rtype:   iterator(:class:`Resource`)
+
+        """
+        table = archive.table
+        pool = None
+        if inflate_threads > 1 and ZIP_DEFLATED in table.methods:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(inflate_threads)
+        ahead = []
+        try:
+            for index in order:
+                raw_name = table.name(index)
+                key = name_key(raw_name)
+                if self.enc_targets is None:
+                    target_name = raw_name.decode()
+                elif key in self.enc_targets:
+                    target_name = self.enc_targets[key][1]
+                else:
+                    continue
+                (data_off, content_read) = archive.content_read(index, pool)
+                ahead.append(Resource(archive.path, raw_name, target_name,
+                                      data_off, table.lengths[index],
+                                      content_read, self))
+                if len(ahead) > 2 * inflate_threads:
+                    resource = ahead.pop(0)
+                    if (self.enc_targets is None or
+                            name_key(resource.raw_name) in self.enc_targets):
+                        yield resource
+            for resource in ahead:
+                if (self.enc_targets is None or
+                        name_key(resource.raw_name) in self.enc_targets):
+                    yield resource
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def generate_directory(self, directory, order):
+        """Generate the selected resources from one game directory.
+
+        Each loose file is opened just before its resource is produced, and
+        closed once the iterator moves on.
+
+        :param directory: game directory to read from
+        :type directory:  :class:`GameDirectory`
+        :param order:     table positions of the selected resources
+        :type order:      iterable(int)
+
+        :returns: iterator over selected resources
+        :rtype:   iterator(:class:`Resource`)
+
+        """
+        table = directory.table
+        for index in order:
+            raw_name = table.name(index)
+            key = name_key(raw_name)
+            if self.enc_targets is None:
+                target_name = raw_name.decode()
+            elif key in self.enc_targets:
+                target_name = self.enc_targets[key][1]
+            else:
+                continue
+            length = table.lengths[index]
+            loose_file = directory.open_file(index)
+            try:
+                yield Resource(directory.path, raw_name, target_name, 0,
+                               length, PlannedRead(loose_file, 0, length),
+                               self)
+            finally:
+                loose_file.close()
 
-__version__ = "1.1"
+def is_single_source(sources):
+    """Check whether a sources argument specifies just one pak file.
 
+    :param sources: sources argument, as described for
+                    :func:`process_resources`
+    :type sources:  str or :class:`PakArchive` or iterable
 
-import struct
-import sys
-import os
-import errno
+    :returns: whether ``sources`` is a single path or open archive
+    :rtype:   bool
 
-# Adapter for string type differences between Python 2 & 3.
-try:
-    basestring
-    def is_string(candidate):
-        return isinstance(candidate, basestring)
-except NameError:
-    def is_string(candidate):
-        return isinstance(candidate, str)
+    """
+    return is_string(sources) or isinstance(sources, (PakArchive,
+                                                       GameDirectory))
 
-PAK_FILE_SIGNATURE = b"PACK"
-RESOURCE_NAME_LEN = 56
-UNSIGNED_INT_LEN = 4
-TABLE_ENTRY_LEN = RESOURCE_NAME_LEN + (2 * UNSIGNED_INT_LEN)
+def iter_resources(sources, targets=None, precedence=None, catalog=None):
+    """Lazily generate the selected resources in one or more pak files.
 
-#: Boolean flag that may be changed to disable or enable stderr messages; True
-#: by default. Such messages are printed when exceptions are encountered that
-#: prevent reading a pak file or processing a resource.
-print_err = True
+    This is a lower-level alternative to :func:`process_resources`. Resources
+    are produced one at a time, as :class:`Resource` objects, and their content
+    is only read when :meth:`Resource.read` is called; so a caller can stream,
+    filter, or stop early without holding all of the selected resources in
+    memory. Pak files are opened one at a time, as they are reached. Within a
+    pak file, resources are produced in offset order.
 
+    Resource selection by ``targets`` is as described for
+    :func:`process_resources`. If ``targets`` is a set or dict, calling
+    :meth:`Resource.done` marks that resource's element for removal from
+    ``targets``, which happens once the iteration finishes (or the iterator's
+    ``close`` method is called); a resource that is not marked as done will be
+    produced again if it is also found in a later pak file.
 
-def read_uint(instream):
-    """Read an unsigned int from a binary file object.
+    If ``precedence`` is "first" or "last", the file tables of all the pak files
+    are instead read up front and merged by a :class:`PakOverlay` with that
+    precedence rule, and each selected resource is only produced from the pak
+    file that wins for its name (even if it is not marked as done). Pak files
+    that don't win any selected resources are not opened again.
 
-    Read :const:`UNSIGNED_INT_LEN` bytes from the current position in the file,
-    interpret those bytes as an unsigned integer, and return the result.
+    File table entries are taken from ``catalog`` where possible, as described
+    for :func:`process_resources`.
 
-    :param instream: binary file object to read from
-    :type instream:  file
+    Errors reading a pak file are reported (see :data:`print_err`) and cause
+    that pak file to be skipped from that point on. The returned iterator has a
+    ``success`` attribute that is True if no such errors have occurred.
 
-    :returns: unsigned integer read from the file
-    :rtype:   int
+    :param sources:    file path of the pak file to read (or an open
+                       archive), or an iterable specifying multiple such paths
+                       (or archives)
+    :type sources:     str or :class:`PakArchive` or iterable
+    :param targets:    resources to select; contents may be modified
+    :type targets:     dict(str,str) or set(str) or
+                       :class:`TargetTracker` or None
+    :param precedence: precedence rule for resources found in more than one
+                       pak file, or None to take each from the first pak file
+                       where it is found and successfully processed
+    :type precedence:  str or None
+    :param catalog:    catalog to get file tables from, or None to read them
+                       from the pak files
+    :type catalog:     :class:`PakCatalog` or None
 
-    """
-    packed = instream.read(UNSIGNED_INT_LEN)
-    if len(packed) != UNSIGNED_INT_LEN:
-        raise IOError(2, "unexpected EOF reading integer")
-    return struct.unpack('I', packed)[0]
+    :returns: iterator over selected resources
+    :rtype:   :class:`ResourceIterator`
 
-def read_header(instream):
-    """Read pak header info from a binary file object.
+    :raises ValueError: if the precedence rule is unknown
 
-    Seek to the beginning of the file. If the first four bytes don't contain the
-    :const:`PAK_FILE_SIGNATURE` string then return None. Otherwise continue to
-    read the offset and size of the file table. Return the file table offset and
-    number of table entries as a tuple.
+    """
+    if is_single_source(sources):
+        sources = [sources]
+    enc_targets = encode_targets(targets)
+    if catalog is None:
+        if precedence is None:
+            return ResourceIterator(sources, enc_targets, targets)
+        tables = None
+    else:
+        sources = list(sources)
+        tables = catalog.tables(sources, enc_targets)
+        if precedence is None:
+            # Leave out the pak files known to hold nothing of interest.
+            kept = [(s, t) for (s, t) in zip(sources, tables)
+                    if t is None or len(t)]
+            return ResourceIterator([s for (s, t) in kept], enc_targets,
+                                    targets, [(t, None) for (s, t) in kept])
+    overlay = PakOverlay(sources, precedence, tables)
+    (sources, selections) = overlay.plan(enc_targets)
+    resources = ResourceIterator(sources, enc_targets, targets, selections)
+    resources.success = overlay.success
+    return resources
 
-    :param instream: binary file object to read from
-    :type instream:  file
+class TargetTracker(dict):
+    """Selected resources, tracked as they are processed.
 
-    :returns: tuple of file table offset and number of table entries if the
-              given file is a pak file, None otherwise
-    :rtype:   tuple(int,int) or None
+    This is a dict mapping the key of each resource name (see
+    :data:`normalize_names`) to a tuple of the original name and the name
+    mapping. The names are converted just once, when the tracker is made, and
+    each processed resource is removed in constant time. The tracker can be
+    passed as the ``targets`` of :func:`process_resources` and the other
+    functions any number of times, so that a resource processed in one call
+    isn't selected in later calls.
+
+    The set or dict of targets that the tracker was made from is left alone
+    until :meth:`sync` is called, which removes the elements for the resources
+    processed since the last sync.
 
     """
-    instream.seek(0)
-    file_id = instream.read(len(PAK_FILE_SIGNATURE))
-    # We don't raise IOError on a short read here... IOError is for use after
-    # we've determined it's actually a pak file.
-    if file_id != PAK_FILE_SIGNATURE:
-        return None
-    ftable_off = read_uint(instream)
-    ftable_len = read_uint(instream)
-    num_files = ftable_len // TABLE_ENTRY_LEN
-    return (ftable_off, num_files)
 
-def read_filetable(instream, header, targets):
-    """Given the header info, extract info on resources contained in a pak file.
+    def __init__(self, targets):
+        """Initializer.
 
-    Seek to the pak file table position in the file. Iterate over the file table
-    and generate a list of (name, offset, length) tuples for some number of the
-    resources in the table. If the ``targets`` argument is None, all discovered
-    resources will be included in the list; otherwise the list will be limited
-    to resources whose names are in ``targets``.
+        :param targets: resources to select, as described for
+                        :func:`process_resources`; contents will be modified
+                        by :meth:`sync`
+        :type targets:  dict(str,str) or set(str)
 
-    :param instream: binary file object to read from
-    :type instream:  file
-    :param header:   pak header info, containing the file table offset and
-                     number of entries
-    :type header:    tuple(int,int)
-    :param targets:  resource names to limit resource selection, or None to
-                     indicate that all resources should be selected
-    :type targets:   container(bytes) or None
+        """
+        if isinstance(targets, dict):
+            # 2.6 COMPAT: "dict comprehension" syntax
+            dict.__init__(self, [(name_key(raw_name(n)), (n, targets[n]))
+                                 for n in targets])
+        else:
+            dict.__init__(self, [(name_key(raw_name(n)), (n, n))
+                                 for n in targets])
+        self.targets = targets
+        self.removed = []
 
-    :returns: list of (name, offset, length) tuples for selected resources
-    :rtype:   list(tuple(bytes,int,int))
+    def __delitem__(self, key):
+        self.removed.append(self[key][0])
+        dict.__delitem__(self, key)
 
-    """
-    target_info = []
-    if targets or targets is None:
-        (ftable_off, num_files) = header
-        instream.seek(ftable_off)
-        for f in range(num_files):
-            file_name = instream.read(RESOURCE_NAME_LEN)
-            if len(file_name) != RESOURCE_NAME_LEN:
-                raise IOError(2, "unexpected EOF reading resource name")
-            # Terminate the name at the first encountered null character.
-            file_name = file_name.partition(b"\0")[0]
-            file_off = read_uint(instream)
-            file_len = read_uint(instream)
-            if targets and file_name not in targets:
-                continue
-            target = (file_name, file_off, file_len)
-            target_info.append(target)
-    return target_info
+    def pop(self, key, *default):
+        """Remove a resource, returning its original name and name mapping.
 
-def get_target_info(instream, targets):
-    """Extract info on resources contained in a pak file.
+        :param key:     key of the resource name
+        :type key:      bytes
+        :param default: value to return if the resource isn't tracked (if not
+                        given, KeyError is raised instead)
+        :type default:  object
 
-    Read the pak header information from the file. If that succeeds, return the
-    result of :func:`read_filetable`; otherwise return None.
+        :returns: original name and name mapping
+        :rtype:   tuple(str,str)
 
-    :param instream: binary file object to read from
-    :type instream:  file
-    :param targets:  resource names to limit resource selection, or None to
-                     indicate that all resources should be selected
-    :type targets:   container(bytes) or None
+        """
+        if key in self:
+            self.removed.append(self[key][0])
+        return dict.pop(self, key, *default)
 
-    :returns: list of (name, offset, length) tuples for selected resources if
-              the given file is a pak file, None otherwise
-    :rtype:   list(tuple(bytes,int,int)) or None
+    def sync(self):
+        """Remove the processed resources from the original targets.
 
-    """
-    header = read_header(instream)
-    if header is None:
-        return None
-    return read_filetable(instream, header, targets)
+        """
+        if isinstance(self.targets, dict):
+            for name in self.removed:
+                self.targets.pop(name, None)
+        else:
+            for name in self.removed:
+                self.targets.discard(name)
+        del self.removed[:]
 
 def encode_targets(targets):
     """Process the targets input to encode resource names as bytestrings.
 
-    Return None if ``targets`` is None. Otherwise return a dict generated from
-    ``targets``, where the key is a bytestring version of each resource name,
-    and the value is a tuple of the original name and the name mapping.
+    Return None if ``targets`` is None, or ``targets`` itself if it is already
+    a :class:`TargetTracker`. Otherwise return a new :class:`TargetTracker`
+    for ``targets``: a dict where the key is a bytestring version of each
+    resource name (normalized, if :data:`normalize_names` is enabled), and the
+    value is a tuple of the original name and the name mapping.
 
     :param targets: resources to select, as described for
                     :func:`process_resources`
-    :type targets:  dict(str,str) or set(str) or None
+    :type targets:  dict(str,str) or set(str) or :class:`TargetTracker`
+                    or None
 
     :returns: The encoded targets dictionary, or None.
-    :rtype:   dict(bytes,(str,str)) or None
+    :rtype:   :class:`TargetTracker` or None
 
     """
-    if targets is None:
-        return None
-    def tobytes(in_string):
-        try:
-            return in_string.encode('latin-1')
-        except AttributeError:
-            # Eh, probably already bytes.
-            return in_string
-    if isinstance(targets, dict):
-        # 2.6 COMPAT: "dict comprehension" syntax
-        return dict([(tobytes(n), (n, targets[n])) for n in targets])
-    else:
-        # 2.6 COMPAT: "dict comprehension" syntax
-        return dict([(tobytes(n), (n, n)) for n in targets])
+    if targets is None or isinstance(targets, TargetTracker):
+        return targets
+    return TargetTracker(targets)
 
 def update_targets(targets, enc_targets):
     """Update the input targets to reflect internal targets state.
 
-    Return immediately if ``targets`` is None. Otherwise modify ``targets`` to
-    ensure that it only contains elements that are still represented in
-    ``enc_targets``.
+    Return immediately if ``targets`` is None, or if it is the
+    :class:`TargetTracker` itself (which the caller syncs when it chooses).
+    Otherwise remove the elements of ``targets`` whose resources have been
+    removed from ``enc_targets`` since it was made (or last synced).
 
     :param targets:     original input for resources to select, as described for
                         :func:`process_resources`; will be modified
-    :type targets:      dict(str,str) or set(str) or None
+    :type targets:      dict(str,str) or set(str) or :class:`TargetTracker` or
+                        None
     :param enc_targets: the results of :func:`encode_targets`, possibly with
                         elements removed
-    :type enc_targets:  dict(bytes,(str,str)) or None
+    :type enc_targets:  :class:`TargetTracker` or None
 
     """
-    if targets is None:
+    if targets is None or targets is enc_targets:
         return
-    if isinstance(targets, dict):
-        new_targets = dict(enc_targets.values())
-    else:
-        new_targets = set([n[0] for n in enc_targets.values()])
-    targets.clear()
-    targets.update(new_targets)
+    enc_targets.sync()
 
-def process_resources_int(pak_path, converter, targets):
-    """Extract and process resources contained in a pak file.
+def streaming(converter):
+    """Mark a converter function as taking a file object rather than content.
 
-    Implement :func:`process_resources` for a single pak file.
+    Use this as a decorator on a converter function for
+    :func:`process_resources` that should be passed a :class:`ResourceReader`
+    as its first argument instead of the whole resource content. The reader is
+    only valid for the duration of the converter call.
 
-    See :func:`process_resources` for more discussion of the return value
-    and the handling of the ``targets`` argument.
+    :param converter: converter function that accepts a file object and a
+                      name string
+    :type converter:  function(file,str)
+
+    :returns: the same converter function
+    :rtype:   function(file,str)
+
+    """
+    converter.expak_streaming = True
+    return converter
+
+def convert_resources(resources, converter):
+    """Process resources using a converter function.
 
-    :param pak_path:  file path of the pak file to process
-    :type pak_path:   str
+    Read the content of each resource and pass it to the converter function,
+    or pass it a :class:`ResourceReader` if it is a :func:`streaming`
+    converter. Mark the resource as done if the converter function succeeds.
+
+    If the converter function returns a deferred result instead (see
+    :func:`process_resources`), the results are collected in the order that
+    the resources were handed over: before moving on to another pak file,
+    before handing over another entry with the name of a resource whose
+    result is still outstanding, and at the end.
+
+    :param resources: selected resources
+    :type resources:  :class:`ResourceIterator`
     :param converter: used to process each selected resource, as described for
                       :func:`process_resources`
-    :type converter:  function(bytes,str)
-    :param targets:   resources to select, as described for
-                      :func:`process_resources` and converted by
-                      :func:`encode_targets`; contents may be modified
-    :type targets:    dict(bytes,(str,str)) or None
+    :type converter:  function(bytes or memoryview,str)
 
-    :returns: True if no IOError exception reading the pak file and no
+    :returns: True if no IOError exception reading the pak files and no
               exception processing any resource, False otherwise
     :rtype:   bool
 
     """
-    try:
-        with open(pak_path, 'rb') as instream:
-            # Get resources to process and iterate over them.
-            target_info = get_target_info(instream, targets)
-            if target_info is None:
+    processing_exception = False
+    is_streaming = getattr(converter, 'expak_streaming', False)
+    # Resources whose converter results are deferred, in the order that they
+    # were handed to the converter function.
+    pending = []
+    pending_names = set()
+    def finish_pending():
+        failed = False
+        for (resource, result) in pending:
+            try:
+                if result.result():
+                    resource.done()
+            except:
+                failed = True
                 if print_err:
-                    sys.stderr.write("{0} is not a pak file\n".format(pak_path))
-                return False
-            processing_exception = False
-            for target in target_info:
-                # Get the individual resource info and read its content.
-                (file_name, file_off, file_len) = target
-                instream.seek(file_off)
-                orig_data = instream.read(file_len)
-                if len(orig_data) != file_len:
-                    raise IOError(2, "unexpected EOF reading resource data")
-                # Process the resource using the converter function, in the way
-                # indicated by the type of the targets argument.
-                try:
-                    if targets is None:
-                        converter(orig_data, file_name.decode())
-                    else:
-                        if converter(orig_data, targets[file_name][1]):
-                            del targets[file_name]
-                except:
-                    processing_exception = True
-                    if print_err:
-                        sys.stderr.write("{0!r} exception processing resource {1}\n".format(
-                            sys.exc_info()[1], file_name.decode()))
-        return True and not processing_exception
-    except IOError:
+                    sys.stderr.write(
+                        "{0!r} exception processing resource {1}\n".format(
+                            sys.exc_info()[1], resource.name))
+        del pending[:]
+        pending_names.clear()
+        return failed
+    for resource in resources:
+        # Settle the deferred results before moving on to another pak file, or
+        # to another entry for a resource that may already be done, so that
+        # each resource is still only processed once.
+        if pending and (resource.pak_path != pending[-1][0].pak_path or
+                        name_key(resource.raw_name) in pending_names):
+            processing_exception = finish_pending() or processing_exception
+            if not resources.selects(resource.raw_name):
+                continue
+        if is_streaming:
+            orig_data = resource.open()
+        else:
+            try:
+                orig_data = resource.read()
+            except IOError:
+                # The iterator will report this and move on to the next pak.
+                continue
+        # Process the resource using the converter function. The name passed
+        # to it depends on the type of the targets argument.
+        try:
+            result = converter(orig_data, resource.target_name)
+            if hasattr(result, 'result'):
+                pending.append((resource, result))
+                pending_names.add(name_key(resource.raw_name))
+            elif result:
+                resource.done()
+        except:
+            processing_exception = True
+            if print_err:
+                sys.stderr.write("{0!r} exception processing resource {1}\n".format(
+                    sys.exc_info()[1], resource.name))
+    if pending:
+        processing_exception = finish_pending() or processing_exception
+        # The iterator brought the targets up to date when it finished, but
+        # that was before these last resources were marked as done.
+        resources.update_targets()
+    return resources.success and not processing_exception
+
+def read_pak_filetable(pak_path):
+    """Read the file table of a pak file, reporting any problems.
+
+    A game directory is scanned for its file table instead, and a zip archive
+    has its central directory read.
+
+    :param pak_path: file path of the pak file, zip archive or game directory
+                     to read, or an open archive or game directory
+    :type pak_path:  str or :class:`PakArchive` or :class:`GameDirectory`
+
+    :returns: file table if the file is a pak file and there are no read
+              errors, None otherwise
+    :rtype:   :class:`FileTable` or None
+
+    """
+    if isinstance(pak_path, (PakArchive, GameDirectory)):
+        return pak_path.table
+    try:
+        if os.path.isdir(pak_path):
+            return scan_directory(pak_path)
+        if index_cache_dir is not None and os.path.exists(pak_path):
+            # Don't even open the pak file if its table is cached.
+            table = load_cached_filetable(pak_path, os.stat(pak_path))
+            if table is not None:
+                return table
+        with open_source(pak_path) as pak:
+            return pak.table
+    except PakFormatError:
+        if print_err:
+            sys.stderr.write("{0}\n".format(sys.exc_info()[1]))
+        return None
+    except (IOError, OSError):
         if print_err:
             sys.stderr.write("{0!r} exception reading pak {1}\n".format(
                 sys.exc_info()[1], pak_path))
-        return False
+        return None
+
+# Converter function used by the current process when it is a pool worker.
+worker_converter = None
 
-def process_resources(sources, converter, targets=None):
+def init_worker(converter, flags):
+    """Initialize a worker process for :func:`process_resources_parallel`.
+
+    :param converter: converter function to use in this worker
+    :type converter:  function(bytes or memoryview,str)
+    :param flags:     values for this module's flags
+    :type flags:      dict(str,object)
+
+    """
+    global worker_converter
+    worker_converter = converter
+    globals().update(flags)
+
+def process_pak_job(job):
+    """Process selected resources from one pak file, in a worker process.
+
+    The job only identifies the pak file by path, and the resources by a file
+    table of just the selected resources, so no resource content ever needs to
+    be passed between processes.
+
+    :param job: tuple of the pak file path, the file table of selected
+                resources, and the encoded targets for those resources (or
+                None)
+    :type job:  tuple(str,:class:`FileTable`,dict(bytes,(str,str)))
+
+    :returns: True if no IOError exception reading the pak file and no
+              exception processing any resource, False otherwise; and the
+              names of the resources that were successfully processed
+    :rtype:   tuple(bool,list(bytes))
+
+    """
+    (pak_path, table, targets) = job
+    if targets is None:
+        remaining = None
+    else:
+        remaining = targets.copy()
+    resources = ResourceIterator([pak_path], remaining,
+                                 selections=[(table, table.select_order(None))])
+    success = convert_resources(resources, worker_converter)
+    if targets is None:
+        return (success, [])
+    return (success, [n for n in targets if n not in remaining])
+
+def worker_pool(workers, converter):
+    """Create a pool of worker processes for :func:`process_resources_parallel`.
+
+    Prefer the "fork" start method where it is available, so that the
+    converter function (often a closure) is inherited by the workers rather
+    than pickled.
+
+    :param workers:   number of worker processes
+    :type workers:    int
+    :param converter: converter function for the workers to use
+    :type converter:  function(bytes or memoryview,str)
+
+    :returns: process pool
+    :rtype:   :class:`multiprocessing.pool.Pool`
+
+    """
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context('fork')
+    except (AttributeError, ValueError):
+        context = multiprocessing
+    flags = {'print_err': print_err,
+             'use_mmap': use_mmap,
+             'coalesce_gap': coalesce_gap,
+             'coalesce_limit': coalesce_limit,
+             'inflate_threads': inflate_threads,
+             'nested_pak_limit': nested_pak_limit,
+             'normalize_names': normalize_names}
+    return context.Pool(workers, init_worker, (converter, flags))
+
+def run_pak_jobs(pool, jobs, targets):
+    """Hand pak file jobs to worker processes and collect the results.
+
+    :param pool:    process pool
+    :type pool:     :class:`multiprocessing.pool.Pool`
+    :param jobs:    jobs as described for :func:`process_pak_job`
+    :type jobs:     list(tuple(str,:class:`FileTable`,dict))
+    :param targets: resources to select, as converted by
+                    :func:`encode_targets`; the successfully processed
+                    resources are removed
+    :type targets:  dict(bytes,(str,str)) or None
+
+    :returns: True if every job succeeded, False otherwise
+    :rtype:   bool
+
+    """
+    all_success = True
+    for (success, done) in pool.imap(process_pak_job, jobs):
+        all_success = success and all_success
+        for file_name in done:
+            del targets[file_name]
+    return all_success
+
+def process_resources_parallel(sources, converter, targets, workers,
+                               precedence=None, catalog=None):
+    """Extract and process resources from pak files using worker processes.
+
+    Implement :func:`process_resources` for multiple pak files and more than
+    one worker.
+
+    The file tables are read up front. If ``precedence`` is not None, each pak
+    file that wins at least one selected resource in a :class:`PakOverlay` is
+    handed to a worker along with just those resources. Otherwise, if
+    ``targets`` is None, each pak file is handed to a worker. Otherwise each
+    remaining target is assigned to the first pak file (in ``sources`` order)
+    that contains it and hasn't been tried for it yet, the pak files with
+    assigned targets are handed to workers, and this repeats with whatever
+    targets are left until there is nothing more to try. The outcome for
+    ``targets`` is the same as for processing the pak files one after the
+    other.
+
+    :param sources:    file paths of the pak files to process, or open archives
+    :type sources:     list(str or :class:`PakArchive`)
+    :param converter:  used to process each selected resource, as described
+                       for :func:`process_resources`
+    :type converter:   function(bytes or memoryview,str)
+    :param targets:    resources to select, as described for
+                       :func:`process_resources` and converted by
+                       :func:`encode_targets`; contents may be modified
+    :type targets:     dict(bytes,(str,str)) or None
+    :param workers:    number of worker processes
+    :type workers:     int
+    :param precedence: precedence rule for resources found in more than one
+                       pak file, or None
+    :type precedence:  str or None
+    :param catalog:    catalog to get file tables from, or None
+    :type catalog:     :class:`PakCatalog` or None
+
+    :returns: True if no IOError exception reading the pak files and no
+              exception processing any resource, False otherwise
+    :rtype:   bool
+
+    """
+    if catalog is None:
+        tables = [None] * len(sources)
+    else:
+        tables = catalog.tables(sources, targets)
+    if precedence is not None:
+        overlay = PakOverlay(sources, precedence, tables)
+        (sources, selections) = overlay.plan(targets)
+        if not sources:
+            return overlay.success
+        jobs = []
+        for (source, (table, order)) in zip(sources, selections):
+            if targets is None:
+                job_targets = None
+            else:
+                # 2.6 COMPAT: "dict comprehension" syntax
+                keys = table.key_list()
+                job_targets = dict([(keys[i], targets[keys[i]])
+                                    for i in order])
+            jobs.append((getattr(source, 'path', source), table.subset(order),
+                         job_targets))
+        pool = worker_pool(min(workers, len(jobs)), converter)
+        try:
+            return run_pak_jobs(pool, jobs, targets) and overlay.success
+        finally:
+            pool.close()
+            pool.join()
+    all_success = True
+    paks = []
+    for (source, table) in zip(sources, tables):
+        # Workers open each pak file for themselves, by path.
+        pak_path = getattr(source, 'path', source)
+        if table is None:
+            table = read_pak_filetable(source)
+        if table is None:
+            all_success = False
+            continue
+        if targets is None:
+            paks.append((pak_path, table, None))
+            continue
+        # Table position of the first entry for each selected resource.
+        selected = {}
+        for (i, key) in enumerate(table.key_list()):
+            if key in targets and key not in selected:
+                selected[key] = i
+        paks.append((pak_path, table, selected))
+    if not paks:
+        return all_success
+    pool = worker_pool(min(workers, len(paks)), converter)
+    try:
+        if targets is None:
+            jobs = [(p, t, None) for (p, t, s) in paks]
+            return run_pak_jobs(pool, jobs, targets) and all_success
+        # Index of the next pak to try for each remaining target.
+        next_pak = dict.fromkeys(targets, 0)
+        while True:
+            assigned = [[] for p in paks]
+            for file_name in targets:
+                for pak_index in range(next_pak[file_name], len(paks)):
+                    if file_name in paks[pak_index][2]:
+                        assigned[pak_index].append(file_name)
+                        next_pak[file_name] = pak_index + 1
+                        break
+                else:
+                    next_pak[file_name] = len(paks)
+            # 2.6 COMPAT: "dict comprehension" syntax
+            jobs = [(paks[i][0],
+                     paks[i][1].subset([paks[i][2][n] for n in assigned[i]]),
+                     dict([(n, targets[n]) for n in assigned[i]]))
+                    for i in range(len(paks)) if assigned[i]]
+            if not jobs:
+                return all_success
+            all_success = run_pak_jobs(pool, jobs, targets) and all_success
+    finally:
+        pool.close()
+        pool.join()
+
+def process_resources(sources, converter, targets=None, workers=None,
+                      precedence=None, catalog=None):
     """Extract and process resources contained in one or more pak files.
 
     The ``converter`` parameter accepts a function that will be used to process
@@ -354,10 +4021,34 @@ def process_resources(sources, converter, targets=None):
     process_resources loop, but will cause process_resources to return False
     when it finishes.
 
+    The resource content is normally a bytes object. If :data:`use_mmap` is
+    enabled it may instead be a read-only :class:`memoryview` into the mapped
+    pak file; such a view is only valid for the duration of the converter call,
+    so a converter that needs to keep the content around must copy it (for
+    example with ``bytes(orig_data)``).
+
+    Selected resources within a pak file are processed in the order of their
+    offsets in that file, and nearby resources are read together; see
+    :data:`coalesce_gap`.
+
+    A converter function marked with the :func:`streaming` decorator is passed
+    a bounded, read-only file object over the resource's region of the pak file
+    instead of the resource content, so that large resources can be consumed in
+    chunks rather than held in memory all at once.
+
     The :func:`nop_converter` function in this module is an example of a simple
     converter function that just writes out the resource content in its original
     form.
 
+    A converter function that starts work which finishes later (for example in
+    a subprocess) may return a deferred result instead of a boolean: any object
+    with a ``result()`` method that waits for the work, then returns the success
+    status or raises an exception, such as a :class:`concurrent.futures.Future`.
+    The content passed to the converter function must be fully consumed before
+    it returns, though. Deferred results are collected in the order that the
+    resources were processed, at the latest before any resource is read from
+    the next pak file, so a resource is never processed more than once.
+
     The selected resources, and the name passed to the converter function for
     each, depend on the type and content of the ``targets`` argument:
 
@@ -374,6 +4065,40 @@ def process_resources(sources, converter, targets=None):
     If the ``targets`` argument is a set or dict, the element corresponding to
     each found and successfully processed resource is removed from it.
 
+    The ``targets`` argument can also be a :class:`TargetTracker`, to select
+    the same resources across several calls (for example, one per pak file)
+    without converting the names again for each call. Each successfully
+    processed resource is then removed from the tracker straight away, but the
+    set or dict that the tracker was made from is only updated when
+    :meth:`TargetTracker.sync` is called.
+
+    If ``workers`` is greater than 1 and there are multiple sources, the pak
+    files are processed concurrently by a pool of that many worker processes,
+    one pak file per worker at a time. Workers are handed pak file paths and
+    resource offsets, and read the resource content themselves. Where the
+    "fork" process start method is not available, the converter function must
+    be picklable to be used this way. When ``targets`` is a set or dict, each
+    resource is still processed from the earliest pak file that contains it
+    (falling back to later pak files if processing fails), just as if the pak
+    files were processed one at a time. When ``targets`` is None, the order in
+    which different pak files are processed is unspecified.
+
+    If ``precedence`` is "first" or "last", the file tables of all the pak files
+    are read up front and merged by a :class:`PakOverlay` with that precedence
+    rule, before any resource content is read. Each selected resource is then
+    only processed from the pak file that wins for its name (there is no
+    falling back to other pak files if processing fails), and pak files that
+    don't win any selected resources are not opened again. Use "last" to get
+    the same result as Quake does when a later pak file overrides a resource
+    in an earlier one.
+
+    If a :class:`PakCatalog` is given as ``catalog``, the file table entries of
+    the selected resources are taken from it for each pak file that it has
+    cataloged (and that hasn't changed since), instead of being read from the
+    pak file; and a pak file that the catalog shows to hold none of the
+    selected resources is not opened at all. Use :meth:`PakCatalog.update`
+    first to catalog the pak files.
+
     This function will return True if each specified source is a pak file, is
     read without I/O errors, and is processed without converter exceptions.
     False otherwise.
@@ -386,33 +4111,48 @@ def process_resources(sources, converter, targets=None):
          done. Examining the contents of ``targets`` after the function returns
          is a good idea.
 
-    :param sources:   file path of the pak file to process, or an iterable
-                      specifying multiple such paths
-    :type sources:    str or iterable(str)
-    :param converter: used to process each selected resource, as described above
-    :type converter:  function(bytes,str)
-    :param targets:   resources to select, as described above; contents may be
-                      modified
-    :type targets:    dict(str,str) or set(str) or None
+    :param sources:    file path of the pak file to process (or an open
+                       archive), or an iterable specifying multiple such paths
+                       (or archives)
+    :type sources:     str or :class:`PakArchive` or iterable
+    :param converter:  used to process each selected resource, as described
+                       above
+    :type converter:   function(bytes or memoryview,str)
+    :param targets:    resources to select, as described above; contents may
+                       be modified
+    :type targets:     dict(str,str) or set(str) or
+                       :class:`TargetTracker` or None
+    :param workers:    number of worker processes to use for multiple sources,
+                       or None to process the sources one at a time
+    :type workers:     int or None
+    :param precedence: precedence rule for resources found in more than one
+                       pak file ("first" or "last"), or None to process each
+                       from the first pak file where it is found and
+                       successfully processed
+    :type precedence:  str or None
+    :param catalog:    catalog to get file tables from, or None to read them
+                       from the pak files
+    :type catalog:     :class:`PakCatalog` or None
 
     :returns: True if no IOError exception reading the pak file and no
               exception processing any resource, False otherwise
     :rtype:   bool
 
+    :raises ValueError: if the precedence rule is unknown
+
     """
-    enc_targets = encode_targets(targets)
-    all_success = True
-    if is_string(sources):
-        # Handle single-string input for the sources argument.
-        all_success = process_resources_int(sources, converter, enc_targets)
-    else:
-        # Handle iterable input for the sources argument.
-        for pak_path in sources:
-            success = process_resources_int(pak_path, converter, enc_targets)
-            all_success = success and all_success
-    update_targets(targets, enc_targets)
-    return all_success
+    if not is_single_source(sources) and workers is not None and workers > 1:
+        enc_targets = encode_targets(targets)
+        all_success = process_resources_parallel(list(sources), converter,
+                                                 enc_targets, workers,
+                                                 precedence, catalog)
+        update_targets(targets, enc_targets)
+        return all_success
+    return convert_resources(iter_resources(sources, targets, precedence,
+                                            catalog),
+                             converter)
 
+@streaming
 def nop_converter(orig_data, name):
     """Example converter function that writes out the unmodified resource.
 
@@ -430,10 +4170,16 @@ def nop_converter(orig_data, name):
 
     * Write the resource's contents as "grunt.wav" in that "hknight" directory.
 
+    This is a :func:`streaming` converter function, so the content is written
+    with :func:`copy_resource`, which can copy it straight from the pak file
+    to the output file without reading it into memory. (It also accepts the
+    content itself, when called directly.)
+
     This function will always return True.
 
-    :param orig_data: binary content of the resource
-    :type orig_data:  bytes
+    :param orig_data: binary content of the resource, or a file object to read
+                      it from
+    :type orig_data:  bytes or memoryview or file
     :param name:      resource name
     :type name:       str
 
@@ -450,58 +4196,60 @@ def nop_converter(orig_data, name):
             if e.errno != errno.EEXIST:
                 raise
     with open(real_path, 'wb') as outstream:
-        outstream.write(orig_data)
+        copy_resource(orig_data, outstream)
     return True
 
-def extract_resources(sources, targets=None):
+def extract_resources(sources, targets=None, precedence=None, catalog=None):
     """Extract resources contained in one or more pak files.
 
     Convenience function for invoking :func:`process_resources` with the
     :func:`nop_converter` function as the converter argument.
 
     See :func:`process_resources` for more discussion of the return value
-    and the handling of the ``targets`` argument.
+    and the handling of the ``targets``, ``precedence`` and ``catalog``
+    arguments.
 
-    :param sources: file path of the pak file to process, or an iterable
-                    specifying multiple such paths
-    :type sources:  str or iterable(str)
-    :param targets: resources to select, as described for
-                    :func:`process_resources`; contents may be modified
-    :type targets:  dict(str,str) or set(str) or None
+    :param sources:    file path of the pak file to process (or an open
+                       archive), or an iterable specifying multiple such paths
+                       (or archives)
+    :type sources:     str or :class:`PakArchive` or iterable
+    :param targets:    resources to select, as described for
+                       :func:`process_resources`; contents may be modified
+    :type targets:     dict(str,str) or set(str) or
+                       :class:`TargetTracker` or None
+    :param precedence: precedence rule for resources found in more than one
+                       pak file, as described for :func:`process_resources`
+    :type precedence:  str or None
+    :param catalog:    catalog to get file tables from, or None
+    :type catalog:     :class:`PakCatalog` or None
 
     :returns: True if no IOError exception reading the pak file and no
               exception extracting any resource, False otherwise
     :rtype:   bool
 
+    :raises ValueError: if the precedence rule is unknown
+
     """
-    return process_resources(sources, nop_converter, targets)
+    return process_resources(sources, nop_converter, targets,
+                             precedence=precedence, catalog=catalog)
 
 def resource_names_int(pak_path):
     """Return the name of every resource in a pak file.
 
     Implement :func:`resource_names` for a single pak file.
 
-    :param pak_path: file path of the pak file to read
-    :type pak_path:  str
+    :param pak_path: file path of the pak file to read, or an open archive
+    :type pak_path:  str or :class:`PakArchive`
 
     :returns: set of resource name strings if no read errors, None otherwise
     :rtype:   set(str) or None
 
     """
-    try:
-        with open(pak_path, 'rb') as instream:
-            target_info = get_target_info(instream, None)
-            if target_info is None:
-                if print_err:
-                    sys.stderr.write("{0} is not a pak file\n".format(pak_path))
-                return None
-        # 2.6 COMPAT: "set comprehension" syntax
-        return set(t[0].decode() for t in target_info)
-    except IOError:
-        if print_err:
-            sys.stderr.write("{0!r} exception reading pak {1}\n".format(
-                sys.exc_info()[1], pak_path))
+    table = read_pak_filetable(pak_path)
+    if table is None:
         return None
+    # 2.6 COMPAT: "set comprehension" syntax
+    return set(n.decode() for n in table.name_list())
 
 def resource_names(sources):
     """Return the name of every resource in one or more pak files.
@@ -510,16 +4258,17 @@ def resource_names(sources):
     files, if each specified file is a pak file and is read without I/O errors.
     Otherwise return None.
 
-    :param sources: file path of the pak file to read, or an iterable
-                    specifying multiple such paths
-    :type sources:  str or iterable(str)
+    :param sources: file path of the pak file to read (or an open archive),
+                    or an iterable specifying multiple such paths (or
+                    archives)
+    :type sources:  str or :class:`PakArchive` or iterable
 
     :returns: set of resource name strings if no read errors, None otherwise
     :rtype:   set(str) or None
 
     """
-    # Handle single-string input for the sources argument.
-    if is_string(sources):
+    # Handle single-source input for the sources argument.
+    if is_single_source(sources):
         return resource_names_int(sources)
     # Handle iterable input for the sources argument.
     all_resources = set()
@@ -530,6 +4279,329 @@ def resource_names(sources):
         all_resources.update(resources)
     return all_resources
 
+# Kinds of pattern accepted by :class:`NameSelector`.
+PATTERN_KINDS = ('glob', 'regex')
+
+# Characters that end the literal prefix of a regular expression.
+REGEX_SPECIAL = frozenset("\\.^$*+?{}[]|()")
+
+#: Matches the global flags, such as "(?i)", at the start of a regular
+#: expression.
+GLOBAL_FLAGS_RE = re.compile(r"(?:\(\?[aiLmsux]+\))*")
+
+def empty_match(compiled):
+    """Match the empty string with an expression that has the same groups.
+
+    :param compiled: compiled regular expression whose groups to copy
+    :type compiled:  :class:`re.RegexObject`
+
+    :returns: match object with the same (empty) groups as *compiled*
+    :rtype:   :class:`re.MatchObject`
+
+    """
+    names = dict((i, n) for (n, i) in compiled.groupindex.items())
+    groups = ["(?P<{0}>)".format(names[i]) if i in names else "()"
+              for i in range(1, compiled.groups + 1)]
+    return re.match("".join(groups), "")
+
+def glob_to_regex(pattern):
+    """Translate a resource name glob pattern into a regular expression.
+
+    In the pattern, "*" matches any run of characters other than "/", "**"
+    matches any run of characters, "?" matches any one character other than
+    "/", "[...]" matches one of a set of characters, and "[!...]" matches
+    one character not in the set (as for :mod:`fnmatch`; a "^" in the set is
+    just a character). Each wildcard becomes a numbered group of the regular
+    expression.
+
+    :param pattern: glob pattern
+    :type pattern:  str
+
+    :returns: equivalent regular expression, anchored at the end but not at
+              the start (as for use with :meth:`re.match`)
+    :rtype:   str
+
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "*":
+            if pattern[i + 1:i + 2] == "*":
+                parts.append("(.*)")
+                i += 1
+            else:
+                parts.append("([^/]*)")
+        elif c == "?":
+            parts.append("([^/])")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                chars = pattern[i + 1:end].replace("\\", "\\\\")
+                if chars[0] == "!":
+                    chars = "^" + chars[1:]
+                elif chars[0] == "^":
+                    chars = "\\" + chars
+                parts.append("([" + chars + "])")
+                i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts) + r"\Z"
+
+def literal_prefix(kind, pattern):
+    """Get the text that every name matched by a pattern must start with.
+
+    :param kind:    "glob" or "regex"
+    :type kind:     str
+    :param pattern: pattern, as described for :class:`NameSelector`
+    :type pattern:  str
+
+    :returns: literal prefix of the pattern (possibly empty)
+    :rtype:   str
+
+    """
+    if kind == 'glob':
+        special = "*?["
+    else:
+        special = REGEX_SPECIAL
+        # An alternative outside of any group could start with anything.
+        depth = 0
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == "\\":
+                i += 1
+            elif c == "[":
+                end = pattern.find("]", i + 2)
+                if end != -1:
+                    i = end
+            elif c == "(":
+                depth += 1
+            elif c == ")":
+                depth -= 1
+            elif c == "|" and depth == 0:
+                return ""
+            i += 1
+    for (i, c) in enumerate(pattern):
+        if c in special:
+            if kind == 'regex' and pattern[i:i + 1] in "*?{":
+                # The quantifier makes the previous character optional.
+                return pattern[:i - 1]
+            return pattern[:i]
+    return pattern
+
+class NameSelector(object):
+    """Selects resources by name patterns, and maps each to a new name.
+
+    Each pattern is either a glob (see :func:`glob_to_regex`) or a regular
+    expression (which must match the whole resource name, and must not use
+    backreferences), along with a template for the new name of each resource
+    that it matches. The template is expanded as for
+    :meth:`re.Match.expand`, so "\\1" is the text matched by the first
+    wildcard of a glob or the first group of a regular expression. If the
+    template is None, the new name is made by ``default_func`` instead. When
+    more than one pattern matches a name, the first one wins.
+
+    All of the patterns are compiled once, into a trie of their literal
+    prefixes and one combined regular expression, so checking a name takes a
+    single pass no matter how many patterns there are: the trie rules out
+    names that can't match anything, and the combined expression finds the
+    first pattern that does match. Some regular expressions that are valid
+    on their own can't be combined (two that use the same group name, or one
+    with global flags such as "(?i)"); then each pattern is tried in turn.
+
+    """
+
+    def __init__(self, patterns, default_func=None):
+        """Initializer.
+
+        :param patterns:     kind ("glob" or "regex"), pattern and name
+                             template of each selector, in priority order
+        :type patterns:      iterable(tuple(str,str,str or None))
+        :param default_func: function to produce the new name of a resource
+                             for a pattern with no template, or None to keep
+                             the resource name
+        :type default_func:  function(str) or None
+
+        :raises ValueError: if a pattern kind is unknown
+
+        :raises re.error: if a pattern is not a valid regular expression, or
+                          a template refers to a group that its pattern
+                          doesn't have
+
+        """
+        self.default_func = default_func
+        self.regexes = []
+        self.templates = []
+        self.prefix_trie = {}
+        alternatives = []
+        for (kind, pattern, template) in patterns:
+            if kind not in PATTERN_KINDS:
+                raise ValueError("unknown pattern kind {0!r}".format(kind))
+            if kind == 'glob':
+                regex = glob_to_regex(pattern)
+            else:
+                # Global flags have to stay at the start. (Older versions of
+                # Python would apply them to the whole combined expression,
+                # so don't let them in there.)
+                flags = GLOBAL_FLAGS_RE.match(pattern).group()
+                regex = flags + "(?:" + pattern[len(flags):] + r")\Z"
+                if flags:
+                    alternatives = None
+            if alternatives is not None:
+                alternatives.append("(?P<p{0}>{1})".format(len(self.regexes),
+                                                           regex))
+            try:
+                compiled = re.compile(regex)
+            except re.error as e:
+                raise re.error("pattern {0!r}: {1}".format(pattern, e))
+            if template is not None:
+                # Expand the template against an empty match that has the
+                # same groups, so that bad group references are caught here
+                # rather than on the first name that matches.
+                try:
+                    empty_match(compiled).expand(template)
+                except (re.error, IndexError) as e:
+                    raise re.error("name template {0!r} for pattern {1!r}: "
+                                   "{2}".format(template, pattern, e))
+            self.regexes.append(compiled)
+            self.templates.append(template)
+            # The trie is a dict per character; an empty-string key marks the
+            # end of some pattern's prefix.
+            node = self.prefix_trie
+            for c in literal_prefix(kind, pattern):
+                if "" in node:
+                    break
+                node = node.setdefault(c, {})
+            else:
+                node.clear()
+                node[""] = True
+        self.combined = None
+        if alternatives is not None:
+            try:
+                self.combined = re.compile("|".join(alternatives))
+            except re.error:
+                pass
+
+    def __len__(self):
+        return len(self.regexes)
+
+    def possible(self, name):
+        """Check whether a name starts with the literal prefix of any pattern.
+
+        :param name: resource name
+        :type name:  str
+
+        :returns: False if no pattern can match the name
+        :rtype:   bool
+
+        """
+        node = self.prefix_trie
+        for c in name:
+            if "" in node:
+                return True
+            node = node.get(c)
+            if node is None:
+                return False
+        return "" in node
+
+    def map_name(self, name):
+        """Get the new name for a resource, if any pattern selects it.
+
+        :param name: resource name
+        :type name:  str
+
+        :returns: new name, or None if the resource isn't selected
+        :rtype:   str or None
+
+        """
+        if not self.possible(name):
+            return None
+        if self.combined is not None:
+            match = self.combined.match(name)
+            if match is None:
+                return None
+            which = int(match.lastgroup[1:])
+        else:
+            for (which, regex) in enumerate(self.regexes):
+                if regex.match(name):
+                    break
+            else:
+                return None
+        template = self.templates[which]
+        if template is None:
+            if self.default_func is None:
+                return name
+            return self.default_func(name)
+        return self.regexes[which].match(name).expand(template)
+
+    def select(self, names):
+        """Select resources by name.
+
+        :param names: resource names
+        :type names:  iterable(str)
+
+        :returns: new name of each selected resource, by resource name
+        :rtype:   dict(str,str)
+
+        """
+        selected = {}
+        for name in names:
+            new_name = self.map_name(name)
+            if new_name is not None:
+                selected[name] = new_name
+        return selected
+
+def select_resources(sources, selector, catalog=None):
+    """Find the resources in one or more pak files that patterns select.
+
+    The file table of each pak file is read (or taken from ``catalog``, as
+    described for :func:`process_resources`) and checked against the
+    :class:`NameSelector` in one pass. The result can be used as the
+    ``targets`` of :func:`process_resources`, possibly after merging it with
+    other targets.
+
+    :param sources:  file path of the pak file to read (or an open archive),
+                     or an iterable specifying multiple such paths (or
+                     archives)
+    :type sources:   str or :class:`PakArchive` or iterable
+    :param selector: patterns to select resources by
+    :type selector:  :class:`NameSelector`
+    :param catalog:  catalog to get file tables from, or None to read them
+                     from the pak files
+    :type catalog:   :class:`PakCatalog` or None
+
+    Errors reading a pak file are reported (see :data:`print_err`), and that
+    pak file is skipped.
+
+    :returns: new name of each selected resource, by resource name
+    :rtype:   dict(str,str)
+
+    """
+    if is_single_source(sources):
+        sources = [sources]
+    sources = list(sources)
+    if catalog is None:
+        tables = [None] * len(sources)
+    else:
+        tables = catalog.tables(sources)
+    selected = {}
+    for (source, table) in zip(sources, tables):
+        if table is None:
+            table = read_pak_filetable(source)
+            if table is None:
+                continue
+        for raw_name in table.name_list():
+            name = raw_name.decode('latin-1')
+            if name not in selected:
+                new_name = selector.map_name(name)
+                if new_name is not None:
+                    selected[name] = new_name
+    return selected
+
 def usage():
     """Print the usage message for :func:`simple_expak`.
 
@@ -587,6 +4659,16 @@ def simple_expak(argv=None):
     extracted, then :program:`simple_expak` will print a list of such resources
     once it is done.
 
+    If the ``EXPAK_INDEX_CACHE`` environment variable is set to a directory
+    path, the parsed file table of each pak file is cached in that directory
+    (see :data:`expak.index_cache_dir`), which speeds up later runs against
+    the same pak files.
+
+    If the ``EXPAK_CATALOG`` environment variable is set to a file path, a
+    :class:`expak.PakCatalog` database at that path is brought up to date for
+    the specified pak files and then used to find the resources, so that pak
+    files which don't hold any of them are not opened.
+
     An I/O error during reading a pak file or writing an extracted resource will
     not prevent :program:`simple_expak` from continuing with other pak files or
     resources. Once :program:`simple_expak` is done processing as many
@@ -618,7 +4700,13 @@ def simple_expak(argv=None):
     if not targets:
         targets = None
     # Extract those resources from those pak files.
-    success = extract_resources(pak_paths, targets)
+    catalog_path = os.environ.get("EXPAK_CATALOG")
+    if catalog_path:
+        with PakCatalog(catalog_path) as catalog:
+            catalog.update(pak_paths)
+            success = extract_resources(pak_paths, targets, catalog=catalog)
+    else:
+        success = extract_resources(pak_paths, targets)
     # Print any specified resources not found/extracted.
     if targets:
         print("not found (or not successfully extracted):")
@@ -282,7 +282,7 @@ def print_modules_info():
         verbose_print("    expak: from system library (version {0})".format(
             processing.expak_version))
     else:
-        verbose_print("    expak: not found in system library; "
+        verbose_print("    expak: not found (or too old) in system library; "
                       "using bundled (version {0})".format(
             processing.expak_version))
     if resources.pkg_resources_source == "system":
@@ -311,6 +311,24 @@ def default_sound_name(resource_name):
         base_name = resource_name
     return os.path.join(*base_name.split("/"))
 
+def default_target_name(target):
+    """Function for generating sound_name when reading the targets table.
+
+    Like :func:`default_sound_name`, except that a pattern entry (see
+    :func:`processing.make_selector`) gets an empty value, meaning that each
+    sound it selects will get its own default name.
+
+    :param target: key from the targets table
+    :type target:  str
+
+    :returns: default value for the targets table entry
+    :rtype:   str
+
+    """
+    if processing.is_selector(target):
+        return ""
+    return default_sound_name(target)
+
 def main(argv):
     """Control flow for reading the config settings and processing sounds.
 
@@ -338,6 +356,8 @@ def main(argv):
     :raises config.TooManySubstitutions: if a setting-evaluation loop goes on
                                          for too many iterations
 
+    :raises config.BadValue: if a setting value has the wrong form
+
     """
 
     # Grab a couple of useful paths.
@@ -382,8 +402,11 @@ def main(argv):
 
         # Get the sound selections and name mappings.
         targets_path = settings.eval('targets_path')
-        targets_table = config.read_cfg(targets_path, default_sound_name)
-        if not targets_table:
+        targets_table = config.read_cfg(targets_path, default_target_name)
+        selector = processing.make_selector(targets_table, default_sound_name)
+        if selector is False:
+            return 1
+        if not targets_table and selector is None:
             if os.path.exists(targets_path):
                 print("Nothing to process in the targets table at path: {0}".format(
                     targets_path))
@@ -393,7 +416,7 @@ def main(argv):
                 return 1
 
         # Do that voodoo that we do.
-        if not processing.go(settings, targets_table):
+        if not processing.go(settings, targets_table, selector):
             return 1
 
         # Inform of leftovers.
@@ -411,7 +434,7 @@ def main(argv):
 
 try:
     sys.exit(main(sys.argv[1:]))
-except (config.BadSetting, config.TooManySubstitutions) as e:
+except (config.BadSetting, config.TooManySubstitutions, config.BadValue) as e:
     sys.stderr.write("\nError: " + str(e) + "\n")
     sys.exit(1)
 finally:
@@ -197,6 +197,88 @@ class BadSetting(Exception):
                     "when evaluating content of setting '{1}': {2}".format(
                 self.key, self.context_key, self.context_value))
 
+class BadValue(Exception):
+    """Exception for signaling that a setting has a value of the wrong form.
+
+    """
+
+    def __init__(self, key, value, expected):
+        """Initializer.
+
+        :param key:      key of the setting
+        :type key:       str
+        :param value:    evaluated value of the setting
+        :type value:     str
+        :param expected: description of the expected form of the value
+        :type expected:  str
+
+        """
+        self.key = key
+        self.value = value
+        self.expected = expected
+
+    def __str__(self):
+        """String representation.
+
+        :returns: exception description
+        :rtype:   str
+
+        """
+        return ("setting '{0}' should be {1}; current value: {2}".format(
+            self.key, self.expected, self.value))
+
+class Template:
+    """A value prepared for repeated final token substitution.
+
+    Made by :meth:`Settings.compile_finalize`. The value is held as a list of
+    literal segments with slots for the variable tokens, so filling it in is
+    just a list join.
+
+    """
+
+    def __init__(self, context_key, value, parts, slots):
+        """Initializer.
+
+        :param context_key: key for which this value processing is being done
+                            (used in error messages)
+        :type context_key:  str
+        :param value:       value that was compiled
+        :type value:        str
+        :param parts:       literal segments, with None in place of each slot
+        :type parts:        list(str or None)
+        :param slots:       index in ``parts`` and variable name of each slot
+        :type slots:        list(tuple(int,str))
+
+        """
+        self.context_key = context_key
+        self.value = value
+        self.parts = parts
+        self.slots = slots
+        if not slots:
+            self.literal = "".join(parts)
+
+    def fill(self, var_table):
+        """Substitute values for the variable tokens.
+
+        :param var_table: values of the variable tokens
+        :type var_table:  dict(str,str)
+
+        :returns: value after token substitution
+        :rtype:   str
+
+        :raises BadSetting: if a variable token isn't in ``var_table``
+
+        """
+        if not self.slots:
+            return self.literal
+        parts = list(self.parts)
+        for (index, name) in self.slots:
+            try:
+                parts[index] = var_table[name]
+            except KeyError:
+                raise BadSetting(name, self.context_key, self.value)
+        return "".join(parts)
+
 class Settings:
     """Encapsulate config properties and methods for evaluating them.
 
@@ -397,6 +479,46 @@ class Settings:
             total_table = self.finalize_table
         return self.sub_table_tokens(context_key, total_table, value, None)
 
+    def compile_finalize(self, context_key, value, var_names):
+        """Prepare a value for repeated final token substitution.
+
+        This does the same token substitution pass as :meth:`eval_finalize`,
+        but leaves the tokens named in ``var_names`` to be filled in later by
+        :meth:`Template.fill`, which is much cheaper than calling
+        :meth:`eval_finalize` each time their values change.
+
+        :param context_key: key for which this value processing is being done
+                            (used in error messages)
+        :type context_key:  str
+        :param value:       value to process
+        :type value:        str
+        :param var_names:   names of the tokens whose values will change
+        :type var_names:    container(str)
+
+        :returns: the compiled value
+        :rtype:   :class:`Template`
+
+        :raises BadSetting: if a discovered token's name is in neither
+                            ``var_names`` nor the system-defined properties
+
+        """
+        parts = []
+        slots = []
+        pos = 0
+        for match in TOKEN_RE.finditer(value):
+            parts.append(value[pos:match.start()])
+            token_name = match.group(1)
+            if token_name in var_names:
+                slots.append((len(parts), token_name))
+                parts.append(None)
+            elif token_name in self.finalize_table:
+                parts.append(self.finalize_table[token_name])
+            else:
+                raise BadSetting(token_name, context_key, value)
+            pos = match.end()
+        parts.append(value[pos:])
+        return Template(context_key, value, parts, slots)
+
     def eval(self, key, var_table=None):
         """Look up a key's value and apply all token substitutions.
 
@@ -449,3 +571,57 @@ class Settings:
             return False
         value = self.eval(key)
         return value.lower() == "true"
+
+    def optional_int(self, key, default):
+        """Evaluate a property as an optional non-negative integer value.
+
+        Return ``default`` if the property is not defined. Otherwise return
+        the property value interpreted as a non-negative integer.
+
+        :param key:     key of the property to evaluate
+        :type key:      str
+        :param default: value to return if the property is not defined
+        :type default:  int
+
+        :returns: the key's value as an integer, or ``default``
+        :rtype:   int
+
+        :raises BadValue: if the key's value is not a non-negative integer
+
+        """
+        if not self.is_defined(key):
+            return default
+        value = self.eval(key)
+        try:
+            int_value = int(value)
+        except ValueError:
+            int_value = -1
+        if int_value < 0:
+            raise BadValue(key, value, "a non-negative integer")
+        return int_value
+
+    def optional_choice(self, key, choices, default):
+        """Evaluate a property as an optional choice from a list of words.
+
+        Return ``default`` if the property is not defined. Otherwise return
+        the property value (lowercased), which must be one of ``choices``.
+
+        :param key:     key of the property to evaluate
+        :type key:      str
+        :param choices: allowed values, in lowercase
+        :type choices:  list(str)
+        :param default: value to return if the property is not defined
+        :type default:  str
+
+        :returns: the key's value, or ``default``
+        :rtype:   str
+
+        :raises BadValue: if the key's value is not one of the choices
+
+        """
+        if not self.is_defined(key):
+            return default
+        value = self.eval(key)
+        if value.lower() not in choices:
+            raise BadValue(key, value, "one of: " + ", ".join(choices))
+        return value.lower()
@@ -23,24 +23,114 @@ import subprocess
 import sys
 import os
 import errno
+import re
+import hashlib
+import shutil
+import tempfile
 import threading
+import multiprocessing
+from collections import deque
 from util import verbose_print
 
-# Use the system-installed :mod:`expak` module if it is available. If not, try
-# to load a bundled-in copy from this application package. Save indicators of
-# which expak was used and what its version string is.
+# The fcntl module is used to make reflink copies, which only Linux supports
+# in this way, and to make pipes non-blocking for the pipe pump.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The selectors module (Python 3.4 and later) drives the pipe pump. Without
+# it, a thread is used to drain each command chain that ends in %write_to%.
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+#: Oldest :mod:`expak` version that has the features used here.
+MIN_EXPAK_VERSION = (1, 2)
+
+# Use the system-installed :mod:`expak` module if it is available and recent
+# enough. If not, try to load a bundled-in copy from this application package.
+# Save indicators of which expak was used and what its version string is.
 saved_sys_path = sys.path
 sys.path = sys.path[1:]
 try:
     import expak
     sys.path = saved_sys_path
+    expak_version_tuple = tuple(int(v) for v in expak.__version__.split(".")[:2])
+    if expak_version_tuple < MIN_EXPAK_VERSION:
+        del sys.modules['expak']
+        raise ImportError("system expak is too old")
     expak_source = "system"
-except ImportError:
+except (ImportError, ValueError):
     sys.path = saved_sys_path
+    sys.modules.pop('expak', None)
     import expak
     expak_source = "bundled"
 expak_version = expak.__version__
 
+#: Size of the chunks used to move sound data between streams.
+PUMP_CHUNK_SIZE = 64 * 1024
+
+#: Errors that mean a non-blocking pipe can't take or give more data yet.
+WOULD_BLOCK_ERRORS = frozenset([errno.EAGAIN,
+                                getattr(errno, 'EWOULDBLOCK', errno.EAGAIN)])
+
+#: Ways of filling in the output of a duplicate sound, for the
+#: dedup_conversions setting. Each one falls back on the ones after it.
+DEDUP_METHODS = ('link', 'reflink', 'copy')
+
+#: Linux ioctl request that makes a file share the blocks of another file.
+FICLONE = 0x40049409
+
+#: Command-stage elements that open and close a group of elements that a
+#: batched converter command repeats for each sound in the batch.
+BATCH_OPEN = "["
+BATCH_CLOSE = "]"
+
+#: Tokens for the sound that a group in a batched converter command is for.
+BATCH_TOKENS = ('sound_name', 'sound_input', 'sound_index')
+
+#: Number of sounds in a batch, if the batch_size setting is undefined.
+DEFAULT_BATCH_SIZE = 32
+
+#: SoX options that take a separate argument.
+SOX_ARG_OPTIONS = frozenset(['-b', '-c', '-e', '-r', '-t', '-v', '-C',
+                             '--bits', '--channels', '--encoding', '--rate',
+                             '--type', '--volume', '--compression',
+                             '--comment', '--add-comment', '--comment-file',
+                             '--endian', '--buffer', '--input-buffer',
+                             '--effects-file', '--plot', '--replay-gain',
+                             '--temp', '--play-rate-arg'])
+
+#: SoX format options, which apply only to the file that follows them. Any
+#: other option is global and applies to the whole SoX run.
+SOX_FORMAT_OPTIONS = frozenset(['-t', '-r', '-b', '-e', '-c', '-v', '-C',
+                                '-L', '-B', '-x', '-N', '-X', '--type',
+                                '--rate', '--bits', '--encoding', '--channels',
+                                '--volume', '--compression', '--comment',
+                                '--add-comment', '--comment-file', '--endian',
+                                '--reverse-nibbles', '--reverse-bits',
+                                '--reverse-bytes', '--ignore-length',
+                                '--no-glob'])
+
+#: SoX options that combine several input files. Stages that use them are
+#: never fused.
+SOX_COMBINE_OPTIONS = frozenset(['-m', '-M', '-T', '--combine'])
+
+#: SoX file names that start with a dash.
+SOX_SPECIAL_FILES = frozenset(['-', '-n', '--null', '-p', '--sox-pipe', '-d',
+                               '--default-device'])
+
+#: Ways of writing the "-t sox" format option for a SoX pipe.
+SOX_PIPE_TYPES = (['-t', 'sox'], ['--type', 'sox'], ['-tsox'], ['--type=sox'])
+
+#: Characters that make a targets table entry a glob pattern.
+GLOB_CHARS = "*?["
+
+#: Prefix that makes a targets table entry a regular expression.
+REGEX_PREFIX = "~"
+
 
 def ensure_dir(dir):
     """Atomically create a directory if it doesn't exist.
@@ -87,7 +177,8 @@ def set_working_dir(settings):
                 verbose_print("created directory: " + out_working_dir)
             os.chdir(out_working_dir)
 
-def valid_command_stage(settings, context_key, stage_args, is_last_stage):
+def valid_command_stage(settings, context_key, stage_args, is_last_stage,
+                        batched=False):
     """Test command-stage elements for possible problems.
 
     Run through the few validation checks that are possible without using any
@@ -104,6 +195,9 @@ def valid_command_stage(settings, context_key, stage_args, is_last_stage):
     :type stage_args:     list(str)
     :param is_last_stage: whether this is the final stage of the command
     :type is_last_stage:  bool
+    :param batched:       whether this is the stage of a batched command; see
+                          :func:`batch_groups`
+    :type batched:        bool
 
     :returns: whether an error was discovered
     :rtype:   bool
@@ -116,7 +210,8 @@ def valid_command_stage(settings, context_key, stage_args, is_last_stage):
                                          many iterations
 
     """
-    test_var_table = {'sound_name': "%sound_name%", 'write_to': "%write_to%"}
+    test_var_table = dict((name, "%" + name + "%")
+                          for name in BATCH_TOKENS + ('write_to',))
     test_stage_args = [settings.eval_finalize(context_key, a, test_var_table)
                        for a in stage_args]
     if not test_stage_args:
@@ -126,6 +221,13 @@ def valid_command_stage(settings, context_key, stage_args, is_last_stage):
         sys.stderr.write("    Error: "
                          "first element of converter command stage is empty\n")
         return False
+    if batched:
+        return valid_batch_stage(test_stage_args, is_last_stage)
+    for token in ("%sound_input%", "%sound_index%"):
+        if any(token in a for a in test_stage_args):
+            sys.stderr.write("    Error: " + token + " can only be used in a "
+                             "batched converter command\n")
+            return False
     if test_stage_args[0] == "%write_to%":
         if len(test_stage_args) != 2:
             sys.stderr.write("    Error: "
@@ -138,6 +240,268 @@ def valid_command_stage(settings, context_key, stage_args, is_last_stage):
                              "command will be ignored\n")
     return True
 
+def sox_files(stage_args):
+    """Find the input and output files of a SoX command stage.
+
+    Only a command with a single input file is understood; everything after
+    its output file is the effects chain.
+
+    :param stage_args: list of command-stage elements
+    :type stage_args:  list(str)
+
+    :returns: indices of the input and output file elements, or None if the
+              stage isn't a SoX command that can be taken apart this way
+    :rtype:   tuple(int,int) or None
+
+    """
+    if os.path.splitext(os.path.basename(stage_args[0]))[0].lower() != "sox":
+        return None
+    files = []
+    i = 1
+    while i < len(stage_args) and len(files) < 2:
+        a = stage_args[i]
+        if a in SOX_SPECIAL_FILES or not a.startswith("-"):
+            files.append(i)
+        elif a in SOX_COMBINE_OPTIONS or a.startswith("--combine="):
+            return None
+        elif a in SOX_ARG_OPTIONS:
+            i += 1
+        i += 1
+    if len(files) < 2:
+        return None
+    return tuple(files)
+
+def only_sox_format_options(option_args):
+    """Test whether SoX options are all format options.
+
+    :param option_args: options (and their arguments) given before a file
+    :type option_args:  list(str)
+
+    :returns: whether there are no global options among them
+    :rtype:   bool
+
+    """
+    i = 0
+    while i < len(option_args):
+        a = option_args[i]
+        if a.startswith("--"):
+            name = a.split("=", 1)[0]
+        else:
+            name = a[:2]
+        if name not in SOX_FORMAT_OPTIONS:
+            return False
+        if a == name and name in SOX_ARG_OPTIONS:
+            i += 1
+        i += 1
+    return True
+
+def is_sox_pipe(format_args, file_arg):
+    """Test whether a SoX file is stdin or stdout in SoX's own format.
+
+    :param format_args: format options given for the file
+    :type format_args:  list(str)
+    :param file_arg:    the file
+    :type file_arg:     str
+
+    :returns: whether the file is a "-t sox" pipe
+    :rtype:   bool
+
+    """
+    if file_arg in ("-p", "--sox-pipe"):
+        return not format_args
+    return file_arg == "-" and list(format_args) in SOX_PIPE_TYPES
+
+def fuse_sox_stages(settings, context_key, command_stages):
+    """Merge consecutive SoX command stages into one SoX process.
+
+    A SoX stage that writes to stdout in SoX's own format, without any other
+    output options, can be fused with a following stage that runs the same
+    SoX and reads that from stdin, without any other input options. The fused
+    stage has the input side of the first stage, the output side of the
+    second, and both effects chains one after the other. That is the same
+    processing (SoX's own format carries its samples at full precision)
+    without the extra process and pipe. Stages that use multiple effects
+    chains (":"), combine inputs, or have global options (such as --norm or
+    -G, which would then apply to both effects chains and the final output)
+    are left alone.
+
+    :param settings:       settings
+    :type settings:        :class:`config.Settings`
+    :param context_key:    key name to use in settings-eval exceptions
+    :type context_key:     str
+    :param command_stages: list of command stages, each a list of elements
+    :type command_stages:  list(list(str))
+
+    :returns: the command stages after fusion
+    :rtype:   list(list(str))
+
+    """
+    test_var_table = dict((name, "%" + name + "%")
+                          for name in BATCH_TOKENS + ('write_to',))
+    def test_eval(stage_args):
+        return [settings.eval_finalize(context_key, a, test_var_table)
+                for a in stage_args]
+    fused = []
+    for stage_args in command_stages:
+        if fused:
+            first = test_eval(fused[-1])
+            second = test_eval(stage_args)
+            first_files = sox_files(first)
+            second_files = sox_files(second)
+            if (first_files and second_files and first[0] == second[0]):
+                (first_in, first_out) = first_files
+                (second_in, second_out) = second_files
+                if (only_sox_format_options(first[1:first_in]) and
+                    only_sox_format_options(
+                        second[second_in + 1:second_out]) and
+                    is_sox_pipe(first[first_in + 1:first_out],
+                                first[first_out]) and
+                    is_sox_pipe(second[1:second_in], second[second_in]) and
+                    ":" not in first[first_out + 1:] and
+                    ":" not in second[second_out + 1:]):
+                    fused[-1] = (fused[-1][:first_in + 1] +
+                                 stage_args[second_in + 1:second_out + 1] +
+                                 fused[-1][first_out + 1:] +
+                                 stage_args[second_out + 1:])
+                    continue
+        fused.append(stage_args)
+    return fused
+
+def batch_groups(stage_args):
+    """Find the groups of elements that a batched command stage repeats for
+    each sound.
+
+    A converter command is batched if it has elements that are just
+    :const:`BATCH_OPEN` and :const:`BATCH_CLOSE`. The elements between each
+    such pair are repeated for each sound in the batch, with the
+    %sound_name%, %sound_input% (the path of a file holding the sound data)
+    and %sound_index% (the sound's position in the batch, from 0) tokens
+    evaluated for that sound. For example ffmpeg can take the inputs from one
+    group and write the outputs from another, with "-map" options using
+    %sound_index% to connect them.
+
+    :param stage_args: list of command-stage elements
+    :type stage_args:  list(str)
+
+    :returns: (start, end) slice indices of the elements inside each group
+    :rtype:   list(tuple(int,int))
+
+    :raises ValueError: if the group markers aren't in matching pairs
+
+    """
+    groups = []
+    start = None
+    for (i, a) in enumerate(stage_args):
+        if a == BATCH_OPEN:
+            if start is not None:
+                raise ValueError("nested " + BATCH_OPEN)
+            start = i + 1
+        elif a == BATCH_CLOSE:
+            if start is None:
+                raise ValueError(BATCH_CLOSE + " without " + BATCH_OPEN)
+            groups.append((start, i))
+            start = None
+    if start is not None:
+        raise ValueError(BATCH_OPEN + " without " + BATCH_CLOSE)
+    return groups
+
+def is_batch_command(command_stages):
+    """Test whether a converter command is batched; see :func:`batch_groups`.
+
+    :param command_stages: list of command stages, each a list of elements
+    :type command_stages:  list(list(str))
+
+    :returns: whether any stage has group markers
+    :rtype:   bool
+
+    """
+    return any(a in (BATCH_OPEN, BATCH_CLOSE)
+               for stage_args in command_stages for a in stage_args)
+
+def valid_batch_stage(test_stage_args, is_last_stage):
+    """Test the elements of a batched command stage for possible problems.
+
+    Helper for :func:`valid_command_stage`. If an issue is found, print about
+    it to stderr and return False.
+
+    :param test_stage_args: list of command-stage elements, after a test
+                            token substitution
+    :type test_stage_args:  list(str)
+    :param is_last_stage:   whether this is the final stage of the command
+    :type is_last_stage:    bool
+
+    :returns: whether the stage is usable
+    :rtype:   bool
+
+    """
+    if not is_last_stage:
+        sys.stderr.write("    Error: a batched converter command must have "
+                         "only one stage\n")
+        return False
+    if test_stage_args[0] in ("%write_to%", BATCH_OPEN):
+        sys.stderr.write("    Error: a batched converter command must start "
+                         "with a program\n")
+        return False
+    try:
+        groups = batch_groups(test_stage_args)
+    except ValueError as e:
+        sys.stderr.write("    Error: in batched converter command, "
+                         "{0}\n".format(e))
+        return False
+    in_group = set(i for (start, end) in groups for i in range(start, end))
+    for (i, a) in enumerate(test_stage_args):
+        for name in BATCH_TOKENS:
+            if i not in in_group and "%" + name + "%" in a:
+                sys.stderr.write("    Error: %" + name + "% can only be used "
+                                 "between " + BATCH_OPEN + " and " +
+                                 BATCH_CLOSE + "\n")
+                return False
+    if not any("%sound_input%" in a for a in test_stage_args):
+        sys.stderr.write("    Error: a batched converter command must use "
+                         "%sound_input%\n")
+        return False
+    return True
+
+def pump(instream, outstream):
+    """Copy everything from one stream to another in fixed-size chunks.
+
+    Only one chunk of :const:`PUMP_CHUNK_SIZE` bytes is held in memory at a
+    time, however much data there is to copy.
+
+    :param instream:  binary file object to read from
+    :type instream:   file
+    :param outstream: binary file object to write to
+    :type outstream:  file
+
+    """
+    chunk = bytearray(PUMP_CHUNK_SIZE)
+    chunk_view = memoryview(chunk)
+    while True:
+        count = instream.readinto(chunk)
+        if not count:
+            break
+        outstream.write(chunk_view[:count])
+
+def stream_hash(instream, prefix):
+    """Hash everything read from a stream, in fixed-size chunks.
+
+    :param instream: binary file object to read from
+    :type instream:  file
+    :param prefix:   data to hash ahead of the stream's content
+    :type prefix:    bytes
+
+    :returns: SHA-1 digest
+    :rtype:   bytes
+
+    """
+    sha1 = hashlib.sha1(prefix)
+    while True:
+        chunk = instream.read(PUMP_CHUNK_SIZE)
+        if not chunk:
+            break
+        sha1.update(chunk)
+    return sha1.digest()
+
 def writer_func(instream, outpath):
     """Function used to implement %write_to% when it needs its own thread.
 
@@ -151,23 +515,542 @@ def writer_func(instream, outpath):
 
     """
     with open(outpath, 'wb') as outstream:
-        outstream.write(instream.read())
+        pump(instream, outstream)
+
+def reflink_file(src, dst):
+    """Make a file share the content blocks of another, copy-on-write.
+
+    :param src: path of the file to share
+    :type src:  str
+    :param dst: path of the file to create
+    :type dst:  str
+
+    :returns: whether the reflink was made (this needs Linux, and a
+              filesystem that supports it)
+    :rtype:   bool
+
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        # 2.6 COMPAT: no multiple context managers in one "with"
+        with open(src, 'rb') as instream:
+            with open(dst, 'wb') as outstream:
+                fcntl.ioctl(outstream.fileno(), FICLONE, instream.fileno())
+        return True
+    except (IOError, OSError):
+        return False
+
+def fill_output(src, dst, method):
+    """Give an output file the same content as an earlier output file.
+
+    :param src:    path of the earlier output file
+    :type src:     str
+    :param dst:    path of the output file to fill in
+    :type dst:     str
+    :param method: the first of :const:`DEDUP_METHODS` to try
+    :type method:  str
+
+    :raises IOError: if the file can't be copied
+
+    :raises OSError: if an existing file at ``dst`` can't be replaced
+
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if method == 'link':
+        try:
+            os.link(src, dst)
+            return
+        except (AttributeError, OSError):
+            # No hard links on this platform or filesystem (or across
+            # filesystems).
+            pass
+    if method != 'copy' and reflink_file(src, dst):
+        return
+    shutil.copyfile(src, dst)
+
+def set_nonblocking(pipe):
+    """Put a pipe file object's file descriptor into non-blocking mode.
+
+    :param pipe: pipe file object
+    :type pipe:  file
+
+    :returns: the file descriptor
+    :rtype:   int
+
+    """
+    fd = pipe.fileno()
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    return fd
+
+class PipeFeed(object):
+    """Sends sound data into the stdin pipe of a command chain, for
+    :class:`PipePump`.
+
+    """
+
+    def __init__(self, instream, pipe):
+        """Initializer.
+
+        :param instream: file object to read the sound data from
+        :type instream:  :class:`expak.ResourceReader` or file
+        :param pipe:     stdin pipe of the first command stage
+        :type pipe:      file
+
+        """
+        self.instream = instream
+        self.pipe = pipe
+        self.fd = set_nonblocking(pipe)
+        self.kernel_copy = isinstance(instream, expak.ResourceReader)
+        self.chunk = bytearray(PUMP_CHUNK_SIZE)
+        self.pending = memoryview(self.chunk)[:0]
+        self.done = False
+        self.error = None
+
+    def step(self):
+        """Send what the pipe will take right now.
+
+        Where possible expak splices the data straight from the pak file into
+        the pipe; otherwise it goes through one chunk at a time.
+
+        :returns: whether all of the data has been sent
+        :rtype:   bool
+
+        """
+        if self.kernel_copy:
+            if self.instream.copy_to(self.pipe):
+                return True
+            self.kernel_copy = False
+        while True:
+            if not len(self.pending):
+                count = self.instream.readinto(self.chunk)
+                if not count:
+                    return True
+                self.pending = memoryview(self.chunk)[:count]
+            written = os.write(self.fd, self.pending)
+            self.pending = self.pending[written:]
+
+    def finish(self):
+        """Close the pipe, so the first stage sees the end of the data.
+
+        """
+        self.done = True
+        try:
+            self.pipe.close()
+        except (IOError, OSError):
+            pass
+
+class PipeDrain(object):
+    """Writes the stdout of a command chain's last process to a file, for
+    :class:`PipePump`; this implements a final "%write_to%" stage.
+
+    """
+
+    def __init__(self, pipe, outpath):
+        """Initializer.
+
+        If the output file can't be opened, the error is kept and the drain
+        is already finished.
+
+        :param pipe:    stdout pipe of the last process in the chain
+        :type pipe:     file
+        :param outpath: output path to write to
+        :type outpath:  str
+
+        """
+        self.pipe = pipe
+        self.fd = set_nonblocking(pipe)
+        self.done = False
+        self.error = None
+        try:
+            self.outstream = open(outpath, 'wb')
+        except IOError as e:
+            self.outstream = None
+            self.error = e
+
+    def step(self):
+        """Write out what the pipe has right now, one chunk at a time.
+
+        :returns: whether the pipe has reached the end of the data
+        :rtype:   bool
+
+        """
+        while True:
+            data = os.read(self.fd, PUMP_CHUNK_SIZE)
+            if not data:
+                return True
+            self.outstream.write(data)
+
+    def finish(self):
+        """Close the pipe and the output file.
+
+        """
+        self.done = True
+        self.pipe.close()
+        if self.outstream is None:
+            return
+        try:
+            self.outstream.close()
+        except (IOError, OSError) as e:
+            if self.error is None:
+                self.error = e
+
+class PipePump(object):
+    """Moves data through the pipes of every running command chain from a
+    single loop.
+
+    Each chain gets a :class:`PipeFeed` for its first stage's stdin and, if it
+    ends in "%write_to%", a :class:`PipeDrain` for its last process's stdout.
+    The pipes are non-blocking and at most one chunk of
+    :const:`PUMP_CHUNK_SIZE` bytes is held for each one, so any number of
+    chains can run without a thread or a whole sound's worth of buffering
+    apiece. The loop only runs while the converter function is waiting for
+    something, but it services every registered pipe while it does.
+
+    Errors from a pipe are kept on its feed or drain object instead of being
+    raised, so that they are reported for the right sound.
+
+    """
+
+    def __init__(self):
+        """Initializer.
+
+        """
+        self.selector = selectors.DefaultSelector()
+
+    def add(self, task, events):
+        """Start moving data for a feed or drain.
+
+        :param task:   the feed or drain
+        :type task:    :class:`PipeFeed` or :class:`PipeDrain`
+        :param events: selector events the task waits for
+        :type events:  int
+
+        """
+        if task.error is not None:
+            task.finish()
+            return
+        self.selector.register(task.fd, events, task)
+        self.service(task)
+
+    def feed(self, instream, pipe):
+        """Start sending sound data into the stdin pipe of a command chain.
+
+        :param instream: file object to read the sound data from
+        :type instream:  :class:`expak.ResourceReader` or file
+        :param pipe:     stdin pipe of the first command stage
+        :type pipe:      file
+
+        :returns: the feed
+        :rtype:   :class:`PipeFeed`
+
+        """
+        task = PipeFeed(instream, pipe)
+        self.add(task, selectors.EVENT_WRITE)
+        return task
+
+    def drain(self, pipe, outpath):
+        """Start writing the stdout pipe of a command chain to a file.
+
+        :param pipe:    stdout pipe of the last process in the chain
+        :type pipe:     file
+        :param outpath: output path to write to
+        :type outpath:  str
+
+        :returns: the drain
+        :rtype:   :class:`PipeDrain`
+
+        """
+        task = PipeDrain(pipe, outpath)
+        self.add(task, selectors.EVENT_READ)
+        return task
+
+    def service(self, task):
+        """Let a feed or drain move whatever data it can without blocking,
+        and retire it if it is done.
+
+        :param task: the feed or drain
+        :type task:  :class:`PipeFeed` or :class:`PipeDrain`
+
+        """
+        try:
+            if not task.step():
+                return
+        except (IOError, OSError) as e:
+            if e.errno in WOULD_BLOCK_ERRORS:
+                return
+            task.error = e
+        self.selector.unregister(task.fd)
+        task.finish()
+
+    def run_until(self, tasks):
+        """Move data for all registered pipes until some of them are done.
+
+        :param tasks: the feeds and drains to wait for
+        :type tasks:  list(:class:`PipeFeed` or :class:`PipeDrain`)
+
+        """
+        while not all(t.done for t in tasks):
+            for (key, events) in self.selector.select():
+                self.service(key.data)
+
+class Conversion(object):
+    """The command chain converting one sound, once it has been started.
+
+    This is the deferred result returned by the converter function when
+    several sounds are converted at once; see :func:`make_converter`.
+
+    """
+
+    def __init__(self, p_chain, err_files, pump=None, drain=None,
+                 writer_thread=None):
+        """Initializer.
+
+        :param p_chain:       processes of the command stages, in order
+        :type p_chain:        list(:class:`subprocess.Popen`)
+        :param err_files:     temporary files collecting the stderr output of
+                              the stages, if it isn't going straight to stderr
+        :type err_files:      list(file)
+        :param pump:          pipe pump moving the chain's data, if any
+        :type pump:           :class:`PipePump` or None
+        :param drain:         drain handling a final "%write_to%" stage
+                              through the pump, if any
+        :type drain:          :class:`PipeDrain` or None
+        :param writer_thread: thread running a final "%write_to%" stage
+                              instead, if there is no pump
+        :type writer_thread:  :class:`threading.Thread` or None
+
+        """
+        self.p_chain = p_chain
+        self.err_files = err_files
+        self.pump = pump
+        self.drain = drain
+        self.writer_thread = writer_thread
+        self.finished = False
+
+    def wait(self):
+        """Wait for all of the command stages to finish.
+
+        The pipe pump keeps the other running chains going meanwhile.
+
+        """
+        if self.finished:
+            return
+        if self.drain is not None:
+            self.pump.run_until([self.drain])
+        if self.writer_thread:
+            self.writer_thread.join()
+        for p in self.p_chain:
+            p.wait()
+        self.finished = True
+
+    def succeeded(self):
+        """Wait for the conversion, and check whether it worked.
+
+        :returns: whether every command stage exited successfully, and the
+                  output of a final "%write_to%" stage was written
+        :rtype:   bool
+
+        """
+        self.wait()
+        if self.drain is not None and self.drain.error is not None:
+            return False
+        return all(p.returncode == 0 for p in self.p_chain)
+
+    def result(self):
+        """Wait for the conversion, pass along its stderr output, and check
+        whether it worked.
+
+        :returns: whether every command stage exited successfully
+        :rtype:   bool
+
+        :raises IOError: if the output of a final "%write_to%" stage couldn't
+                         be written
+
+        """
+        self.wait()
+        for err_file in self.err_files:
+            err_file.seek(0)
+            err_output = err_file.read()
+            err_file.close()
+            if err_output:
+                sys.stderr.flush()
+                # 2.6 COMPAT: no sys.stderr.buffer in Python 2
+                getattr(sys.stderr, 'buffer', sys.stderr).write(err_output)
+        del self.err_files[:]
+        if self.drain is not None and self.drain.error is not None:
+            raise self.drain.error
+        return self.succeeded()
+
+class Batch(object):
+    """Sounds gathered up for one run of a batched converter command.
+
+    Each sound's data is staged in a file until the batch is run. If the run
+    fails, each sound in it is converted again on its own, so that success
+    or failure is still known for each sound.
+
+    """
+
+    def __init__(self, run_func):
+        """Initializer.
+
+        :param run_func: function that starts the command for a list of
+                         (sound name, input path) pairs
+        :type run_func:  function(list(tuple(str,str)))
+
+        """
+        self.run_func = run_func
+        self.members = []
+        self.conversion = None
+        self.results = None
+
+    def add(self, sound_name, input_path):
+        """Add a sound to the batch.
+
+        :param sound_name: mapped name for the sound resource
+        :type sound_name:  str
+        :param input_path: path of the file holding the sound data
+        :type input_path:  str
+
+        :returns: the deferred result for the sound
+        :rtype:   :class:`BatchMember`
+
+        """
+        self.members.append((sound_name, input_path))
+        return BatchMember(self, len(self.members) - 1)
+
+    def start(self):
+        """Start running the command for the sounds in the batch, if it
+        hasn't been started yet.
+
+        """
+        if self.conversion is None:
+            self.conversion = self.run_func(self.members)
+
+    def wait(self):
+        """Run the batch to completion, and settle the result of each sound.
+
+        """
+        if self.results is not None:
+            return
+        self.start()
+        if self.collect(self.conversion):
+            self.results = [True] * len(self.members)
+        elif len(self.members) == 1:
+            self.results = [False]
+        else:
+            self.results = [self.collect(self.run_func([m]))
+                            for m in self.members]
+        for (sound_name, input_path) in self.members:
+            try:
+                os.remove(input_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def collect(conversion):
+        """Wait for a run of the command, pass along its stderr output, and
+        check its exit status.
+
+        :param conversion: the run of the command
+        :type conversion:  :class:`Conversion`
+
+        :returns: whether the command succeeded
+        :rtype:   bool
+
+        """
+        try:
+            return conversion.result()
+        except (IOError, OSError):
+            return False
+
+class BatchMember(object):
+    """The deferred result for one sound in a :class:`Batch`.
+
+    """
+
+    def __init__(self, batch, index):
+        """Initializer.
+
+        :param batch: the batch
+        :type batch:  :class:`Batch`
+        :param index: position of the sound in the batch
+        :type index:  int
+
+        """
+        self.batch = batch
+        self.index = index
+
+    def wait(self):
+        """Wait for the batch to finish.
+
+        """
+        self.batch.wait()
+
+    def succeeded(self):
+        """Wait for the batch to finish, and check this sound's outcome.
+
+        :returns: whether the sound was converted
+        :rtype:   bool
+
+        """
+        return self.result()
+
+    def result(self):
+        """Wait for the batch to finish, and get this sound's outcome.
+
+        :returns: whether the sound was converted
+        :rtype:   bool
+
+        """
+        self.batch.wait()
+        return self.batch.results[self.index]
 
 def make_converter(settings):
     """Create the converter command used to process every selected sound.
 
     Look up the converter command value in the settings. Perform the initial
     token substitution for user-defined settings, and split the command into
-    stages. Validate the stages. Return a definition of a function that can be
-    used as an :mod:`expak` converter function, which will handle doing final
-    token substitutions on the stage definitions, spawning the stages,
-    connecting their pipes, and sending the sound data into the first stage.
+    stages. Validate the stages, and fuse consecutive SoX stages unless the
+    skip_sox_fusion setting is enabled (see :func:`fuse_sox_stages`). Return
+    a definition of a function that can be used as an :mod:`expak` converter
+    function, which will handle doing final token substitutions on the stage
+    definitions, spawning the stages, connecting their pipes, and sending the
+    sound data into the first stage. The converter function is an
+    :func:`expak.streaming` converter, so the sound data is sent along in
+    chunks as it is read from the pak file.
+
+    If the dedup_conversions setting is enabled, the converter function
+    first reads through the sound data, hashing it together with the
+    converter command, and then rewinds it. When an earlier sound with the
+    same hash has already been converted successfully (by this process), its
+    output files are linked or copied to the new output paths instead of
+    running the command again. The output paths are the command-stage
+    elements that use %sound_name%.
+
+    If the jobs setting allows more than one conversion at a time, the
+    converter function returns as soon as the sound data has been sent into
+    the command chain, with a :class:`Conversion` as its deferred result;
+    :mod:`expak` collects the results in order. Before starting another chain
+    it waits for the oldest one if that many are already running. The stderr
+    output of each chain is held back and passed along when its result is
+    collected, so that messages from different sounds don't get mixed up.
+    All of the running chains share one :class:`PipePump`, which keeps their
+    pipes moving whenever the converter function is waiting on any of them.
+
+    If the converter command is batched (see :func:`batch_groups`), the
+    converter function instead stages the sound data in a file and returns a
+    :class:`BatchMember` as its deferred result. The command is run for each
+    batch of up to batch_size sounds, and a batch that isn't full is run when
+    :mod:`expak` collects its results.
 
     :param settings: settings
     :type settings:  :class:`config.Settings`
 
     :returns: converter function, or None if the converter command is invalid
-    :rtype:   function(str,str) or None
+    :rtype:   function(file,str) or None
 
     :raises config.BadSetting: if a token name discovered during evaluation of
                                the converter setting references an undefined
@@ -176,6 +1059,10 @@ def make_converter(settings):
     :raises config.TooManySubstitutions: if token substitution goes on for too
                                          many iterations
 
+    :raises config.BadValue: if dedup_conversions is not "link", "reflink" or
+                             "copy", or jobs or batch_size is not a
+                             non-negative integer
+
     """
     # Get the raw value of the converter setting and see if it has token
     # markers. If it does, or if the dumb_converter_eval setting is enabled,
@@ -188,33 +1075,143 @@ def make_converter(settings):
         converter_key = 'converter'
     else:
         converter_key = raw_converter_val
-    reserved_names = ['sound_name', 'write_to']
+    reserved_names = list(BATCH_TOKENS) + ['write_to']
     command = settings.eval_prep(converter_key, reserved_names)
     # Split the command into stages at each pipe symbol; split the stages into
     # stage elements (executable+args) at each comma.
     command_stages = [[a.strip() for a in s.split(",")]
                       for s in command.split("|")]
     # Validate.
+    batched = is_batch_command(command_stages)
     num_stages = len(command_stages)
     for stage in range(num_stages):
         verbose_print("converter stage {0} of {1}:".format(stage + 1, num_stages))
         stage_args = command_stages[stage]
         verbose_print("    " + " ".join(stage_args))
         if not valid_command_stage(settings, converter_key, stage_args,
-                                   stage == num_stages - 1):
+                                   stage == num_stages - 1, batched):
             return None
+    # Let consecutive SoX stages run as one process, unless the settings tell
+    # us not to.
+    if not settings.optional_bool('skip_sox_fusion'):
+        fused_stages = fuse_sox_stages(settings, converter_key, command_stages)
+        if len(fused_stages) < num_stages:
+            command_stages = fused_stages
+            num_stages = len(command_stages)
+            verbose_print("fused SoX stages; converter plan is now:")
+            for stage in range(num_stages):
+                verbose_print("converter stage {0} of {1}:".format(
+                    stage + 1, num_stages))
+                verbose_print("    " + " ".join(command_stages[stage]))
+    # Compile each stage element once, so that the final token substitution
+    # for each sound only has to fill in the variable tokens.
+    var_names = BATCH_TOKENS + ('write_to',)
+    stage_templates = [[settings.compile_finalize(converter_key, a, var_names)
+                        for a in stage_args]
+                       for stage_args in command_stages]
     # Stages look good, so let's define a converter function to use them!
     skip_makedir = settings.optional_bool('skip_preconverter_makedir')
-    def converter(orig_data, sound_name):
+    # For deduplication, a sound's output is reused only for a sound that
+    # has the same data and would get the same command apart from its name.
+    # Remember the output paths of each converted sound by that hash.
+    dedup_method = settings.optional_choice('dedup_conversions',
+                                            DEDUP_METHODS, None)
+    converted = None
+    if dedup_method is not None:
+        converted = {}
+        test_var_table = dict((name, "%" + name + "%") for name in var_names)
+        test_stages = [[t.fill(test_var_table) for t in templates]
+                       for templates in stage_templates]
+        command_id = repr(test_stages)
+        if not isinstance(command_id, bytes):
+            command_id = command_id.encode('utf-8')
+        output_elements = [(stage, i)
+                           for (stage, stage_args) in enumerate(test_stages)
+                           for (i, a) in enumerate(stage_args)
+                           if "%sound_name%" in a]
+    jobs = converter_jobs(settings)
+    if jobs > 1:
+        verbose_print("running up to {0} converter commands at a time".format(
+            jobs))
+    running = deque()
+    # A batched command gathers up sounds, staging their data in files in the
+    # internal temporary directory, and runs once for each batch of them.
+    if batched:
+        batch_size = max(settings.optional_int('batch_size',
+                                               DEFAULT_BATCH_SIZE), 1)
+        verbose_print("converting up to {0} sounds per command".format(
+            batch_size))
+        staging_dir = settings.eval_finalize(converter_key, "%qs_internal%")
+        batch_stage = stage_templates[0]
+        groups = batch_groups(command_stages[0])
+        open_batch = []
+    def run_batch(members):
+        """Start a batched converter command for some sounds.
+
+        :param members: sound name and input path of each sound
+        :type members:  list(tuple(str,str))
+
+        :returns: the started command
+        :rtype:   :class:`Conversion`
+
+        """
+        stage_args = []
+        outside = 0
+        for (start, end) in groups + [(len(batch_stage) + 1, None)]:
+            stage_args.extend(t.fill({})
+                              for t in batch_stage[outside:start - 1])
+            if end is None:
+                break
+            for (index, (sound_name, input_path)) in enumerate(members):
+                var_table = {'sound_name': sound_name,
+                             'sound_input': input_path,
+                             'sound_index': str(index)}
+                stage_args.extend(t.fill(var_table)
+                                  for t in batch_stage[start:end])
+            outside = end + 1
+        err_files = []
+        stage_stderr = None
+        if jobs > 1:
+            stage_stderr = tempfile.TemporaryFile()
+            err_files.append(stage_stderr)
+        with open(os.devnull, 'rb') as stage_stdin:
+            p = subprocess.Popen(stage_args, stdin=stage_stdin,
+                                 stderr=stage_stderr)
+        return Conversion([p], err_files)
+    # Each process makes its own pipe pump when it first needs one. Pak
+    # workers are forked from this process, and a selector must not be
+    # shared across a fork, or each worker would wake up for its siblings'
+    # pipes.
+    pumps = {}
+    def process_pump():
+        """Get the pipe pump for the current process.
+
+        :returns: the pump, or None if the platform can't support one
+        :rtype:   :class:`PipePump` or None
+
+        """
+        if selectors is None or fcntl is None:
+            return None
+        pid = os.getpid()
+        if pid not in pumps:
+            pumps.clear()
+            pumps[pid] = PipePump()
+        return pumps[pid]
+    @expak.streaming
+    def converter(orig_stream, sound_name):
         """Converter function for processing sound data with a command chain.
 
         Make necessary subdirectories for the desired output file.
 
         Do final token substitution on the command stages, and spawn them
-        as processes (in the case of external utilities) or a thread (in the
-        case of a "%write_to%" command). Hook the command stages together,
-        piping stdout from one into stdin of the next. Write the sound data
-        to the stdin of the first stage.
+        as processes (in the case of external utilities). Hook the command
+        stages together, piping stdout from one into stdin of the next. Pump
+        the sound data into the stdin of the first stage, and the stdout of
+        the last process into the output file of a final "%write_to%" stage.
+        That is done by the :class:`PipePump` where the platform supports it;
+        otherwise the data is sent in with :func:`expak.copy_resource` and a
+        thread runs the "%write_to%" stage. Either way, expak splices the
+        data from the pak file into the pipe where possible.
 
         Note that any exceptions raised while executing a converter function
         will only abort that converter invocation, not the entire program.
@@ -222,14 +1219,17 @@ def make_converter(settings):
         TooManySubstitutions, in practice the command stage validation should
         have already caught such errors.
 
-        :param orig_data:  sound data from the pak file
-        :type orig_data:   str
-        :param sound_name: mapped name for the sound resource; usually the
-                           basename of the file to create
-        :type sound_name:  str
+        :param orig_stream: file object for reading the sound data from the
+                            pak file; not valid after this function returns
+        :type orig_stream:  :class:`expak.ResourceReader`
+        :param sound_name:  mapped name for the sound resource; usually the
+                            basename of the file to create
+        :type sound_name:   str
 
-        :returns: True
-        :rtype:   bool
+        :returns: whether the conversion succeeded, or the started
+                  conversion if more than one can run at a time, or the
+                  sound's place in a batch for a batched command
+        :rtype:   bool or :class:`Conversion` or :class:`BatchMember`
 
         :raises config.BadSetting: if a token name discovered during final
                                    evaluation of the converter setting
@@ -250,12 +1250,58 @@ def make_converter(settings):
                                   "created directory: " + out_dir)
         # Now we're going to spawn the stages. Need to do final token
         # substitution and then build a list of spawned processes.
-        var_table = {'sound_name': sound_name, 'write_to': "%write_to%"}
+        var_table = {'sound_name': sound_name, 'write_to': "%write_to%",
+                     'sound_input': "%sound_input%",
+                     'sound_index': "%sound_index%"}
+        # If the same data has already been through the same command, fill in
+        # this sound's output files from that sound's output files.
+        if converted is not None:
+            sound_hash = stream_hash(orig_stream, command_id)
+            out_paths = [stage_templates[stage][i].fill(var_table)
+                         for (stage, i) in output_elements]
+            if sound_hash in converted:
+                (earlier_paths, earlier_conversion) = converted[sound_hash]
+                # Only reuse the output of a conversion that worked; if the
+                # earlier one failed, convert this sound as usual.
+                if (earlier_conversion is None or
+                        earlier_conversion.succeeded()):
+                    earlier = [(src, dst)
+                               for (src, dst) in zip(earlier_paths, out_paths)
+                               if src != dst and os.path.isfile(src)]
+                    if earlier:
+                        for (src, dst) in earlier:
+                            fill_output(src, dst, dedup_method)
+                        verbose_print("    (same as an earlier sound)")
+                        return True
+            orig_stream.seek(0)
+        # For a batched command, stage the sound data in a file and add the
+        # sound to the open batch. Start the batch once it is full; expak
+        # starts a partly-filled one when it collects the results.
+        if batched:
+            if not open_batch or open_batch[0].conversion is not None:
+                open_batch[:] = [Batch(run_batch)]
+            batch = open_batch[0]
+            (fd, input_path) = tempfile.mkstemp(suffix=".wav", dir=staging_dir)
+            with os.fdopen(fd, 'wb') as outstream:
+                expak.copy_resource(orig_stream, outstream)
+            member = batch.add(sound_name, input_path)
+            if len(batch.members) >= batch_size:
+                while len(running) >= jobs:
+                    running.popleft().wait()
+                batch.start()
+                running.append(batch)
+            if converted is not None:
+                converted[sound_hash] = (out_paths, member)
+            return member
+        # Don't have more than the allowed number of conversions going.
+        while len(running) >= jobs:
+            running.popleft().wait()
+        # Collect the stderr output of the stages if conversions overlap.
+        err_files = []
         passthru_filename = None
         p_chain = []
         for stage in range(num_stages):
-            stage_args = [settings.eval_finalize(converter_key, a, var_table)
-                          for a in command_stages[stage]]
+            stage_args = [t.fill(var_table) for t in stage_templates[stage]]
             # Use of the %write_to% command makes this the last stage, and
             # means that we won't handle it like other stages.
             if stage_args[0] == "%write_to%":
@@ -267,60 +1313,213 @@ def make_converter(settings):
             # is special because no one cares about its stdout.
             stage_stdin = p_chain[-1].stdout if p_chain else subprocess.PIPE
             stage_stdout = subprocess.PIPE if (stage + 1 < num_stages) else None
-            p = subprocess.Popen(stage_args, stdin=stage_stdin, stdout=stage_stdout)
+            stage_stderr = None
+            if jobs > 1:
+                stage_stderr = tempfile.TemporaryFile()
+                err_files.append(stage_stderr)
+            p = subprocess.Popen(stage_args, stdin=stage_stdin,
+                                 stdout=stage_stdout, stderr=stage_stderr)
             p_chain.append(p)
         # OK we built our chain of processes. Unless the very first stage
         # used "%write_to%", the process chain will have something in it.
         if p_chain:
-            # Launch the thread to handle a final "%write_to%"" stage if there
-            # is one.
+            # A final "%write_to%" stage, if there is one, is handled by the
+            # pipe pump or else by a thread of its own.
+            pump = process_pump()
+            drain = None
             writer_thread = None
             if passthru_filename:
-                writer_thread = threading.Thread(target=writer_func,
-                                                 args=(p_chain[-1].stdout,
-                                                       passthru_filename))
-                writer_thread.start()
+                if pump is not None:
+                    drain = pump.drain(p_chain[-1].stdout, passthru_filename)
+                else:
+                    writer_thread = threading.Thread(target=writer_func,
+                                                     args=(p_chain[-1].stdout,
+                                                           passthru_filename))
+                    writer_thread.start()
             # We don't need the file objects that were created to wrap the
             # stdout file descriptors of the non-terminal stages of the chain,
             # so go ahead and close them now. We don't close the last one
-            # because it is either None, or used by the write-to thread.
+            # because it is either None, or used by the drain or thread.
             for p in p_chain[:-1]:
                 p.stdout.close()
+            conversion = Conversion(p_chain, err_files, pump, drain,
+                                    writer_thread)
             # Pump the sound data into the first stage of the chain and flush.
-            p_chain[0].stdin.write(orig_data)
-            p_chain[0].stdin.close()
-            # Wait for the last stage in the chain to finish before we leave
-            # and garbage-collect objects.
-            if writer_thread:
-                writer_thread.join()
+            # Where possible expak moves it straight from the pak file into
+            # the pipe, without it passing through here. With the pipe pump,
+            # the other running chains keep moving while this one is fed.
+            if pump is not None:
+                feed = pump.feed(orig_stream, p_chain[0].stdin)
+                pump.run_until([feed])
+                if feed.error is not None:
+                    # Let the rest of the chain wind down, and pass along
+                    # whatever it had to say about the problem.
+                    try:
+                        conversion.result()
+                    except (IOError, OSError):
+                        pass
+                    raise feed.error
             else:
-                p_chain[-1].wait()
+                expak.copy_resource(orig_stream, p_chain[0].stdin)
+                p_chain[0].stdin.close()
         else:
             # As the code currently stands, an empty process chain means
             # that the one and only stage is "%write_to%". But just to be
             # robust against future weirdness, we'll check to make sure that
             # there indeed was a "%write_to%" command.
             if passthru_filename:
-                # We can handle this in-thread without spawning anything.
+                # We can handle this in-thread without spawning anything, and
+                # expak can copy straight from the pak file to the output
+                # file.
                 with open(passthru_filename, 'wb') as outstream:
-                    outstream.write(orig_data)
-        # This converter always returns True if it doesn't encounter an
+                    expak.copy_resource(orig_stream, outstream)
+            conversion = None
+        if converted is not None:
+            converted[sound_hash] = (out_paths, conversion)
+        # If conversions can overlap, let this one run while we move on to
+        # the next sound. Otherwise wait for the last stage in the chain to
+        # finish before we leave and garbage-collect objects.
+        if conversion is not None:
+            if jobs > 1:
+                running.append(conversion)
+                return conversion
+            return conversion.result()
+        # A lone "%write_to%" stage always works if it doesn't encounter an
         # exception.
         return True
     return converter
 
-def go(settings, targets_table):
+def is_selector(target):
+    """Check whether a targets table entry is a pattern rather than a name.
+
+    :param target: key from the targets table
+    :type target:  str
+
+    :returns: whether the entry is a glob pattern or regular expression
+    :rtype:   bool
+
+    """
+    if target.startswith(REGEX_PREFIX):
+        return True
+    for c in GLOB_CHARS:
+        if c in target:
+            return True
+    return False
+
+def make_selector(targets_table, default_func):
+    """Move the pattern entries of the targets table into a selector.
+
+    A key that starts with :const:`REGEX_PREFIX` is a regular expression
+    (without that prefix); otherwise a key containing any of
+    :const:`GLOB_CHARS` is a glob pattern. The value of such an entry is a
+    template for the new names of the sounds that it selects, or empty to
+    give each sound its default name.
+
+    When more than one pattern selects a sound, the one with the longest
+    literal beginning (the part before any wildcard) names it, so that for
+    example "sound/weapons/*.wav" overrides "sound/**". A sound that is named
+    in the targets table outright is never renamed by a pattern.
+
+    :param targets_table: table mapping sound selections to output names;
+                          pattern entries are removed from it
+    :type targets_table:  dict(str,str)
+    :param default_func:  function to produce the default name for a sound
+    :type default_func:   function(str)
+
+    :returns: selector for the pattern entries, None if there are none, or
+              False if a regular expression or name template is invalid
+    :rtype:   :class:`expak.NameSelector` or None or bool
+
+    """
+    patterns = []
+    for target in list(targets_table):
+        if not is_selector(target):
+            continue
+        template = targets_table.pop(target) or None
+        if target.startswith(REGEX_PREFIX):
+            patterns.append(('regex', target[len(REGEX_PREFIX):], template))
+        else:
+            patterns.append(('glob', target, template))
+    if not patterns:
+        return None
+    patterns.sort(key=lambda p: (-len(expak.literal_prefix(p[0], p[1])),
+                                 p[1], p[0]))
+    for (kind, pattern, template) in patterns:
+        verbose_print("targets pattern: {0} ({1})".format(pattern, kind))
+    try:
+        return expak.NameSelector(patterns, default_func)
+    except re.error as e:
+        sys.stderr.write("Error: invalid targets table entry: "
+                         "{0}\n".format(e))
+        return False
+
+def converter_jobs(settings):
+    """Get the number of converter command chains that may run at once.
+
+    The jobs setting is the number of chains; 0 means one per CPU. If the
+    setting is undefined, use just one (i.e. convert one sound at a time).
+
+    :param settings: settings
+    :type settings:  :class:`config.Settings`
+
+    :returns: number of chains
+    :rtype:   int
+
+    :raises config.BadValue: if jobs is not a non-negative integer
+
+    """
+    jobs = settings.optional_int('jobs', 1)
+    if jobs == 0:
+        try:
+            jobs = multiprocessing.cpu_count()
+        except NotImplementedError:
+            jobs = 1
+    return jobs
+
+def pak_workers(settings):
+    """Get the number of worker processes to use for reading pak files.
+
+    The pak_workers setting is the number of workers; 0 means to use one per
+    CPU. If the setting is undefined, use just one (i.e. no pool of workers).
+
+    :param settings: settings
+    :type settings:  :class:`config.Settings`
+
+    :returns: number of workers
+    :rtype:   int
+
+    :raises config.BadValue: if pak_workers is not a non-negative integer
+
+    """
+    workers = settings.optional_int('pak_workers', 1)
+    if workers == 0:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return workers
+
+def go(settings, targets_table, selector=None):
     """Process according to the given settings and sound selections.
 
-    Get the pak file paths from the settings. Get and apply the working
-    directory from the settings. Get the converter definition from the
-    settings and define a converter function. Process each pak file using
-    :func:`expak.process_resources`.
+    Get the pak file paths from the settings. Apply the pak index cache
+    directory and pak catalog (if any) from the settings. Get and apply the
+    working directory from the settings. Get the converter definition from
+    the settings and define a converter function. Process the pak files using
+    :func:`expak.process_resources`, taking each sound from the pak file
+    chosen by the pak_precedence setting, either in this process or (if the
+    pak_workers setting asks for more than one worker) with a pool of worker
+    processes.
+
+    If there is a selector for the pattern entries of the targets table, first
+    add the sounds that it selects from the pak files to the targets table.
 
     :param settings:      settings
     :type settings:       :class:`config.Settings`
     :param targets_table: table mapping sound selections to output names
     :type targets_table:  dict(str,str)
+    :param selector:      selector made by :func:`make_selector`, or None
+    :type selector:       :class:`expak.NameSelector` or None
 
     :returns: False if the converter definition is invalid, True otherwise
     :rtype:   bool
@@ -331,6 +1530,9 @@ def go(settings, targets_table):
     :raises config.TooManySubstitutions: if token substitution goes on for
                                          too many iterations
 
+    :raises config.BadValue: if pak_workers is not a non-negative integer, or
+                             pak_precedence is not "first" or "last"
+
     """
     # Get the paths of pak files to process.
     pak_paths_prep = settings.eval_prep('pak_paths').split(",")
@@ -341,17 +1543,62 @@ def go(settings, targets_table):
         abs_pak_paths = [os.path.join(pak_home, p) for p in pak_paths if p]
     else:
         abs_pak_paths = [os.path.abspath(p) for p in pak_paths if p]
+    # Enable the expak file table cache if requested.
+    if settings.is_defined('index_cache_dir'):
+        expak.index_cache_dir = os.path.abspath(settings.eval('index_cache_dir'))
+        verbose_print("pak index cache directory is " + expak.index_cache_dir)
+    catalog_path = None
+    if settings.is_defined('catalog_path'):
+        catalog_path = os.path.abspath(settings.eval('catalog_path'))
     # Change to the defined working directory.
     set_working_dir(settings)
     # Make the converter function.
     converter = make_converter(settings)
     if not converter:
         return False
-    # Process each pak file.
-    for path in abs_pak_paths:
+    # Our converter function is done with the sound data by the time it
+    # returns, so it can stream directly from the memory-mapped pak file.
+    # Unless the settings tell us not to, e.g. for pak files on a filesystem
+    # that doesn't map well.
+    expak.use_mmap = not settings.optional_bool('skip_pak_mmap')
+    # Match sound names the way Quake does, if requested.
+    expak.normalize_names = settings.optional_bool('normalize_names')
+    # Process the pak files. By default a sound found in more than one pak
+    # file is taken from the last one, the same as in Quake.
+    precedence = settings.optional_choice('pak_precedence',
+                                          expak.PRECEDENCE_RULES, 'last')
+    workers = pak_workers(settings)
+    catalog = None
+    if catalog_path is not None:
         verbose_print("")
-        verbose_print("reading pak file {0}...".format(path))
-        expak.process_resources(path, converter, targets_table)
+        verbose_print("updating pak catalog " + catalog_path)
+        catalog = expak.PakCatalog(catalog_path)
+        for pak_path in catalog.update(abs_pak_paths, workers):
+            verbose_print("    cataloged " + pak_path)
+    if selector is not None:
+        verbose_print("")
+        verbose_print("matching {0} targets patterns...".format(len(selector)))
+        selected = expak.select_resources(abs_pak_paths, selector, catalog)
+        added = 0
+        for sound in selected:
+            if sound not in targets_table:
+                targets_table[sound] = selected[sound]
+                added += 1
+        verbose_print("    selected {0} more sounds".format(added))
+    verbose_print("")
+    if workers > 1 and len(abs_pak_paths) > 1:
+        verbose_print("reading {0} pak files with {1} workers...".format(
+            len(abs_pak_paths), workers))
+    else:
+        verbose_print("reading pak files {0}...".format(
+            ", ".join(abs_pak_paths)))
+        workers = None
+    try:
+        expak.process_resources(abs_pak_paths, converter, targets_table,
+                                workers, precedence, catalog)
+    finally:
+        if catalog is not None:
+            catalog.close()
     verbose_print("")
     return True
 